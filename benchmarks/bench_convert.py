@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+"""
+Benchmark preparing downloaded photos for several frame profiles (landscape frames of 3 sizes).
+
+usage: benchmarks/bench_convert.py [photos]
+
+legacy: photo_convert.convert_photo for each profile (each photo is decoded once per profile)
+current: photo_convert.render_photo for all the profiles at once (each photo is decoded once)
+"""
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils import photo_convert  # noqa: E402
+
+
+def legacy_convert(source, profiles, folder):
+    for profile in profiles:
+        photo_convert.convert_photo(source, os.path.join(folder, profile.name + ".jpg"), profile.aspect, profile.size)
+
+
+def current_convert(source, profiles, folder):
+    photo_convert.render_photo(source, [(profile, os.path.join(folder, profile.name + ".jpg")) for profile in profiles])
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    with tempfile.TemporaryDirectory() as folder:
+        # 12 MP photos, as taken by a phone
+        sources = []
+        for i in range(count):
+            source = os.path.join(folder, "IMG_%04d.JPG" % i)
+            Image.effect_noise((4032, 3024), 40 + i).convert("RGB").save(source, quality=90)
+            sources.append(source)
+
+        profiles = [photo_convert.create_frame_profile("1080p", folder, size=(1920, 1080)),
+                    photo_convert.create_frame_profile("pi-landscape", folder, size=(800, 480)),
+                    photo_convert.create_frame_profile("square", folder, size=(400, 400))]
+
+        for mode, convert in (("legacy", legacy_convert), ("current", current_convert)):
+            start = time.perf_counter()
+            for source in sources:
+                convert(source, profiles, folder)
+            elapsed = time.perf_counter() - start
+            print("%s: %d photos for %d profiles in %.2f s (%.2f originals/s)" % (mode, count, len(profiles),
+                                                                                 elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
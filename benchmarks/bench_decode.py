@@ -0,0 +1,101 @@
+#! /usr/bin/env python3
+"""
+Benchmark the time and memory needed to prepare a camera-sized photo for the frame.
+
+usage: benchmarks/bench_decode.py {legacy|current} [repeat]
+
+Each mode should be run in a separate process so the peak RSS reported is for that mode only.
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtGui import QGuiApplication, QImage
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from gui import image_loader  # noqa: E402
+from gui.image_loader import RenderSettings  # noqa: E402
+from utils import photo_utils  # noqa: E402
+
+PHOTO_SIZE = (4032, 3024)  # 12MP camera
+FRAME = RenderSettings(800, 480, 0, False)  # official Pi display, landscape, fixed compass
+
+
+def create_photo(filename):
+    """
+    Create a noisy 12MP JPEG (noise stops the JPEG encoder from compressing it down to nothing).
+    Run in a child process so the memory used to create the photo is not included in the results.
+    """
+    _app = QGuiApplication([])
+    image = QImage(PHOTO_SIZE[0], PHOTO_SIZE[1], QImage.Format_RGB32)
+    image.fill(QtGui.QColor(40, 120, 200))
+    noise = os.urandom(PHOTO_SIZE[0] * 16 * 4)
+    tile = QImage(noise, PHOTO_SIZE[0], 16, QImage.Format_RGB32)
+    painter = QtGui.QPainter(image)
+    painter.setOpacity(0.3)
+    for y in range(0, PHOTO_SIZE[1], 16):
+        painter.drawImage(0, y, tile)
+    painter.end()
+    image.save(filename, "JPEG", 90)
+
+
+def legacy_prepare(image_filename, settings, watermark):
+    """
+    The original display path: 2 full decodes, full-size pixmap, 3 rotations and a smooth scale
+    """
+    exif_orientation = photo_utils.get_file_exif_orientation(image_filename)
+    image = QImage(image_filename)
+    photo_utils.is_portrait(image.width(), image.height())
+    angle = -settings.frame_rotation
+
+    image = QtGui.QImage(image_filename)
+    pmap = QtGui.QPixmap.fromImage(image)
+    pmap = pmap.transformed(QtGui.QTransform().rotate(angle)).scaled(
+        QtCore.QSize(settings.width, settings.height), QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+    pmap = pmap.transformed(QtGui.QTransform().rotate(-angle))
+    image_loader.paint_watermark(pmap, watermark)
+    pmap = pmap.transformed(QtGui.QTransform().rotate(angle))
+    return exif_orientation, pmap
+
+
+def current_prepare(image_filename, settings, watermark):
+    photo = image_loader.prepare_photo(image_filename, settings, watermark)
+    return QtGui.QPixmap.fromImage(photo.image)
+
+
+def main():
+    mode = sys.argv[1] if len(sys.argv) > 1 else "current"
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    prepare = {"legacy": legacy_prepare, "current": current_prepare}[mode]
+
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, "photo.jpg")
+        child = multiprocessing.Process(target=create_photo, args=(filename,))
+        child.start()
+        child.join()
+
+        _app = QGuiApplication(sys.argv)
+        logo = QImage(os.path.join(os.path.dirname(__file__), "..", "logo.png")).scaledToWidth(50)
+        watermark = logo if mode == "legacy" else image_loader.Watermark(logo)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            prepare(filename, FRAME, watermark)
+            timings.append(time.perf_counter() - start)
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings.sort()
+    print("%s: %dx%d -> %dx%d, median %.1f ms/slide (min %.1f ms), peak RSS %.1f MB (+%.1f MB for decoding)" % (
+        mode, PHOTO_SIZE[0], PHOTO_SIZE[1], FRAME.width, FRAME.height,
+        timings[len(timings) // 2] * 1000, timings[0] * 1000, rss_after / 1024, (rss_after - rss_before) / 1024))
+
+
+if __name__ == '__main__':
+    main()
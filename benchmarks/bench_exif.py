@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+"""
+Benchmark reading the EXIF tags used by the frame (orientation, date taken, GPS location).
+
+usage: benchmarks/bench_exif.py [folder] [repeat]
+
+exifread: exifread.process_file(details=False), parsing every tag in the file
+current: exif_reader.read_exif, reading only the tags needed from the start of the file
+
+Without a folder, a corpus of synthetic photos is used: camera JPEGs (with a large maker note and a thumbnail) and
+HEIC-converted JPEGs (with JFIF, XMP and ICC profile segments before the EXIF data).
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+
+import exifread
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils import exif_reader  # noqa: E402
+
+PHOTO_SIZE = (2000, 1500)
+SYNTHETIC_COUNT = 20  # of each kind
+
+
+def make_exif(index):
+    exif = Image.Exif()
+    exif[0x010F] = "Camera maker"
+    exif[0x0110] = "Camera model %d" % index
+    exif[0x0112] = (1, 3, 6, 8)[index % 4]
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x9003] = "2021:05:%02d 10:%02d:00" % (index % 28 + 1, index % 60)
+    exif_ifd[0x927C] = bytes(i % 256 for i in range(40000))  # maker note
+    gps_ifd = exif.get_ifd(0x8825)
+    gps_ifd[1] = "N"
+    gps_ifd[2] = (51.0, 30.0, index / 10)
+    gps_ifd[3] = "W"
+    gps_ifd[4] = (0.0, 7.0, 39.0)
+    return exif
+
+
+def make_corpus(folder):
+    image = Image.effect_noise(PHOTO_SIZE, 60).convert("RGB")
+    thumbnail = io.BytesIO()
+    image.resize((160, 120)).save(thumbnail, "JPEG")
+    icc_profile = bytes(range(256)) * 12
+    xmp = b"<x:xmpmeta xmlns:x='adobe:ns:meta/'>" + b" " * 4000 + b"</x:xmpmeta>"
+
+    filenames = []
+    for index in range(SYNTHETIC_COUNT):
+        exif = make_exif(index)
+        camera = os.path.join(folder, "camera_%02d.jpg" % index)
+        # the thumbnail follows the EXIF data, as in photos from cameras
+        exif_data = exif.tobytes() + thumbnail.getvalue()
+        image.save(camera, "JPEG", exif=exif_data, quality=90)
+        converted = os.path.join(folder, "converted_%02d.jpg" % index)
+        image.save(converted, "JPEG", exif=exif.tobytes(), icc_profile=icc_profile, xmp=xmp, quality=90)
+        filenames += [camera, converted]
+    return filenames
+
+
+def read_with_exifread(filename):
+    with open(filename, "rb") as f:
+        return exifread.process_file(f, details=False)
+
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else None
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if folder:
+            filenames = sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                               if not name.startswith(".") and os.path.isfile(os.path.join(folder, name)))
+        else:
+            filenames = make_corpus(tmp)
+
+        differences = [f for f in filenames if exif_reader.read_exif(f) != exif_reader.read_exif_with_exifread(f)]
+        if differences:
+            print("different tags read from %d photos: %s" % (len(differences), ", ".join(differences[:5])))
+
+        for mode, read in (("exifread", read_with_exifread), ("current", exif_reader.read_exif)):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for filename in filenames:
+                    read(filename)
+                timings.append(time.perf_counter() - start)
+
+            best = min(timings)
+            print("%s: %d photos, %.3f ms/photo (%.0f photos/s)" % (
+                mode, len(filenames), best * 1000 / len(filenames), len(filenames) / best))
+
+
+if __name__ == '__main__':
+    main()
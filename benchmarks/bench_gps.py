@@ -0,0 +1,44 @@
+#! /usr/bin/env python3
+"""
+Benchmark converting the GPS locations of a photo library from DMS form to decimal degrees.
+
+usage: benchmarks/bench_gps.py [photos]
+
+legacy: photo_utils.gps_dms_to_dd for each photo (formats the location as a string, parsed by geopy)
+current: photo_utils.gps_dms_to_dd_array for all the photos at once (numpy)
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils import photo_utils  # noqa: E402
+
+
+def legacy_convert(gps_values):
+    return [photo_utils.gps_dms_to_dd(*gps)[:2] for gps in gps_values]
+
+
+def current_convert(gps_values):
+    return photo_utils.gps_dms_to_dd_array(gps_values)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    rng = random.Random(1)
+    gps_values = [(rng.randint(0, 89), rng.randint(0, 59), rng.randint(0, 5999) / 100, rng.choice("NS"),
+                   rng.randint(0, 179), rng.randint(0, 59), rng.randint(0, 5999) / 100, rng.choice("EW"))
+                  for _ in range(count)]
+
+    for mode, convert in (("legacy", legacy_convert), ("current", current_convert)):
+        start = time.perf_counter()
+        convert(gps_values)
+        elapsed = time.perf_counter() - start
+        print("%s: %d photos in %.3f s (%.0f photos/s)" % (mode, count, elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
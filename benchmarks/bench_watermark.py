@@ -0,0 +1,62 @@
+#! /usr/bin/env python3
+"""
+Benchmark the cost of adding the watermark to a frame-ready photo on a rotated frame.
+
+usage: benchmarks/bench_watermark.py [repeat]
+
+legacy: rotate the photo back upright, paint the logo, rotate the photo again (2 full-frame transforms)
+current: paint the logo, pre-rotated for the quadrant, directly on the rotated photo
+"""
+import os
+import sys
+import time
+
+from PyQt5 import QtGui
+from PyQt5.QtGui import QGuiApplication, QImage
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from gui import image_loader  # noqa: E402
+
+FRAME_SIZE = (800, 480)  # official Pi display
+ANGLE = -90  # frame rotated into portrait mode
+
+
+def legacy_paint(image, logo, _unused_watermark):
+    image = image.transformed(QtGui.QTransform().rotate(-ANGLE))
+    image_loader.paint_watermark(image, logo)
+    return image.transformed(QtGui.QTransform().rotate(ANGLE))
+
+
+def current_paint(image, _unused_logo, watermark):
+    watermark.paint(image, ANGLE)
+    return image
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    _app = QGuiApplication(sys.argv)
+    logo = QImage(os.path.join(os.path.dirname(__file__), "..", "logo.png")).scaledToWidth(50)
+    watermark = image_loader.Watermark(logo)
+
+    # a portrait photo already rotated and scaled to fill the frame
+    image = QImage(FRAME_SIZE[0], FRAME_SIZE[1], QImage.Format_RGB32)
+    image.fill(QtGui.QColor(40, 120, 200))
+
+    for mode, paint in (("legacy", legacy_paint), ("current", current_paint)):
+        timings = []
+        for _ in range(repeat):
+            photo = QImage(image)
+            photo.detach()
+            start = time.perf_counter()
+            paint(photo, logo, watermark)
+            timings.append(time.perf_counter() - start)
+
+        timings.sort()
+        print("%s: %dx%d frame, median %.3f ms/slide (min %.3f ms)" % (
+            mode, FRAME_SIZE[0], FRAME_SIZE[1], timings[len(timings) // 2] * 1000, timings[0] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,20 @@
 #! /usr/bin/env python3
 
 import argparse
+import itertools
 import logging.config
+import os
 import sys
+import time
 
 import yaml
 
-from network.icloud_photos import IcloudPhotos
-from utils import photo_utils
+from network.album_cache import AlbumCache
+from network.icloud_photos import ALBUM_REFRESH_DAYS, IcloudPhotos
+from network.sync_manifest import SyncManifest
+from network.sync_pipeline import QUEUE_SIZE, SyncPipeline
+from utils import photo_convert, photo_utils
+from utils.config import Config
 
 LOG_CONFIG = "logging.yml"
 with open(LOG_CONFIG, 'rt') as f:
@@ -26,36 +33,136 @@ def main():
     parser.add_argument("password", help="password")
     parser.add_argument("--output", help="folder to store downloaded network", default="tmp/raw")
     parser.add_argument("--sample", help="number of network to download", type=int, default=5)
+    parser.add_argument("--first", help="download the first photos in the album instead of a random sample (faster: "
+                                        "the rest of the album is not read)", action='store_true', default=False)
     parser.add_argument("--album", help="icloud album to find network", default="All Photos")
     parser.add_argument("--orientation", help="orientation of network", choices=["portrait", "landscape"],
                         default=None)
     parser.add_argument("--list", help="list albums (no photo downloading)", action='store_true', default=False)
+    parser.add_argument("--workers", help="number of photos downloaded at once", type=int, default=4)
+    parser.add_argument("--manifest", help="record of the photos already downloaded (default: .sync_manifest.db in "
+                                           "the output folder)", default=None)
+    parser.add_argument("--cache", help="cache of the album contents (default: .album_cache.db in the output folder)",
+                        default=None)
+    parser.add_argument("--refresh-days", help="days before the whole album is read again (new photos are read on "
+                                               "every run)", type=float, default=ALBUM_REFRESH_DAYS)
+    parser.add_argument("--prune", help="delete downloaded (and converted) photos that are no longer in the album "
+                                        "(or in any other album synced to the output folder)", action='store_true',
+                        default=False)
+    parser.add_argument("--profile", help="frame profile (in the config file) to prepare the photos for: rotated, "
+                                          "cropped, scaled and saved as JPEG (can be repeated; 'all' for every "
+                                          "profile)", action="append", default=[])
+    parser.add_argument("--config", help="config file with the frame profiles", default="config.yml")
+    parser.add_argument("--convert-to", help="folder to save the photos prepared for a frame not in the config file "
+                                             "(with --aspect and/or --size)", default=None)
+    parser.add_argument("--aspect", help="aspect ratio of the frame e.g. 16:9 (default: from --size)", default=None)
+    parser.add_argument("--size", help="resolution of the frame e.g. 800x480 (default: photos are not scaled down)",
+                        default=None)
+    parser.add_argument("--convert-workers", help="number of processes converting photos (default: number of CPUs)",
+                        type=int, default=None)
+    parser.add_argument("--queue-size", help="number of photos waiting to be downloaded/converted", type=int,
+                        default=QUEUE_SIZE)
+    parser.add_argument("--delete-originals", help="delete the downloaded photos once converted for every profile "
+                                                   "(less disk space, but photos are downloaded again for a new "
+                                                   "profile)", action='store_true', default=False)
     args = parser.parse_args()
     print(args)
 
+    try:
+        profiles = []
+        if args.profile:
+            names = None if "all" in args.profile else args.profile
+            profiles = photo_convert.get_frame_profiles(Config(args.config), names)
+        if args.convert_to:
+            profiles.append(photo_convert.create_frame_profile(
+                "--convert-to", args.convert_to, photo_convert.parse_aspect(args.aspect) if args.aspect else None,
+                photo_convert.parse_size(args.size) if args.size else None, args.orientation))
+        if args.delete_originals and not profiles:
+            raise ValueError("--delete-originals needs a frame profile (--profile or --convert-to)")
+    except (KeyError, ValueError) as exception:
+        parser.error(str(exception))
+
+    # download photos for every frame (e.g. a landscape and a portrait frame need both)
+    orientation = args.orientation or photo_convert.get_download_orientation(profiles)
+
     api = IcloudPhotos(args.user, args.password)
+    album_cache = AlbumCache(args.cache or os.path.join(args.output, ".album_cache.db"))
 
     if args.list:
         print("Albums:")
         albums = api.get_albums()
+        cached_albums = {album.name: album for album in album_cache.get_albums()}
         for album in albums:
-            print(album)
+            if album in cached_albums:
+                print("%s (%d photos cached)" % (album, cached_albums[album].item_count))
+            else:
+                print(album)
         sys.exit(1)
 
+    # a random sample (or the first photos) of the photo frame album, read from the album cache in one pass
+    # (only the sample is kept in memory)
+    manifest = SyncManifest(args.manifest or os.path.join(args.output, ".sync_manifest.db"))
+    photo_count = 0
+
+    def count_photos(photos):
+        nonlocal photo_count
+        for photo in photos:
+            photo_count += 1
+            yield photo
+
     try:
-        # get all network in the photo frame album
-        logger.info("Downloading photo list...")
-        photos = api.get_all_photos(args.album, args.orientation)
+        listed = time.time()
+        logger.info("Read %d photos from the icloud", api.refresh_album(album_cache, args.album,
+                                                                        args.refresh_days * 24 * 3600))
+        logger.info("Selecting %s %d photos...", "first" if args.first else "random sample of", args.sample)
+        photos = count_photos(api.iter_cached_photos(album_cache, args.album, orientation))
+        if args.first:
+            photos_sample = list(itertools.islice(photos, args.sample))
+        else:
+            photos_sample = photo_utils.get_stream_sample(photos, args.sample)
     except KeyError as exception:
         print("Could not find album: ", exception)
         sys.exit(1)
+    logger.info("Selected %d photos from %d", len(photos_sample), photo_count)
+
+    # record every photo of the album (not only the photos of this orientation/type), so the photos downloaded to
+    # the folder by other syncs are only pruned once they are in none of the albums
+    album_ids = album_cache.get_asset_ids(args.album)
+    manifest.mark_seen(args.album, album_ids, listed)
 
-    # get a random sample to download
-    logger.info("Selecting random sample (%d from %d)", args.sample, len(photos))
-    photos_sample = photo_utils.get_sample(photos, args.sample)
+    # an empty album is more likely to be an error
+    if args.prune and album_ids:
+        logger.info("Removed %d photos no longer in the album",
+                    manifest.prune(args.album, listed, [profile.output for profile in profiles]))
 
+    # download the photos and convert them for the frames at the same time (the download links of the cached photos
+    # may have expired, so the photos are looked up again as they go)
     logger.info("Downloading photos to %s...", args.output)
-    IcloudPhotos.download(photos_sample, args.output)
+    pipeline = SyncPipeline(args.output, profiles, manifest, api.get_current_photos, args.workers,
+                            args.convert_workers, args.queue_size, not args.delete_originals)
+    try:
+        result = pipeline.run(photos_sample, len(photos_sample))
+    except KeyboardInterrupt:
+        logger.warning("Sync interrupted")
+        sys.exit(130)
+    logger.info("%d photos (%s bytes) downloaded in total", *manifest.get_stats())
+
+    convert_failed = result.failed_conversions
+    if profiles and not args.delete_originals:
+        # convert the photos downloaded by earlier runs but not converted yet (e.g. for a new profile)
+        conversions = photo_convert.get_conversions(args.output, profiles)
+        if conversions:
+            logger.info("Converting %d more photos for %s...", len(conversions),
+                        ", ".join(profile.name for profile in profiles))
+            results = photo_convert.convert_photos(conversions, workers=args.convert_workers)
+            convert_failed = [result for result in results if result.error]
+    if convert_failed:
+        logger.error("Could not convert %d photos", len(convert_failed))
+
+    if result.failed_downloads:
+        logger.error("Could not download %d photos", len(result.failed_downloads))
+    if result.failed_downloads or convert_failed:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -128,11 +128,15 @@ class FrameDashboard(PhotoFrameContent):
         self.machine_text.setText(summary_text)
 
     def _update_frame_summary(self):
+        geo_cache_entries, geo_cache_bytes = self.photo_frame.geo_cache.get_stats()
         summary_entries = [
             "<b>Number of players:</b> %d" % len(self.photo_frame.players),
             "<b>Slideshow delay:</b> %d" % self.photo_frame.slideshow_delay,
             "<b>Root folder:</b> %s" % self.photo_frame.root_folder,
-            "<b>Flip rotation:</b> %s" % self.photo_frame.flip_rotation
+            "<b>Flip rotation:</b> %s" % self.photo_frame.flip_rotation,
+            "<b>Photo cache:</b> %s" % self.photo_frame.pixmap_cache.get_stats(),
+            "<b>Catalog:</b> %d files (%d with GPS)" % self.photo_frame.catalog.get_stats(),
+            "<b>Geo cache:</b> %d entries (%s)" % (geo_cache_entries, size(geo_cache_bytes))
         ]
 
         if self.photo_frame.compass:
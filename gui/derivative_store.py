@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+
+from PyQt5.QtGui import QImage, QImageWriter
+
+logger = logging.getLogger(__name__)
+
+
+class DerivativeStore:
+    """
+    Persistent cache of frame-ready copies of the photos (rotated, scaled and watermarked), so the original
+    camera photos only need to be decoded once.
+
+    Copies are stored as <folder>/<width>x<height>/<render settings>/<hash of photo path>.jpg (the render settings
+    folder names every RenderSettings field, e.g. 800x480-90-portrait) and carry the modification time of the original
+    photo, so a copy is only used if the original has not changed since it was made.
+    Copies made for other screen sizes are removed when the store is opened.
+    """
+
+    def __init__(self, folder: str, width: int, height: int, quality: int = 90):
+        """
+        Open the store for a given screen size.
+
+        :param folder: the folder holding the copies
+        :param width: the width of the frame
+        :param height: the height of the frame
+        :param quality: JPEG quality of the copies
+        """
+        self.quality = quality
+        self._geometry = "%dx%d" % (width, height)
+        self._folder = os.path.join(folder, self._geometry)
+
+        self._builder = None
+        self._builder_stop = threading.Event()
+
+        self._remove_other_geometries(folder)
+
+    def _remove_other_geometries(self, folder):
+        if not os.path.isdir(folder):
+            return
+
+        for entry in os.listdir(folder):
+            if entry != self._geometry:
+                logger.info("Screen size changed. Removing photos prepared for %s", entry)
+                shutil.rmtree(os.path.join(folder, entry), ignore_errors=True)
+
+    def get_path(self, image_filename, settings):
+        """
+        Get the location of the copy of a photo
+
+        :param image_filename: the original photo
+        :param settings: the RenderSettings of the frame
+        :return: the location of the copy (may not exist)
+        """
+        key = hashlib.sha1(os.path.abspath(image_filename).encode("utf-8")).hexdigest()
+        return os.path.join(self._get_settings_folder(settings), key + ".jpg")
+
+    def _get_settings_folder(self, settings):
+        """
+        :return: the folder of the copies made with the RenderSettings (a copy is only valid for the same settings)
+        """
+        orientation = {None: "any", True: "portrait", False: "landscape"}[settings.portrait_frame]
+        return os.path.join(self._folder, "%dx%d-%d-%s" % (settings.width, settings.height, settings.frame_rotation,
+                                                           orientation))
+
+    def is_fresh(self, image_filename, settings):
+        """
+        Check if there is an up-to-date copy of a photo
+
+        :return: True if the copy exists and was made from the current version of the photo
+        """
+        try:
+            return os.stat(self.get_path(image_filename, settings)).st_mtime_ns == os.stat(image_filename).st_mtime_ns
+        except OSError:
+            return False
+
+    def load(self, image_filename, settings):
+        """
+        Load the copy of a photo
+
+        :param image_filename: the original photo
+        :param settings: the RenderSettings of the frame
+        :return: the frame-ready QImage or None if there is no up-to-date copy
+        """
+        if not self.is_fresh(image_filename, settings):
+            return None
+
+        image = QImage(self.get_path(image_filename, settings))
+        if image.isNull():
+            return None
+
+        logger.debug("Loaded prepared copy of %s", image_filename)
+        return image
+
+    def save(self, image_filename, settings, image):
+        """
+        Store the copy of a photo. The copy is written to a temporary file first, so a partial copy is never used.
+
+        :param image_filename: the original photo
+        :param settings: the RenderSettings of the frame
+        :param image: the frame-ready QImage
+        """
+        try:
+            source_mtime = os.stat(image_filename).st_mtime_ns
+        except OSError:
+            return
+
+        path = self.get_path(image_filename, settings)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = "%s.%d.tmp" % (path, threading.get_ident())
+        writer = QImageWriter(tmp_path, b"jpg")
+        writer.setQuality(self.quality)
+        if not writer.write(image):
+            logger.error("Could not store prepared copy of %s - %s", image_filename, writer.errorString())
+            return
+
+        os.utime(tmp_path, ns=(source_mtime, source_mtime))
+        os.replace(tmp_path, path)
+        logger.debug("Stored prepared copy of %s", image_filename)
+
+    def prune(self, image_filenames, settings):
+        """
+        Remove the copies of photos that are no longer in the playlists
+
+        :param image_filenames: all the photos that are still in use
+        :param settings: the RenderSettings of the frame
+        """
+        folder = self._get_settings_folder(settings)
+        if not os.path.isdir(folder):
+            return
+
+        in_use = {os.path.basename(self.get_path(f, settings)) for f in image_filenames}
+        for entry in os.listdir(folder):
+            if entry not in in_use and not entry.endswith(".tmp"):
+                logger.debug("Removing unused copy %s", entry)
+                os.remove(os.path.join(folder, entry))
+
+    def start_builder(self, image_filenames, settings, loader):
+        """
+        Prepare copies of the photos on a background thread. Any builder already running is stopped first.
+
+        :param image_filenames: the photos to prepare
+        :param settings: the RenderSettings of the frame
+        :param loader: function(filename, settings) returning a PreparedPhoto
+        """
+        self.stop_builder()
+        self._builder_stop = threading.Event()
+        self._builder = threading.Thread(target=self._build, name="derivative-builder", daemon=True,
+                                         args=(list(image_filenames), settings, loader, self._builder_stop))
+        self._builder.start()
+
+    def stop_builder(self):
+        if self._builder:
+            self._builder_stop.set()
+            self._builder = None
+
+    def _build(self, image_filenames, settings, loader, stop):
+        logger.info("Preparing copies of %d photos for %s", len(image_filenames), settings)
+        self.prune(image_filenames, settings)
+
+        built = 0
+        for image_filename in image_filenames:
+            if stop.is_set():
+                logger.info("Stopped preparing copies of photos")
+                return
+
+            if self.is_fresh(image_filename, settings):
+                continue
+
+            try:
+                photo = loader(image_filename, settings)
+            except Exception as e:  # keep going: one bad photo must not stop the whole build
+                logger.error("Error preparing %s - %s", image_filename, e)
+                continue
+
+            if photo.image is not None:
+                self.save(image_filename, settings, photo.image)
+                built += 1
+
+        logger.info("Prepared copies of %d photos", built)
@@ -0,0 +1,222 @@
+import logging
+from collections import namedtuple
+
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtCore import QRectF, QSize
+from PyQt5.QtGui import QImage, QImageReader, QPainter
+
+from utils import photo_utils
+
+logger = logging.getLogger(__name__)
+
+# everything (apart from the photo itself) that changes the way a photo is drawn on the frame
+# portrait_frame is None if the frame has no compass (i.e. any photo orientation is accepted)
+RenderSettings = namedtuple("RenderSettings", ["width", "height", "frame_rotation", "portrait_frame"])
+
+# the result of preparing a photo for display
+# image is None if the photo could not be loaded or does not match the frame orientation
+PreparedPhoto = namedtuple("PreparedPhoto", ["filename", "image", "compatible"])
+
+
+def paint_watermark(image, watermark):
+    """
+    Overlay the logo in the bottom-right corner of an image
+
+    :param image: the photo (QImage or QPixmap)
+    :param watermark: the logo
+    """
+    painter = QPainter()
+    painter.begin(image)
+    painter.drawImage(image.width() - watermark.width() - 40,
+                      image.height() - watermark.height() - 10, watermark)
+    painter.end()
+
+
+class Watermark:
+    """
+    The logo overlaid on the photos, pre-rotated for each quadrant (0, 90, 180, 270 degrees).
+    It is drawn on photos that are already rotated for the frame, so the photo is never rotated back and forth
+    just to place the logo: painting it is a single small blit.
+    """
+
+    def __init__(self, logo: QImage, right_margin: int = 40, bottom_margin: int = 10):
+        """
+        :param logo: the logo (upright)
+        :param right_margin: distance between the logo and the right edge of the (unrotated) photo
+        :param bottom_margin: distance between the logo and the bottom edge of the (unrotated) photo
+        """
+        self.right_margin = right_margin
+        self.bottom_margin = bottom_margin
+        self._logos = {angle: logo.transformed(QtGui.QTransform().rotate(angle)) for angle in (0, 90, 180, 270)}
+
+    def width(self):
+        return self._logos[0].width()
+
+    def height(self):
+        return self._logos[0].height()
+
+    def get_logo(self, angle: int = 0):
+        """
+        :param angle: the rotation (multiple of 90 degrees)
+        :return: the logo rotated by the angle
+        """
+        return self._logos[angle % 360]
+
+    def paint(self, image, angle: int = 0):
+        """
+        Overlay the logo on a photo that has been rotated by an angle.
+        The logo is placed in the bottom-right corner of the photo before it was rotated, and is rotated with it.
+
+        :param image: the rotated photo (QImage or QPixmap)
+        :param angle: the rotation applied to the photo (multiple of 90 degrees)
+        """
+        angle %= 360
+        logo = self._logos[angle]
+        unrotated = self._logos[0]
+
+        # the corner of the photo before it was rotated, mapped the same way as QImage.transformed() maps it
+        if angle % 180:
+            width, height = image.height(), image.width()
+        else:
+            width, height = image.width(), image.height()
+        rect = QRectF(width - unrotated.width() - self.right_margin, height - unrotated.height() - self.bottom_margin,
+                      unrotated.width(), unrotated.height())
+        rect = QImage.trueMatrix(QtGui.QTransform().rotate(angle), width, height).mapRect(rect)
+
+        painter = QPainter()
+        painter.begin(image)
+        painter.drawImage(round(rect.left()), round(rect.top()), logo)
+        painter.end()
+
+
+def get_fit_size(width, height, max_width, max_height):
+    """
+    Get the size of an image scaled to fit inside a box, keeping the aspect ratio.
+
+    :return: width, height
+    """
+    factor = min(max_width / width, max_height / height)
+    return max(1, round(width * factor)), max(1, round(height * factor))
+
+
+def _is_frame_orientation(width, height, exif_orientation, settings):
+    """
+    :return: True if a photo (width x height as stored) has the same orientation as the frame
+    """
+    if exif_orientation:
+        is_portrait_image_check = photo_utils.is_portrait(width, height, exif_orientation)
+    else:
+        is_portrait_image_check = photo_utils.is_portrait(width, height)
+
+    logger.debug("Is frame in portrait mode? %s", settings.portrait_frame)
+    logger.debug("Is image in portrait mode? %s", is_portrait_image_check)
+
+    # check compatibility of frame with photo rotation (must be the same)
+    return settings.portrait_frame == is_portrait_image_check
+
+
+def is_compatible(image_filename, settings, media_info=None):
+    """
+    Check if a photo can be shown on the frame in its current orientation, without decoding it (e.g. before using a
+    copy already prepared for the frame)
+
+    :param image_filename: the location of the photo
+    :param settings: the RenderSettings of the frame
+    :param media_info: the MediaInfo of the photo from the catalog (if known, the file is not read)
+    :return: True if the photo matches the frame orientation (or the frame accepts any orientation)
+    """
+    if settings.portrait_frame is None:
+        return True
+
+    if media_info and media_info.width and media_info.height:
+        width, height, exif_orientation = media_info.width, media_info.height, media_info.orientation
+    else:
+        reader = QImageReader(image_filename)
+        reader.setAutoTransform(False)  # the size as stored, like the catalogued size
+        size = reader.size()
+        if not size.isValid():
+            return True  # reported when the photo is loaded
+        width, height = size.width(), size.height()
+        exif_orientation = media_info.orientation if media_info else \
+            photo_utils.get_file_exif_orientation(image_filename)
+    return _is_frame_orientation(width, height, exif_orientation, settings)
+
+
+def prepare_photo(image_filename, settings, watermark, media_info=None):
+    """
+    Load a photo and convert it into a frame-ready image (rotated, scaled and watermarked).
+    The photo dimensions are read from the file header, and the photo is decoded directly at the size
+    it will be shown (JPEG files are downscaled during decoding) before being rotated once.
+    Only QImage is used (not QPixmap) so this can be safely called from a worker thread.
+
+    :param image_filename: the location of the photo
+    :param settings: the RenderSettings of the frame
+    :param watermark: the Watermark to overlay on the photo (or None)
+    :param media_info: the MediaInfo of the photo from the catalog (if known, the EXIF tags are not read again)
+    :return: a PreparedPhoto
+    """
+    logger.debug("Preparing image %s", image_filename)
+    angle_to_rotate_photo = 0
+
+    reader = QImageReader(image_filename)
+    reader.setAutoTransform(False)  # rotation is handled below
+    size = reader.size()
+    if not size.isValid():
+        logger.info("Could not load image: %s", image_filename)
+        return PreparedPhoto(image_filename, None, True)
+
+    # we always need this (even to discard incompatible photos) so check now
+    if media_info:
+        exif_orientation = media_info.orientation
+    else:
+        exif_orientation = photo_utils.get_file_exif_orientation(image_filename)
+
+    # if frame rotation detection is supported, skip portrait photos if frame is in landscape mode (and vice versa)
+    if settings.portrait_frame is not None:
+        if not _is_frame_orientation(size.width(), size.height(), exif_orientation, settings):
+            logger.debug("Frame rotation does not match photo rotation. Skipping %s.", image_filename)
+            return PreparedPhoto(image_filename, None, False)
+
+        # if we get here, the photo is compatible
+
+        # rotate the photo based on the frame orientation
+        logger.debug("Frame rotated by %d", settings.frame_rotation)
+        angle_to_rotate_photo = -settings.frame_rotation
+
+    # rotate the photo based on the photo EXIF rotation
+    if exif_orientation:
+        photo_rotation = photo_utils.get_exif_rotation_angle(exif_orientation)
+        logger.debug("Photo rotated by %d", photo_rotation)
+        angle_to_rotate_photo = angle_to_rotate_photo + photo_rotation
+
+    # size of the photo once rotated and scaled to fit the frame
+    if angle_to_rotate_photo % 180:
+        height, width = get_fit_size(size.height(), size.width(), settings.width, settings.height)
+    else:
+        width, height = get_fit_size(size.width(), size.height(), settings.width, settings.height)
+
+    # only shrink while decoding: smaller photos are decoded at full size and scaled up afterwards
+    if width < size.width():
+        logger.debug("Decoding photo at %dx%d", width, height)
+        reader.setScaledSize(QSize(width, height))
+
+    image = reader.read()
+    if image.isNull():
+        logger.info("Could not load image: %s (%s)", image_filename, reader.errorString())
+        return PreparedPhoto(image_filename, None, True)
+
+    if image.width() != width or image.height() != height:
+        logger.debug("Scaling photo to %dx%d", width, height)
+        image = image.scaled(width, height, QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation)
+
+    if angle_to_rotate_photo % 360:
+        logger.debug("Rotating photo by %f", angle_to_rotate_photo)
+        image = image.transformed(QtGui.QTransform().rotate(angle_to_rotate_photo))
+
+    # add the watermark, rotated the same way as the photo
+    if watermark is not None:
+        if image.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied):
+            image = image.convertToFormat(QImage.Format_RGB32)
+        watermark.paint(image, angle_to_rotate_photo)
+
+    return PreparedPhoto(image_filename, image, True)
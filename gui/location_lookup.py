@@ -0,0 +1,134 @@
+import logging
+import threading
+
+from PyQt5 import QtCore
+from PyQt5.QtGui import QImage
+
+logger = logging.getLogger(__name__)
+
+
+class LocationLookupSignals(QtCore.QObject):
+    """
+    Signals sent by a LocationLookup (a QRunnable cannot send signals itself).
+    The first argument is the ID of the lookup, so the receiver can ignore results it no longer needs.
+    One instance is shared by all the lookups of a receiver, so it outlives the lookups (which are deleted by the
+    thread pool when they finish).
+    """
+    address_found = QtCore.pyqtSignal(int, str)
+    map_found = QtCore.pyqtSignal(int, QImage)
+
+
+class LocationLookup(QtCore.QRunnable):
+    """
+    Find the address and map of a GPS location on a worker thread (these may need slow network lookups).
+    The results are delivered to the Qt thread through signals.
+    """
+
+    def __init__(self, signals: LocationLookupSignals, lookup_id: int, latitude: float, longitude: float, get_address,
+                 get_map):
+        """
+        :param signals: used to send the results
+        :param lookup_id: ID sent with the results
+        :param latitude: latitude (decimal degrees)
+        :param longitude: longitude (decimal degrees)
+        :param get_address: function(latitude, longitude) returning the address
+        :param get_map: function(latitude, longitude) returning the map QImage (or None)
+        """
+        super().__init__()
+        self.lookup_id = lookup_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self._get_address = get_address
+        self._get_map = get_map
+        self._cancelled = threading.Event()
+        self.signals = signals
+
+    def cancel(self):
+        """
+        Stop the lookup (if it has not started yet) and do not send any more results
+        """
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self):
+        address_sent = False
+        try:
+            if self.is_cancelled():
+                return
+            address = self._get_address(self.latitude, self.longitude)
+            if self.is_cancelled():
+                return
+            self.signals.address_found.emit(self.lookup_id, address or "")
+            address_sent = True
+
+            map_image = self._get_map(self.latitude, self.longitude)
+            if self.is_cancelled():
+                return
+            self.signals.map_found.emit(self.lookup_id, map_image if map_image is not None else QImage())
+        except Exception as e:  # an error on a worker thread would otherwise be lost
+            logger.error("Error looking up location %f, %f - %s", self.latitude, self.longitude, e)
+            # send empty results, so the receiver does not keep waiting for them
+            if not address_sent:
+                self.signals.address_found.emit(self.lookup_id, "")
+            self.signals.map_found.emit(self.lookup_id, QImage())
+
+
+class LocationWarmup(QtCore.QRunnable):
+    """
+    Speculatively read the metadata, address and map of photos that are likely to be shown in the popup (the current
+    and next photos), so they are already cached when the popup is opened.
+    The warm-up runs on a low priority thread and pauses while photos are being prepared for the slideshow.
+    """
+
+    def __init__(self, filenames, get_media_info, get_address, get_map, is_busy, poll_interval: float = 0.05):
+        """
+        :param filenames: the photos, most likely to be needed first
+        :param get_media_info: function(filename) returning the MediaInfo of a photo (or None)
+        :param get_address: function(latitude, longitude) returning the address
+        :param get_map: function(latitude, longitude) returning the map
+        :param is_busy: function returning True while the warm-up should wait (e.g. photos are being decoded)
+        :param poll_interval: time (seconds) between checks of is_busy
+        """
+        super().__init__()
+        self.filenames = list(filenames)
+        self._get_media_info = get_media_info
+        self._get_address = get_address
+        self._get_map = get_map
+        self._is_busy = is_busy
+        self._poll_interval = poll_interval
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def _wait_until_idle(self):
+        """
+        :return: False if the warm-up was cancelled while waiting
+        """
+        while self._is_busy():
+            if self._cancelled.wait(self._poll_interval):
+                return False
+        return not self.is_cancelled()
+
+    def run(self):
+        QtCore.QThread.currentThread().setPriority(QtCore.QThread.LowestPriority)
+        try:
+            for filename in self.filenames:
+                if not self._wait_until_idle():
+                    return
+                media_info = self._get_media_info(filename)
+                if not media_info or media_info.latitude is None or media_info.longitude is None:
+                    continue
+
+                for lookup in (self._get_address, self._get_map):
+                    if not self._wait_until_idle():
+                        return
+                    lookup(media_info.latitude, media_info.longitude)
+            logger.debug("Popup warm-up done for %d photos", len(self.filenames))
+        except Exception as e:  # an error on a worker thread would otherwise be lost
+            logger.error("Error warming up popup - %s", e)
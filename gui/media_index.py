@@ -0,0 +1,146 @@
+import bisect
+import itertools
+import logging
+import os
+from array import array
+
+from PyQt5 import QtCore
+
+logger = logging.getLogger(__name__)
+
+RESCAN_DELAY = 500  # time (ms) to wait for a folder to stop changing before re-scanning it
+
+
+class MediaIndex(QtCore.QObject):
+    """
+    Sorted list of the media files in a folder.
+    The folder is scanned once when the index is created, then the index is kept up-to-date by watching the folder
+    for changes (inotify on Linux), so the folder does not need to be re-scanned every time the player moves.
+    Each file is given an ID (a small integer) that does not change while the file stays in the folder.
+    A burst of changes (e.g. photos being copied to the folder) only re-scans the folder once it has stopped changing.
+    """
+
+    changed = QtCore.pyqtSignal()
+
+    def __init__(self, folder: str, watch: bool = True, rescan_delay: int = RESCAN_DELAY):
+        """
+        Create the index and load the media in the folder.
+
+        :param folder: the folder containing the media
+        :param watch: True to update the index automatically when the folder changes
+        :param rescan_delay: time (ms) to wait for the folder to stop changing before re-scanning it
+        """
+        super().__init__()
+        self._folder = folder
+        self._paths = []
+        self._ids = array("l")  # ID of each file in _paths
+        self._path_ids = {}  # path -> ID
+        self._id_paths = {}  # ID -> path
+        self._next_id = itertools.count()
+
+        self._watcher = None
+        if watch:
+            self._rescan_timer = QtCore.QTimer(self)
+            self._rescan_timer.setSingleShot(True)
+            self._rescan_timer.setInterval(rescan_delay)
+            self._rescan_timer.timeout.connect(self.rescan)
+
+            self._watcher = QtCore.QFileSystemWatcher()
+            if os.path.isdir(folder) and self._watcher.addPath(folder):
+                self._watcher.directoryChanged.connect(self._folder_changed)
+            else:
+                logger.warning("Cannot watch folder %s for changes", folder)
+
+        self.rescan()
+
+    def get_paths(self):
+        """
+        Get the media in the index, sorted by filename.
+        The list is replaced (not modified) when the index changes, so the caller can keep a reference to it.
+
+        :return: list of filenames
+        """
+        return self._paths
+
+    def find(self, path):
+        """
+        Find the position of a media file in the index.
+
+        :param path: the filename
+        :return: the position of the file or, if the file is no longer in the index, the position of the file before it
+        (None if there is no file before it)
+        """
+        i = bisect.bisect_left(self._paths, path)
+        if i < len(self._paths) and self._paths[i] == path:
+            return i
+        return i - 1 if i > 0 else None
+
+    def get_id(self, i):
+        """
+        :param i: the position of a file in the index
+        :return: the ID of the file
+        """
+        return self._ids[i]
+
+    def get_path_id(self, path):
+        """
+        :param path: the filename
+        :return: the ID of the file or None if the file is not in the index
+        """
+        return self._path_ids.get(path)
+
+    def get_id_path(self, media_id):
+        """
+        :param media_id: the ID of a file
+        :return: the filename or None if the file is no longer in the index
+        """
+        return self._id_paths.get(media_id)
+
+    def find_id(self, media_id):
+        """
+        :param media_id: the ID of a file
+        :return: the position of the file in the index or None if the file is no longer in the index
+        """
+        path = self._id_paths.get(media_id)
+        if path is None:
+            return None
+        return self.find(path)
+
+    def rescan(self):
+        """
+        Read the whole folder and apply any differences to the index.
+
+        :return: True if the index changed
+        """
+        logger.debug("Scanning folder %s", self._folder)
+        try:
+            with os.scandir(self._folder) as entries:
+                found = {os.path.join(self._folder, e.name) for e in entries if not e.name.startswith(".") and e.is_file()}
+        except OSError as e:
+            logger.error("Cannot read folder %s - %s", self._folder, e)
+            found = set()
+
+        current = set(self._paths)
+        added = found - current
+        removed = current - found
+        if not added and not removed:
+            return False
+
+        logger.info("Media index for %s: %d added, %d removed", self._folder, len(added), len(removed))
+        for path in removed:
+            del self._id_paths[self._path_ids.pop(path)]
+        for path in sorted(added):
+            media_id = next(self._next_id)
+            self._path_ids[path] = media_id
+            self._id_paths[media_id] = path
+
+        # the existing list is already sorted so this is close to linear
+        self._paths = sorted([p for p in self._paths if p not in removed] + list(added))
+        self._ids = array("l", (self._path_ids[p] for p in self._paths))
+
+        self.changed.emit()
+        return True
+
+    def _folder_changed(self, _unused_folder):
+        # (re)start the timer: the folder is re-scanned once, when the changes stop
+        self._rescan_timer.start()
@@ -1,15 +1,21 @@
-import glob
+import bisect
 import logging
+import os
 import random
+import re
 from abc import abstractmethod
 from typing import List
 
-import exifread
 from PyQt5 import QtWidgets, QtCore, QtGui
-from PyQt5.QtGui import QImage, QPainter
 
+from gui import image_loader
+from gui.media_index import MediaIndex
 from gui.players import PhotoFrameContent
+from gui.prefetch import PhotoPrefetcher
 from utils import photo_utils
+from utils.exif_reader import read_exif
+from utils.history import BrowsingHistory
+from utils.shuffle import PersistentShuffleEngine
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +25,7 @@ class AbstractMediaPlayer(PhotoFrameContent):
     Abstract base class for all media players
     """
 
-    def __init__(self, name, folder, photo_frame, shuffle):
+    def __init__(self, name, folder, photo_frame, shuffle, history_size: int = 1000):
         """
         Create a default abstract media player.
         All sub-classes should call this constructor.
@@ -28,6 +34,7 @@ class AbstractMediaPlayer(PhotoFrameContent):
         :param folder: folder containing the media (images, video...)
         :param shuffle: toggle random slidedown
         :param photo_frame: reference to the photo frame
+        :param history_size: number of visited media remembered for prev()
         """
         super().__init__(name, photo_frame)
 
@@ -35,24 +42,150 @@ class AbstractMediaPlayer(PhotoFrameContent):
         self._shuffle = shuffle
         self._media_list = None
         self.current_media_index = None
-        self.browsing_history = []
-
-        self.refresh_media_list()
+        self.browsing_history = BrowsingHistory(history_size)  # media IDs, so it survives changes to the media list
+        self._shuffle_engines = {}  # frame orientation (see _get_active_orientation) -> ShuffleEngine
+
+        # sub-playlists (sorted indices in the media list) used when the frame has a compass
+        # media with an unknown orientation is in both sub-playlists until it is checked
+        self._portrait_playlist = []
+        self._landscape_playlist = []
+        self._unknown_orientation = set()
+
+        # the folder is scanned once here, then the index follows changes to the folder
+        self._media_index = MediaIndex(folder)
+        self._media_index.changed.connect(self._media_index_changed)
+        self._media_list = self._media_index.get_paths()
+        logger.debug("Loaded %d media files for %s", len(self._media_list), self.get_name())
+        self._partition_media_list()
 
     def refresh_media_list(self):
         """
-        Re-load the media list from the filesystem
-
-        :return: a list of filenames
+        Re-scan the media folder. Only needed on demand: the media list is kept up-to-date automatically.
         """
         logger.debug("Refreshing media list for %s in folder %s", self.get_name(), self.get_folder())
-        self._media_list = glob.glob(self.get_folder() + "/*")
+        self._media_index.rescan()
 
-        # leave index unchanged if possible (to allow playlist to be refreshed without side-effect of jumping to start
-        if self.current_media_index and self.current_media_index >= len(self._media_list):
-            self.current_media_index = None
-            logger.debug("Reset _current_media_index to None")
-        logger.debug("Loaded photo list: %s", self._media_list)
+    def _media_index_changed(self):
+        """
+        Switch to the updated media list, keeping the position in the playlist on the same media.
+        If the current media was removed, the position moves to the media before it (so next() shows the media after it).
+        """
+        old_media_list = self._media_list
+        self._media_list = self._media_index.get_paths()
+
+        if self.current_media_index is not None:
+            self.current_media_index = self._media_index.find(old_media_list[self.current_media_index])
+            logger.debug("Media list changed. _current_media_index = %s", self.current_media_index)
+
+        self._partition_media_list()
+        for orientation, engine in self._shuffle_engines.items():
+            engine.sync(self._get_playlist_ids(orientation))
+        self.playlist_changed()
+
+    def _partition_media_list(self):
+        """
+        Split the media list into portrait and landscape sub-playlists, based on the dimensions/EXIF data in the catalog.
+        Media not (yet) in the catalog is added to both sub-playlists.
+        """
+        self._portrait_playlist = []
+        self._landscape_playlist = []
+        self._unknown_orientation = set()
+
+        media_info = self.photo_frame.catalog.find_all(self._media_list)
+        for i, path in enumerate(self._media_list):
+            portrait = self._is_portrait_media(media_info.get(path))
+            if portrait is None:
+                self._unknown_orientation.add(i)
+            if portrait is not False:
+                self._portrait_playlist.append(i)
+            if portrait is not True:
+                self._landscape_playlist.append(i)
+
+        logger.debug("%s: %d portrait, %d landscape, %d unknown", self.get_name(),
+                     len(self._portrait_playlist) - len(self._unknown_orientation),
+                     len(self._landscape_playlist) - len(self._unknown_orientation), len(self._unknown_orientation))
+
+    @staticmethod
+    def _is_portrait_media(media_info):
+        """
+        :return: True if portrait, False if landscape, None if unknown
+        """
+        if not media_info or not media_info.width or not media_info.height:
+            return None
+        try:
+            return photo_utils.is_portrait(media_info.width, media_info.height, media_info.orientation or 1)
+        except KeyError:  # unsupported EXIF orientation
+            return None
+
+    def _check_orientation(self, i):
+        """
+        Read the orientation of a media item with an unknown orientation (only the file header is read)
+        and remove it from the sub-playlist it does not belong to.
+
+        :param i: the index in the media list
+        """
+        self._unknown_orientation.discard(i)
+        portrait = self._is_portrait_media(self.photo_frame.catalog.get_or_scan(self._media_list[i]))
+        if portrait is None:
+            return
+
+        other_orientation = not portrait
+        other_playlist = self._get_playlist(other_orientation)
+        position = self._find_in_playlist(i, other_playlist)
+        if position is not None:
+            del other_playlist[position]
+            if other_orientation in self._shuffle_engines:
+                self._shuffle_engines[other_orientation].remove(self._media_index.get_id(i))
+
+    def _get_active_orientation(self):
+        """
+        :return: True if the frame is in portrait mode, False if landscape, None if the frame has no compass
+        """
+        compass = self.photo_frame.compass
+        return compass.is_portrait_frame() if compass else None
+
+    def _get_playlist(self, orientation):
+        """
+        Get the media that can be shown with a frame orientation
+
+        :param orientation: True for portrait, False for landscape, None for any orientation
+        :return: sorted sequence of indices in the media list
+        """
+        if orientation is None:
+            return range(len(self._media_list))
+        return self._portrait_playlist if orientation else self._landscape_playlist
+
+    def _get_playlist_ids(self, orientation):
+        return [self._media_index.get_id(i) for i in self._get_playlist(orientation)]
+
+    def _get_active_playlist(self):
+        """
+        Get the media that can be shown with the current frame rotation
+
+        :return: sorted sequence of indices in the media list
+        """
+        return self._get_playlist(self._get_active_orientation())
+
+    def _get_shuffle_engine(self):
+        """
+        Get the shuffle engine for the current frame rotation. The state of each engine is saved in the cache folder,
+        so the shuffle cycle carries on after a restart.
+
+        :return: the ShuffleEngine
+        """
+        orientation = self._get_active_orientation()
+        engine = self._shuffle_engines.get(orientation)
+        if engine is None:
+            name = re.sub(r"[^\w-]", "_", self.get_name())
+            filename = os.path.join(self.photo_frame.cache_folder, "shuffle", "%s-%s.json" % (name, orientation))
+            engine = PersistentShuffleEngine(filename, self._media_index.get_id_path, self._media_index.get_path_id)
+            engine.sync(self._get_playlist_ids(orientation))
+            self._shuffle_engines[orientation] = engine
+        return engine
+
+    def save_state(self):
+        for engine in self._shuffle_engines.values():
+            engine.flush()
 
     def get_folder(self):
         """
@@ -70,6 +203,42 @@ class AbstractMediaPlayer(PhotoFrameContent):
         """
         return self._media_list
 
+    def playlist_changed(self):
+        """
+        Called when the playlist is reloaded with different contents. Sub-classes can override this to drop
+        any work done in advance for the old playlist.
+        """
+
+    def prepare_upcoming_media(self):
+        """
+        Called after moving to a new media item. Sub-classes can override this to get the next media ready in advance.
+        """
+
+    def get_upcoming_indices(self, n: int) -> List[int]:
+        """
+        Predict the playlist positions of the next media to be shown by next() (ignoring any that may be skipped)
+
+        :param n: the number of positions to predict
+        :return: list of playlist indices, in the order they will be shown
+        """
+        playlist = self._get_active_playlist()
+        if not playlist or n <= 0:
+            return []
+
+        # after prev(), next() goes forward through the browsing history first
+        indices = [self._media_index.find_id(media_id) for media_id in self.browsing_history.peek_forward(n)]
+        upcoming = [i for i in indices if i is not None]
+        n -= len(upcoming)
+        if n <= 0:
+            return upcoming
+
+        if self._shuffle:
+            indices = (self._media_index.find_id(media_id) for media_id in self._get_shuffle_engine().peek(n))
+            return upcoming + [i for i in indices if i is not None]
+
+        start = 0 if self.current_media_index is None else bisect.bisect_right(playlist, self.current_media_index)
+        return upcoming + [playlist[(start + i) % len(playlist)] for i in range(n)]
+
     @abstractmethod
     def show_current_media(self):
         """
@@ -78,19 +247,39 @@ class AbstractMediaPlayer(PhotoFrameContent):
         """
 
     def get_current_media_exif(self):
+        """
+        Read the EXIF tags of the current media (see get_current_media_info for the catalogued metadata)
+
+        :return: filename, ExifData (None, None if there is no current media)
+        """
         # make sure we have a list of media and a current pointer
         if None in [self._media_list, self.current_media_index]:
             # self.main_window.setText("Media Player %s: No media to show" % self.get_name())
             return None, None
 
         image_filename = self._media_list[self.current_media_index]
-        with open(image_filename, 'rb') as f:
-            return image_filename, exifread.process_file(f, details=False)
+        return image_filename, read_exif(image_filename)
+
+    def get_current_media_info(self):
+        """
+        Get the metadata of the current media from the catalog (the file is only read if it has not been catalogued yet)
+
+        :return: filename, MediaInfo (both None if there is no current media)
+        """
+        if None in [self._media_list, self.current_media_index]:
+            return None, None
+
+        media_filename = self._media_list[self.current_media_index]
+        return media_filename, self.photo_frame.catalog.get_or_scan(media_filename)
 
     def next(self):
         """
-        Display the next media. If at the end of the playlist, jump to the start
+        Display the next media. If at the end of the playlist, jump to the start.
+        After prev(), move forward through the browsing history first.
         """
+        if self._move_in_history(self.browsing_history.forward):
+            logger.debug("Moving forward in browsing history")
+            return
 
         def at_end(i, media_list):
             return i >= len(media_list) - 1
@@ -101,8 +290,13 @@ class AbstractMediaPlayer(PhotoFrameContent):
         def move_to_next(i, _unused_media_list):
             return i + 1
 
-        def random_jump(_unused_i, media_list):
-            return random.randint(0, len(media_list) - 1)
+        def random_jump(_unused_i, playlist):
+            # the shuffle engine plays each media once per cycle
+            i = self._media_index.find_id(self._get_shuffle_engine().next())
+            position = self._find_in_playlist(i, playlist) if i is not None else None
+            if position is None:  # should not happen: the engine is kept in sync with the playlist
+                return random.randint(0, len(playlist) - 1)
+            return position
 
         if self._shuffle:
             logger.debug("Getting random photo")
@@ -115,18 +309,32 @@ class AbstractMediaPlayer(PhotoFrameContent):
         """
         Display the previously visited media. Stop when we get to the start of the browsing history.
         """
-        # remove current entry from history
-        if self.browsing_history:
-            self.browsing_history.pop()
-
-        # jump to the previous entry (if any)
-        if self.browsing_history:
-            self.current_media_index = self.browsing_history[-1]
-            self.show_current_media()
-        else:
+        if not self._move_in_history(self.browsing_history.back):
             logger.debug("No more browsing history")
             self.current_media_index = None
 
+    def _move_in_history(self, step):
+        """
+        Move through the browsing history and display the media there. Media no longer in the folder is skipped.
+
+        :param step: the browsing history method moving the cursor (back or forward)
+        :return: True if a media was found in the history
+        """
+        while True:
+            media_id = step()
+            if media_id is None:
+                return False
+
+            i = self._media_index.find_id(media_id)
+            if i is not None:
+                break
+            logger.debug("Media %d in browsing history was removed. Skipping", media_id)
+
+        self.current_media_index = i
+        self.show_current_media()
+        self.prepare_upcoming_media()
+        return True
+
     def old_prev(self):
         """
         Display the previous media. If at the start of the playlist, jump to the end
@@ -148,36 +356,63 @@ class AbstractMediaPlayer(PhotoFrameContent):
         Overlay the logo on a pixmap
         :param pmap: the photo
         """
-        painter = QPainter()
-        painter.begin(pmap)
-        painter.drawImage(pmap.width() - self.photo_frame.watermark.width() - 40,
-                          pmap.height() - self.photo_frame.watermark.height() - 10, self.photo_frame.watermark)
-        painter.end()
+        self.photo_frame.watermark.paint(pmap)
 
-    def _move(self, is_boundary, jump, move):
-        self.refresh_media_list()
+    @staticmethod
+    def _find_in_playlist(i, playlist):
+        """
+        :return: the position of media index i in the (sorted) playlist, or None if it is not in the playlist
+        """
+        position = bisect.bisect_left(playlist, i)
+        if position < len(playlist) and playlist[position] == i:
+            return position
+        return None
 
+    def _move(self, is_boundary, jump, move):
+        """
+        Move through the playlist of media compatible with the frame rotation until a media item can be shown.
+        The navigation functions work on positions in that playlist.
+        """
+        playlist = self._get_active_playlist()
         invalid_media = True
         ctr = 0
-        while invalid_media and ctr < len(self._media_list):
+        while invalid_media and ctr < len(playlist):
             # prevent looping forever in case no images match
             logger.debug("ctr = %d", ctr)
 
             logger.debug("_current_media_index = %s", self.current_media_index)
-            logger.debug("length _media_list = %d", len(self._media_list))
+            logger.debug("length playlist = %d", len(playlist))
 
-            if self.current_media_index is None or is_boundary(self.current_media_index, self._media_list):
+            # position of the current media in the playlist (or of the media before it if not in the playlist)
+            position = None
+            if self.current_media_index is not None:
+                position = bisect.bisect_right(playlist, self.current_media_index) - 1
+                if position < 0:
+                    position = None
+
+            if position is None or is_boundary(position, playlist):
                 logger.debug("Jumping to other end of media list")
-                self.current_media_index = jump(self.current_media_index, self._media_list)
+                position = jump(position, playlist)
             else:
                 logger.debug("Moving to neighbouring media item")
-                self.current_media_index = move(self.current_media_index, self._media_list)
+                position = move(position, playlist)
+            self.current_media_index = playlist[position]
+
+            if self.current_media_index in self._unknown_orientation:
+                self._check_orientation(self.current_media_index)
+                if self._find_in_playlist(self.current_media_index, playlist) is None:
+                    logger.debug("Media %d does not match the frame rotation. Skipping", self.current_media_index)
+                    ctr += 1
+                    continue
 
             invalid_media = not self.show_current_media()
             ctr += 1
 
         # update the browsing history
-        self.browsing_history.append(self.current_media_index)
+        if self.current_media_index is not None:
+            self.browsing_history.push(self._media_index.get_id(self.current_media_index))
+
+        self.prepare_upcoming_media()
 
 
 class VideoPlayer(AbstractMediaPlayer):
@@ -200,88 +435,130 @@ class VideoPlayer(AbstractMediaPlayer):
 
 class PhotoPlayer(AbstractMediaPlayer):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, prefetch: int = 0, **kwargs):
+        """
+        Create a photo player.
+
+        :param prefetch: number of upcoming photos to prepare in the background (0 to load each photo on demand)
+        """
+        # created before the playlist is loaded by the parent constructor
+        self._prefetcher = PhotoPrefetcher(self._load_photo, prefetch) if prefetch > 0 else None
+
         super().__init__(*args, **kwargs)
+        self.photo_frame.catalog.scan_in_background(self._media_list)
+
         self.main_window = QtWidgets.QLabel()
         self.main_window.setAlignment(QtCore.Qt.AlignCenter)
 
     def get_main_widget(self):
         return self.main_window
 
+    def _load_photo(self, image_filename, settings):
+        # use the catalogued metadata so the EXIF tags do not need to be read again
+        media_info = self.photo_frame.catalog.get(image_filename)
+
+        # use the copy prepared for the frame (if any), otherwise load the original and keep a copy for next time
+        store = self.photo_frame.derivative_store
+        if store and store.is_fresh(image_filename, settings):
+            if not image_loader.is_compatible(image_filename, settings, media_info):
+                logger.debug("Frame rotation does not match photo rotation. Skipping %s.", image_filename)
+                return image_loader.PreparedPhoto(image_filename, None, False)
+            image = store.load(image_filename, settings)
+            if image:
+                return image_loader.PreparedPhoto(image_filename, image, True)
+
+        photo = image_loader.prepare_photo(image_filename, settings, self.photo_frame.watermark, media_info)
+        if store and photo.image is not None:
+            store.save(image_filename, settings, photo.image)
+        return photo
+
+    def playlist_changed(self):
+        if self._prefetcher:
+            self._prefetcher.cancel()
+        self.photo_frame.catalog.scan_in_background(self._media_list)
+
+    def prepare_upcoming_media(self):
+        if not self._media_list:
+            return
+
+        upcoming = []
+        if self._prefetcher:
+            settings = self.photo_frame.get_render_settings()
+            upcoming = [self._media_list[i] for i in self.get_upcoming_indices(self._prefetcher.depth)]
+
+            # no need to prepare photos that are still in the pixmap cache
+            self._prefetcher.schedule(
+                [f for f in upcoming if self._get_cache_key(f, settings) not in self.photo_frame.pixmap_cache], settings)
+
+        # the popup is most likely to be opened for the current photo
+        if self.current_media_index is not None:
+            self.photo_frame.warm_up_popup([self._media_list[self.current_media_index]] + upcoming)
+
+    def is_preparing_media(self):
+        return self._prefetcher is not None and self._prefetcher.is_busy()
+
     def show_current_media(self):
-        logger.debug("Showing media %d", self.current_media_index)
+        logger.debug("Showing media %s", self.current_media_index)
 
         if not self._media_list:
             self.main_window.setText("Media Player %s: No media to show" % self.get_name())
             return True
 
-        angle_to_rotate_photo = 0
-
-        # load image from the file
         image_filename = self._media_list[self.current_media_index]
-        logger.debug("Loading image %s", image_filename)
-
-        # we alwways need this (even to discard incompatible network) so check now
-        exif_orientation = photo_utils.get_file_exif_orientation(image_filename)
-
-        # if frame rotation detection is supported, skip portrait network if frame is in landscape mode (and vice versa)
-        if self.photo_frame.compass:
+        settings = self.photo_frame.get_render_settings()
 
-            is_portrait_frame_check = self.photo_frame.compass.is_portrait_frame()
+        # re-use the final pixmap if this photo has been shown recently
+        cache_key = self._get_cache_key(image_filename, settings)
+        pmap = self.photo_frame.pixmap_cache.get(cache_key) if cache_key else None
+        if pmap:
+            logger.debug("Using cached pixmap for %s", image_filename)
+            self.main_window.setPixmap(pmap)
+            return True
 
-            image = QImage(image_filename)
-            if exif_orientation:
-                is_portrait_image_check = photo_utils.is_portrait(image.width(), image.height(), exif_orientation)
-            else:
-                is_portrait_image_check = photo_utils.is_portrait(image.width(), image.height())
+        # load image from the file (unless it has already been prepared in the background)
+        photo = self._prefetcher.take(image_filename, settings) if self._prefetcher else None
+        if photo:
+            logger.debug("Using prefetched image %s", image_filename)
+        else:
+            logger.debug("Loading image %s", image_filename)
+            photo = self._load_photo(image_filename, settings)
 
-            logger.debug("Is frame in portrait mode? %s", is_portrait_frame_check)
-            logger.debug("Is image in portrait mode? %s", is_portrait_image_check)
+        if not photo.compatible:
+            self.main_window.setText("Frame rotation does not match photo rotation. Skipping %s." % image_filename)
+            return False
 
-            # check compatibility of frame with photo rotation (must be the same)
-            if is_portrait_frame_check != is_portrait_image_check:
-                logging.debug("Frame rotation does not match photo rotation. Skipping %s.", image_filename)
-                self.main_window.setText("Frame rotation does not match photo rotation. Skipping %s." % image_filename)
-                return False
+        if photo.image is None:
+            return False
 
-            # if we get here, the photo is compatible
-
-            # rotate the photo based on the frame orientation
-            logger.debug("Frame rotated by %d", self.photo_frame.compass.get_rotation_simple())
-            angle_to_rotate_photo = -self.photo_frame.compass.get_rotation_simple()
-
-        # rotate the photo based on the photo EXIF rotation
-        if exif_orientation:
-            photo_rotation = photo_utils.get_exif_rotation_angle(exif_orientation)
-            logger.debug("Photo rotated by %d", photo_rotation)
-            angle_to_rotate_photo = angle_to_rotate_photo - photo_rotation
-
-        image = QtGui.QImage(image_filename)
-        if image:
-            pmap = QtGui.QPixmap.fromImage(image)
-            logger.debug("Rotating photo by %f", angle_to_rotate_photo)
-            logger.debug("Scaling photo to %s", self.photo_frame.frame_size)
-            pmap = pmap.transformed(QtGui.QTransform().rotate(angle_to_rotate_photo)).scaled(
-                self.photo_frame.frame_size,
-                QtCore.Qt.KeepAspectRatio,
-                QtCore.Qt.SmoothTransformation)
-
-            # add the watermark (unrotate, watermark, rotate)
-            pmap = pmap.transformed(QtGui.QTransform().rotate(-angle_to_rotate_photo))
-            self.paint_watermark(pmap)
-            pmap = pmap.transformed(QtGui.QTransform().rotate(angle_to_rotate_photo))
+        pmap = QtGui.QPixmap.fromImage(photo.image)
+        if cache_key:
+            self.photo_frame.pixmap_cache.put(cache_key, pmap)
+        self.main_window.setPixmap(pmap)
+        return True
 
-            self.main_window.setPixmap(pmap)
-            return True
+    @staticmethod
+    def _get_cache_key(image_filename, settings):
+        """
+        Get the key identifying a photo in the pixmap cache.
+        The modification time is included so an updated file is not served from the cache.
 
-        logger.info("Could not load image: %s", image_filename)
-        return False
+        :return: the key or None if the file cannot be accessed
+        """
+        try:
+            mtime = os.stat(image_filename).st_mtime_ns
+        except OSError:
+            return None
+        return image_filename, mtime, settings.width, settings.height, settings.frame_rotation
 
     def get_properties(self) -> List[str]:
         return [
             "folder = %s" % self.get_folder(),
             "# photos = %d" % len(self.get_playlist()),
-            "shuffle = %s" % self._shuffle
+            "shuffle = %s" % self._shuffle,
+            "# portrait/landscape/unknown = %d/%d/%d" % (len(self._portrait_playlist) - len(self._unknown_orientation),
+                                                         len(self._landscape_playlist) - len(self._unknown_orientation),
+                                                         len(self._unknown_orientation)),
+            "prefetch = %d" % (self._prefetcher.depth if self._prefetcher else 0)
         ]
 
     def get_description(self) -> str:
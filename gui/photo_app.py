@@ -1,4 +1,4 @@
-import collections
+import functools
 import logging
 import os
 import sys
@@ -11,12 +11,13 @@ from PyQt5.QtCore import pyqtSlot
 from PyQt5.QtGui import QFont, QImage, QGuiApplication
 from PyQt5.QtWidgets import QDialog, QLabel, QGridLayout, QPushButton, QSplashScreen
 
+from gui.location_lookup import LocationLookup, LocationLookupSignals, LocationWarmup
 from gui.players import PhotoFrameContent
-from utils import photo_utils
+from utils.lru_cache import LruCache
 
 logger = logging.getLogger(__name__)
 
-GOOGLE_MAPS_URL = "https://maps.googleapis.com/maps/api/staticmap?zoom=11&size=350x350&maptype=roadmap&markers=color:red|label:C|%f,%f&key=%s"
+GOOGLE_MAPS_URL = "https://maps.googleapis.com/maps/api/staticmap?zoom=%d&size=350x350&maptype=roadmap&markers=color:red|label:C|%f,%f&key=%s"
 
 
 class PhotoFrame(QtWidgets.QMainWindow):
@@ -36,7 +37,33 @@ class PhotoFrame(QtWidgets.QMainWindow):
         self.rotation = None
         self.shuffle = None
         self.google_maps = None
-
+        self.places_file = None
+        self.online_geocoder = None
+        self.map_tiles = None
+        self.map_zoom = None
+        self.geo_cache_grid = None
+        self.geo_cache_mb = None
+        self.geo_cache_days = None
+        self.pixmap_cache_mb = None
+        self.cache_folder = None
+        self.derivative_cache = None
+        self.http_connect_timeout = None
+        self.http_read_timeout = None
+        self.http_retries = None
+        self.http_circuit_reset = None
+
+        self.http_client = None
+        self.pixmap_cache = None
+        self.catalog = None
+        self.geocoder = None
+        self.geo_cache = None
+        self.tile_store = None
+        self.popup_warmup = None
+        self._popup_warmup = None  # the LocationWarmup running
+        self._popup_warmup_pool = QtCore.QThreadPool(self)
+        self._popup_warmup_pool.setMaxThreadCount(1)
+        self.derivative_store = None
+        self._derivative_settings = None  # RenderSettings used by the last derivative build
         self.players = None
         self.current_player_index = 0
         self.watermark = None
@@ -55,6 +82,104 @@ class PhotoFrame(QtWidgets.QMainWindow):
         self.showFullScreen()
         self._timer_callback()
 
+    def _update_derivative_store(self):
+        """
+        Start preparing copies of all photos in the background (again, if the frame has been rotated)
+        """
+        settings = self.get_render_settings()
+        if not self.derivative_store or settings == self._derivative_settings:
+            return
+
+        from gui.media_players import PhotoPlayer
+        from gui.image_loader import prepare_photo
+
+        image_filenames = []
+        for player in self.players:
+            if isinstance(player, PhotoPlayer):
+                image_filenames.extend(player.get_playlist())
+
+        self._derivative_settings = settings
+        self.derivative_store.start_builder(image_filenames, settings,
+                                            lambda filename, s: prepare_photo(filename, s, self.watermark))
+
+    def get_location_address(self, latitude, longitude, online=True):
+        """
+        Get the address of a GPS location (from the geo cache if a photo was taken nearby before)
+
+        :param online: False to only use the offline geocoder (not Nominatim, even if online_geocoder is set)
+        :return: address as a string or "" if not found
+        """
+        get_address = self.geocoder.get_address if online else self.geocoder.offline.get_address
+        return self.geo_cache.get_or_fetch("address", latitude, longitude, get_address) or ""
+
+    def get_location_map(self, latitude, longitude, online=True):
+        """
+        Get a map of a GPS location. The map is drawn from the local tile store if it holds the tiles, otherwise it is
+        downloaded from Google Maps (or taken from the geo cache if a photo was taken nearby before).
+        Safe to call from a worker thread.
+
+        :param online: False to not download the map from Google Maps (only the tile store and the geo cache are used)
+        :return: the map as a QImage or None if not available
+        """
+        from gui.tile_map import render_map
+        map_image = render_map(self.tile_store, latitude, longitude, self.map_zoom)
+        if map_image is not None:
+            return map_image
+
+        if not self.google_maps:
+            return None
+
+        # maps downloaded at another zoom level are not used
+        kind = "map-%d" % self.map_zoom
+        map_data = self.geo_cache.get_or_fetch(kind, latitude, longitude, self._download_map) if online else \
+            self.geo_cache.get(kind, latitude, longitude)
+        return QImage.fromData(map_data) if map_data else None
+
+    def warm_up_popup(self, filenames):
+        """
+        Look up the popup information of some photos in the background, so it is ready if the popup is opened.
+        Only local sources are used (the offline geocoder, the tile store and the caches): the photos may never be
+        shown in the popup, so they are not looked up on the web services (Nominatim, Google Maps).
+        Any earlier warm-up is cancelled.
+
+        :param filenames: the photos (the current photo first)
+        """
+        if self._popup_warmup:
+            self._popup_warmup.cancel()
+            self._popup_warmup = None
+
+        if not self.popup_warmup or self.catalog is None:
+            return
+
+        self._popup_warmup = LocationWarmup(filenames, self.catalog.get_or_scan,
+                                            functools.partial(self.get_location_address, online=False),
+                                            functools.partial(self.get_location_map, online=False),
+                                            self.is_preparing_media)
+        self._popup_warmup_pool.start(self._popup_warmup)
+
+    def is_preparing_media(self):
+        """
+        :return: True if any player is preparing photos in the background
+        """
+        return any(player.is_preparing_media() for player in self.players or [])
+
+    def _download_map(self, latitude, longitude):
+        """
+        Download a map via Google Maps API
+
+        :return: the map as PNG data or None if the download failed
+        """
+        try:
+            response = self.http_client.get(GOOGLE_MAPS_URL % (self.map_zoom, latitude, longitude, self.google_maps))
+        except requests.exceptions.RequestException as e:
+            logger.error("Error downloading map from Google Maps API - %s", e)
+            return None
+
+        if not response.ok or not response.headers.get("Content-Type", "").startswith("image/"):
+            logger.error("Error downloading map from Google Maps API - HTTP %d", response.status_code)
+            return None
+        return response.content
+
     def setup(self):
 
         # read values from the config file
@@ -72,12 +197,45 @@ class PhotoFrame(QtWidgets.QMainWindow):
             self.compass = None
 
         # create a watermark based on the logo
-        self.watermark = self.logo_large.scaledToWidth(50, QtCore.Qt.SmoothTransformation)
+        from gui.image_loader import Watermark
+        self.watermark = Watermark(self.logo_large.scaledToWidth(50, QtCore.Qt.SmoothTransformation))
+
+        # cache of frame-ready photos shared by all players
+        self.pixmap_cache = LruCache(self.pixmap_cache_mb * 1024 * 1024,
+                                     lambda pmap: pmap.width() * pmap.height() * pmap.depth() // 8)
 
         # screen dimensions
         self.frame_size = QGuiApplication.primaryScreen().geometry().size()
         logger.info("Frame size = %s", self.frame_size)
 
+        # metadata (EXIF, dimensions, GPS) of all media files
+        from utils.catalog import MediaCatalog
+        self.catalog = MediaCatalog(os.path.join(self.cache_folder, "catalog.db"))
+
+        # one HTTP client (pooled connections, retries, circuit breakers) for everything downloaded by the frame
+        from network.http_client import HttpClient, set_default_client
+        self.http_client = HttpClient(self.http_connect_timeout, self.http_read_timeout, self.http_retries,
+                                      reset_timeout=self.http_circuit_reset)
+        set_default_client(self.http_client)
+
+        # addresses for the popup (the places dataset is loaded on the first lookup)
+        from utils.geocoder import OfflineGeocoder, ReverseGeocoder
+        offline_geocoder = OfflineGeocoder(self.places_file) if self.places_file else OfflineGeocoder()
+        self.geocoder = ReverseGeocoder(offline_geocoder, self.online_geocoder, self.http_client)
+
+        from utils.tile_store import TileStore
+        self.tile_store = TileStore(self.map_tiles or os.path.join(self.cache_folder, "map_tiles.mbtiles"))
+
+        from utils.geo_cache import GeoCache
+        self.geo_cache = GeoCache(os.path.join(self.cache_folder, "geo_cache.db"), self.geo_cache_grid,
+                                  self.geo_cache_mb * 1024 * 1024, self.geo_cache_days * 24 * 3600)
+
+        # persistent copies of the photos prepared for this screen
+        if self.derivative_cache:
+            from gui.derivative_store import DerivativeStore
+            self.derivative_store = DerivativeStore(os.path.join(self.cache_folder, "derivatives"),
+                                                    self.frame_size.width(), self.frame_size.height())
+
         # create frame content
         self._setup_players()
         self._build_ui()
@@ -114,6 +272,42 @@ class PhotoFrame(QtWidgets.QMainWindow):
         self.google_maps = self.config.get_config_value("google_maps", frame_config)
         logger.info("Google Maps API = %s", self.google_maps)
 
+        self.places_file = self.config.get_config_value("places_file", frame_config)
+        logger.info("Places file = %s", self.places_file)
+
+        self.online_geocoder = self.config.get_config_value("online_geocoder", frame_config)
+        logger.info("Online geocoder = %s", self.online_geocoder)
+
+        self.popup_warmup = self.config.get_config_value("popup_warmup", frame_config)
+        logger.info("Popup warm-up = %s", self.popup_warmup)
+
+        self.map_tiles = self.config.get_config_value("map_tiles", frame_config)
+        self.map_zoom = int(self.config.get_config_value("map_zoom", frame_config))
+        logger.info("Map tiles = %s (zoom %d)", self.map_tiles, self.map_zoom)
+
+        self.geo_cache_grid = float(self.config.get_config_value("geo_cache_grid", frame_config))
+        self.geo_cache_mb = int(self.config.get_config_value("geo_cache_mb", frame_config))
+        self.geo_cache_days = float(self.config.get_config_value("geo_cache_days", frame_config))
+        logger.info("Geo cache = %f degree grid, %d MB, %f days", self.geo_cache_grid, self.geo_cache_mb,
+                    self.geo_cache_days)
+
+        self.pixmap_cache_mb = int(self.config.get_config_value("pixmap_cache_mb", frame_config))
+        logger.info("Pixmap cache (MB) = %d", self.pixmap_cache_mb)
+
+        self.cache_folder = self.config.get_config_value("cache_folder", frame_config) or os.path.join(self.root_folder,
+                                                                                                     ".cache")
+        logger.info("Cache folder = %s", self.cache_folder)
+
+        self.derivative_cache = self.config.get_config_value("derivative_cache", frame_config)
+        logger.info("Derivative cache = %s", self.derivative_cache)
+
+        self.http_connect_timeout = float(self.config.get_config_value("http_connect_timeout", frame_config))
+        self.http_read_timeout = float(self.config.get_config_value("http_read_timeout", frame_config))
+        self.http_retries = int(self.config.get_config_value("http_retries", frame_config))
+        self.http_circuit_reset = float(self.config.get_config_value("http_circuit_reset", frame_config))
+        logger.info("HTTP timeouts = %f s connect, %f s read, %d retries, circuit reset %f s", self.http_connect_timeout,
+                    self.http_read_timeout, self.http_retries, self.http_circuit_reset)
+
     def _setup_players(self):
         """
         Factory method to create the set of media players
@@ -134,7 +328,9 @@ class PhotoFrame(QtWidgets.QMainWindow):
                 player = PhotoPlayer(name, self.root_folder + "/" + self.config.get_config_value("folder",
                                                                                                  players_config[name]),
                                      self,
-                                     self.config.get_config_value("shuffle", players_config[name]))
+                                     self.config.get_config_value("shuffle", players_config[name]),
+                                     prefetch=int(self.config.get_config_value("prefetch", players_config[name])),
+                                     history_size=int(self.config.get_config_value("history_size", players_config[name])))
 
             elif players_config[name]["type"] == "dashboard":
                 from gui.dashboard import FrameDashboard
@@ -147,7 +343,8 @@ class PhotoFrame(QtWidgets.QMainWindow):
                                      self.root_folder + "/" + self.config.get_config_value("folder",
                                                                                            players_config[name]),
                                      self,
-                                     self.config.get_config_value("shuffle", players_config[name]))
+                                     self.config.get_config_value("shuffle", players_config[name]),
+                                     history_size=int(self.config.get_config_value("history_size", players_config[name])))
 
             logger.info("Creating player %s", player.get_name())
             self.players.append(player)
@@ -191,9 +388,34 @@ class PhotoFrame(QtWidgets.QMainWindow):
         """
         return self.players[self.current_player_index]
 
+    def get_render_settings(self):
+        """
+        Get the current settings used to draw photos on the frame (frame size and rotation)
+
+        :return: the RenderSettings
+        """
+        from gui.image_loader import RenderSettings
+        if self.compass:
+            return RenderSettings(self.frame_size.width(), self.frame_size.height(),
+                                  self.compass.get_rotation_simple(), self.compass.is_portrait_frame())
+        return RenderSettings(self.frame_size.width(), self.frame_size.height(), 0, None)
+
     def _timer_callback(self):
+        self._update_derivative_store()
+        self._close_popup()  # the popup describes the photo being replaced
         self.get_current_player().next()
 
+    def _close_popup(self):
+        """
+        Close the popup (if open). Any address/map lookup still running for it is cancelled.
+
+        :return: True if the popup was open
+        """
+        if self.popup and self.popup.isVisible():
+            self.popup.hide()
+            return True
+        return False
+
     def _build_ui(self):
         # setup UI - use a QStackedWidget to avoid widgets being destroyed
         self.stack = QtWidgets.QStackedWidget(self)
@@ -234,8 +456,7 @@ class PhotoFrame(QtWidgets.QMainWindow):
         """
 
         # close the popup (if open)
-        if self.popup and self.popup.isVisible():
-            self.popup.hide()
+        if self._close_popup():
             return  # make sure we return here, otherwise the dialog re-opens further down!
 
         # get the width/height of the screen, and the mouse click lco-ords
@@ -262,6 +483,13 @@ class PhotoFrame(QtWidgets.QMainWindow):
         else:
             self._popup()
 
+    def closeEvent(self, event):
+        if self._popup_warmup:
+            self._popup_warmup.cancel()
+        for player in self.players or []:
+            player.save_state()
+        super().closeEvent(event)
+
     def keyPressEvent(self, key):
         """
         Handle key-presses
@@ -273,6 +501,9 @@ class PhotoFrame(QtWidgets.QMainWindow):
             self.close()
             sys.exit(0)
 
+        if key_press in [QtCore.Qt.Key_Left, QtCore.Qt.Key_Right, QtCore.Qt.Key_Up, QtCore.Qt.Key_Down]:
+            self._close_popup()  # the popup describes the photo being replaced
+
         if key_press == QtCore.Qt.Key_Left:  # left = prev image
             self.get_current_player().prev()
 
@@ -302,8 +533,8 @@ class PhotoFrame(QtWidgets.QMainWindow):
         if not self.popup:
             self.popup = Popup(self, self.font_size)
 
-        filename, exif = self.get_current_player().get_current_media_exif()  # filename and EXIF may be none
-        self.popup.update_popup(filename, exif)
+        filename, media_info = self.get_current_player().get_current_media_info()  # filename and info may be none
+        self.popup.update_popup(filename, media_info)
 
     def splash_screen(self, delay: int):
         angle_to_rotate_photo = 0
@@ -349,76 +580,88 @@ class Popup(QDialog):
         # ref to current filename (used to delete files)
         self._current_filename: str = ""
 
-    def update_popup(self, filename, exif_tags):
+        # address/map lookups run on a worker thread
+        self._thread_pool = QtCore.QThreadPool(self)
+        self._lookup = None  # the LocationLookup for the photo currently shown
+        self._lookup_id = 0
+        self.lookup_signals = LocationLookupSignals(self)
+        self.lookup_signals.address_found.connect(self._address_found)
+        self.lookup_signals.map_found.connect(self._map_found)
+
+    def update_popup(self, filename, media_info):
         """
         Display meta information about the selected photo in the popup dialog.
+        The popup is shown straight away: the address and map are looked up on a worker thread and filled in
+        when they arrive.
 
         :param filename: filename of the photo
-        :param exif_tags: dictionary of EXIF tags for the photo
+        :param media_info: MediaInfo of the photo from the catalog (or None)
         """
+        self.cancel_lookup()
+
         logger.debug("Filename: %s", self._current_filename)
         self._current_filename = filename
         if not filename:
             filename = "<unknown>"
         self.value_widgets[0].setText(filename)
 
-        map_image = QImage("unknown_map.png")  # default image
-
-        # extract EXIF data (set default values in case the information cannot be found)
-        logger.debug("exif tags: %s", exif_tags)
+        # set default values in case the information cannot be found
+        logger.debug("media info: %s", media_info)
         date = location = "<unknown>"
+        self._set_map(QImage("unknown_map.png"))  # default image
 
-        if isinstance(exif_tags, collections.Mapping):
-            long_ref = lat_ref = lat = long = ""
-            if "EXIF DateTimeOriginal" in exif_tags.keys():
-                date = str(exif_tags["EXIF DateTimeOriginal"])
-
-            if "GPS GPSLatitudeRef" in exif_tags.keys():
-                lat_ref = exif_tags["GPS GPSLatitudeRef"]
-
-            if "GPS GPSLatitude" in exif_tags.keys():
-                lat = exif_tags["GPS GPSLatitude"]
-
-            if "GPS GPSLongitudeRef" in exif_tags.keys():
-                long_ref = exif_tags["GPS GPSLongitudeRef"]
-
-            if "GPS GPSLongitude" in exif_tags.keys():
-                long = exif_tags["GPS GPSLongitude"]
-
-            # if we have GPS data...
-            if all([lat, lat_ref, long, long_ref]):
-                lat_d, lat_m, lat_s = tuple(lat.values)
-                long_d, long_m, long_s = tuple(long.values)
-
-                # reverse lookup address
-                logger.debug("%s %s %s %s", lat, lat_ref, long, long_ref)
-                location = photo_utils.get_gps_dms_location(lat_d.num / lat_d.den, lat_m.num / lat_m.den,
-                                                            lat_s.num / lat_s.den,
-                                                            lat_ref, long_d.num / long_d.den, long_m.num / long_m.den,
-                                                            long_s.num / long_s.den, long_ref)
-
-                # reformat lines
-                location = "\n".join(location.split(", "))
-
-                # download image via Google Maps API
-                latitude, longitude, _altitude = photo_utils.gps_dms_to_dd(lat_d.num / lat_d.den, lat_m.num / lat_m.den,
-                                                                           lat_s.num / lat_s.den,
-                                                                           lat_ref, long_d.num / long_d.den,
-                                                                           long_m.num / long_m.den,
-                                                                           long_s.num / long_s.den, long_ref)
-                try:
-                    map_url = GOOGLE_MAPS_URL % (latitude, longitude, self.frame.google_maps)
-                    response = requests.get(map_url)
-                    map_image.loadFromData(response.content)
-                except requests.exceptions.ConnectionError as e:
-                    logger.error("Error downloading map from Google Maps API - %s", e)
-                    map_image = QImage("unknown_map.png")
+        if media_info:
+            if media_info.date:
+                date = media_info.date
+
+            # if we have GPS data, look up the address and map
+            if media_info.latitude is not None and media_info.longitude is not None:
+                location = "Looking up..."
+                self._lookup_id += 1
+                self._lookup = LocationLookup(self.lookup_signals, self._lookup_id, media_info.latitude,
+                                              media_info.longitude, self.frame.get_location_address,
+                                              self.frame.get_location_map)
+                self._thread_pool.start(self._lookup)
 
         self.value_widgets[1].setText(date)
         self.value_widgets[2].setText(location)
+        self.show()
+
+    def cancel_lookup(self):
+        """
+        Stop looking up the address/map of the photo. Results that are still on their way are discarded.
+        """
+        if self._lookup:
+            self._lookup.cancel()
+            self._lookup = None
+
+    def _is_current_lookup(self, lookup_id):
+        return self._lookup is not None and lookup_id == self._lookup.lookup_id
+
+    def _address_found(self, lookup_id, address):
+        if not self._is_current_lookup(lookup_id):
+            logger.debug("Discarding address from old lookup %d", lookup_id)
+            return
+
+        # reformat lines
+        self.value_widgets[2].setText("\n".join(address.split(", ")) if address else "<unknown>")
+
+    def _map_found(self, lookup_id, map_image):
+        if not self._is_current_lookup(lookup_id):
+            logger.debug("Discarding map from old lookup %d", lookup_id)
+            return
+
+        self._lookup = None
+        if not map_image.isNull():
+            self._set_map(map_image)
+
+    def _set_map(self, map_image):
         map_image = map_image.scaledToWidth(350, QtCore.Qt.SmoothTransformation)
         self.map_label.setPixmap(QtGui.QPixmap.fromImage(map_image))
-        self.show()
+
+    def hideEvent(self, event):
+        self.cancel_lookup()
+        super().hideEvent(event)
 
     def _build_ui(self):
         layout = QGridLayout(self)
@@ -432,7 +675,7 @@ class Popup(QDialog):
 
         # centred logo
         logo_label = QLabel(self)
-        logo = self.frame.logo_large.scaledToWidth(self.frame.frame_size.width() / 15, QtCore.Qt.SmoothTransformation)
+        logo = self.frame.logo_large.scaledToWidth(self.frame.frame_size.width() // 15, QtCore.Qt.SmoothTransformation)
         logo_label.setPixmap(QtGui.QPixmap.fromImage(logo))
         layout.addWidget(logo_label, 0, 0, 1, -1, QtCore.Qt.AlignCenter)  # span 3 columns
 
@@ -469,5 +712,6 @@ class Popup(QDialog):
 
         logger.info("Deleting %s", self._current_filename)
         os.remove(self._current_filename)
+        self.frame.refresh_current_playlist()  # don't wait for the folder watcher to notice
         self.close()
         self.frame.get_current_player().next()
@@ -45,3 +45,14 @@ class PhotoFrameContent(ABC):
 
     def refresh_media_list(self):
         pass
+
+    def save_state(self):
+        """
+        Save any state that should survive a restart (called when the frame is closed)
+        """
+
+    def is_preparing_media(self) -> bool:
+        """
+        :return: True if media is being prepared in the background (other background work should wait)
+        """
+        return False
@@ -0,0 +1,98 @@
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoPrefetcher:
+    """
+    Prepare the next few photos of a playlist on a pool of worker threads,
+    so moving to the next photo only has to swap in an image that is already decoded, rotated and scaled.
+    """
+
+    def __init__(self, loader, depth: int, workers: int = 2):
+        """
+        Create a prefetcher.
+
+        :param loader: function(filename, settings) returning a PreparedPhoto. Called on a worker thread.
+        :param depth: the number of upcoming photos to prepare in advance
+        :param workers: the number of worker threads
+        """
+        self._loader = loader
+        self.depth = depth
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._jobs = OrderedDict()  # filename -> Future
+        self._settings = None  # RenderSettings used by the queued jobs
+
+    def schedule(self, filenames, settings):
+        """
+        Start preparing the given photos (in order). Jobs for photos no longer in the list are cancelled.
+        If the render settings have changed (e.g. the frame was rotated) all existing jobs are discarded.
+
+        :param filenames: the upcoming photos, in the order they will be shown
+        :param settings: the RenderSettings to use
+        """
+        if settings != self._settings:
+            logger.debug("Render settings changed (%s). Discarding prefetched photos", settings)
+            self.cancel()
+            self._settings = settings
+
+        wanted = list(OrderedDict.fromkeys(filenames))[:self.depth]
+
+        for filename in [f for f in self._jobs if f not in wanted]:
+            logger.debug("Cancelling prefetch of %s", filename)
+            self._jobs.pop(filename).cancel()
+
+        for filename in wanted:
+            if filename not in self._jobs:
+                logger.debug("Prefetching %s", filename)
+                self._jobs[filename] = self._executor.submit(self._loader, filename, settings)
+
+    def take(self, filename, settings):
+        """
+        Get a prefetched photo. If the photo is still being prepared, wait for it to finish.
+
+        :param filename: the photo
+        :param settings: the RenderSettings the photo must have been prepared with
+        :return: the PreparedPhoto or None if the photo was not prefetched
+        """
+        if settings != self._settings or filename not in self._jobs:
+            return None
+
+        job = self._jobs.pop(filename)
+        try:
+            return job.result()
+        except CancelledError:
+            return None
+        except Exception as e:  # a bad file must not stop the slideshow: let the caller load it again
+            logger.error("Error prefetching %s - %s", filename, e)
+            return None
+
+    def cancel(self):
+        """
+        Discard all queued and prepared photos (e.g. when the playlist changes)
+        """
+        for job in self._jobs.values():
+            job.cancel()
+        self._jobs.clear()
+
+    def get_pending(self):
+        """
+        Get the photos currently queued or prepared
+
+        :return: list of filenames
+        """
+        return list(self._jobs.keys())
+
+    def is_busy(self):
+        """
+        Check if any photos are still being prepared. Safe to call from any thread.
+
+        :return: True if some jobs have not finished
+        """
+        return any(not job.done() for job in list(self._jobs.values()))
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False)
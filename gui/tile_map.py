@@ -0,0 +1,59 @@
+import logging
+
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtGui import QImage, QPainter
+
+from utils.tile_store import get_tiles_around
+
+logger = logging.getLogger(__name__)
+
+ATTRIBUTION = "© OpenStreetMap contributors"
+
+
+def render_map(tile_store, latitude, longitude, zoom=11, width=350, height=350):
+    """
+    Draw a map centred on a location, with a marker on the location, from the tiles in a tile store.
+    Only QImage is used (not QPixmap) so this can be safely called from a worker thread.
+
+    :param tile_store: the TileStore
+    :param latitude: latitude (decimal degrees)
+    :param longitude: longitude (decimal degrees)
+    :param zoom: the zoom level
+    :param width: the width of the map (pixels)
+    :param height: the height of the map (pixels)
+    :return: the map as a QImage or None if some of the tiles are not in the store
+    """
+    tiles = []
+    for x, y, left, top in get_tiles_around(latitude, longitude, zoom, width, height):
+        tile = QImage.fromData(tile_store.get_tile(zoom, x, y) or b"")
+        if tile.isNull():
+            logger.debug("Tile %d/%d/%d is not in the tile store", zoom, x, y)
+            return None
+        tiles.append((left, top, tile))
+
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(QtGui.QColor(170, 211, 223))  # sea (shown beyond the poles)
+
+    painter = QPainter()
+    painter.begin(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    for left, top, tile in tiles:
+        painter.drawImage(left, top, tile)
+
+    # marker on the location (the centre of the map)
+    painter.setPen(QtGui.QPen(QtCore.Qt.white, 3))
+    painter.setBrush(QtGui.QColor(220, 30, 30))
+    painter.drawEllipse(QtCore.QPointF(width / 2, height / 2), 8, 8)
+
+    # the map data licence requires the attribution to be shown
+    font = painter.font()
+    font.setPixelSize(10)
+    painter.setFont(font)
+    text_rect = painter.fontMetrics().boundingRect(ATTRIBUTION).adjusted(-3, -1, 3, 1)
+    text_rect.moveBottomRight(QtCore.QPoint(width - 1, height - 1))
+    painter.fillRect(text_rect, QtGui.QColor(255, 255, 255, 180))
+    painter.setPen(QtCore.Qt.black)
+    painter.drawText(text_rect, QtCore.Qt.AlignCenter, ATTRIBUTION)
+    painter.end()
+
+    return image
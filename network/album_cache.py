@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# an album in the cache
+# item_count is the number of photos in the album when it was last refreshed
+# refreshed/full_refresh are the times of the last refresh and of the last time the whole album was read
+CachedAlbum = namedtuple("CachedAlbum", ["name", "item_count", "refreshed", "full_refresh"])
+
+# the metadata of a photo in an album, with the icloud records it was read from
+CachedAsset = namedtuple("CachedAsset", ["asset_id", "filename", "item_type", "width", "height", "orientation",
+                                         "modified", "master_record", "asset_record"])
+
+_ASSET_COLUMNS = ", ".join(CachedAsset._fields)
+
+
+def _get_field(record, field):
+    return record["fields"].get(field, {}).get("value")
+
+
+class AlbumCache:
+    """
+    SQLite cache of the photo metadata of icloud albums, so the albums do not need to be read from the icloud on every
+    run (see IcloudPhotos.refresh_album).
+    The photos of an album are kept in album order. The cache can be used from any thread.
+    """
+
+    def __init__(self, db_filename: str):
+        """
+        Open (or create) the cache
+
+        :param db_filename: the location of the SQLite database (":memory:" for a temporary cache)
+        """
+        if db_filename != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_filename)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_filename, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS albums ("
+                             "name TEXT PRIMARY KEY, item_count INTEGER, refreshed REAL, full_refresh REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS assets ("
+                             "album TEXT NOT NULL, rank INTEGER NOT NULL, asset_id TEXT NOT NULL, filename TEXT, "
+                             "item_type TEXT, width INTEGER, height INTEGER, orientation INTEGER, modified INTEGER, "
+                             "master_record TEXT, asset_record TEXT, PRIMARY KEY (album, asset_id))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS assets_rank ON assets (album, rank)")
+
+    def get_album(self, name):
+        """
+        :return: the CachedAlbum or None if the album has never been cached
+        """
+        with self._lock:
+            row = self._db.execute("SELECT name, item_count, refreshed, full_refresh FROM albums WHERE name = ?",
+                                   (name,)).fetchone()
+        return CachedAlbum(*row) if row else None
+
+    def get_albums(self):
+        """
+        :return: list of all the CachedAlbums
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT name, item_count, refreshed, full_refresh FROM albums ORDER BY name")
+            return [CachedAlbum(*row) for row in rows]
+
+    def get_asset_ids(self, name):
+        """
+        :return: set of the IDs of the photos in an album
+        """
+        with self._lock:
+            return {row[0] for row in self._db.execute("SELECT asset_id FROM assets WHERE album = ?", (name,))}
+
+    def iter_assets(self, name):
+        """
+        Go through the photos of an album, in album order (read from the cache as they are needed)
+
+        :return: a generator of CachedAssets
+        """
+        rank = -1
+        while True:
+            with self._lock:
+                rows = self._db.execute("SELECT rank, %s FROM assets WHERE album = ? AND rank > ? ORDER BY rank LIMIT 500"
+                                        % _ASSET_COLUMNS, (name, rank)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield CachedAsset(*row[1:8], json.loads(row[8]), json.loads(row[9]))
+            rank = rows[-1][0]
+
+    @staticmethod
+    def _get_asset_row(name, rank, photo):
+        """
+        :type photo: pyicloud.services.photos.PhotoAsset
+        """
+        width, height = photo.dimensions
+        return (name, rank, photo.id, photo.filename, _get_field(photo._master_record, "itemType"), width, height,
+                _get_field(photo._master_record, "originalOrientation"),
+                photo._master_record.get("modified", {}).get("timestamp"),
+                json.dumps(photo._master_record), json.dumps(photo._asset_record))
+
+    def replace_album(self, name, photos, item_count, refreshed):
+        """
+        Replace all the photos of an album. The photos are added in one transaction, so the cache is unchanged if
+        reading them fails
+
+        :param name: the album name
+        :param photos: iterable of PhotoAssets, in album order
+        :param item_count: the number of photos in the album
+        :param refreshed: the time the album was read
+        """
+        rows = (self._get_asset_row(name, rank, photo) for rank, photo in enumerate(photos))
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM assets WHERE album = ?", (name,))
+            self._db.executemany("INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.execute("INSERT OR REPLACE INTO albums VALUES (?, ?, ?, ?)", (name, item_count, refreshed, refreshed))
+
+    def add_assets(self, name, photos, item_count, refreshed):
+        """
+        Add new photos to the end of an album
+
+        :param name: the album name
+        :param photos: iterable of PhotoAssets, in album order
+        :param item_count: the number of photos in the album
+        :param refreshed: the time the album was read
+        """
+        with self._lock, self._db:
+            last_rank = self._db.execute("SELECT COALESCE(MAX(rank), -1) FROM assets WHERE album = ?",
+                                         (name,)).fetchone()[0]
+            self._db.executemany("INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (self._get_asset_row(name, last_rank + 1 + i, photo) for i, photo in enumerate(photos)))
+            self._db.execute("UPDATE albums SET item_count = ?, refreshed = ? WHERE name = ?",
+                             (item_count, refreshed, name))
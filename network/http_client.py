@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "pi-cloud-frame"
+
+# responses worth retrying (the server may be overloaded or restarting)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of calling a host that has failed repeatedly (until the circuit breaker resets)
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a host after several consecutive failures, so an offline frame does not wait for a connection
+    timeout on every call. After reset_timeout one trial call is allowed: the breaker closes again if it succeeds.
+    The breaker can be used from any thread.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 60, clock=time.monotonic):
+        """
+        :param failure_threshold: number of consecutive failures that open the breaker
+        :param reset_timeout: time (seconds) before a trial call is allowed
+        :param clock: function returning the current time (seconds)
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow_request(self):
+        """
+        :return: True if a call can be made (the breaker is closed or a trial call is due)
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running or self._clock() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+            self._trial_running = False
+
+
+class HttpClient:
+    """
+    HTTP client shared by everything the frame downloads (maps, addresses, tiles): connections are pooled and kept
+    alive, every call has connect/read timeouts, failed calls are retried with an exponential backoff and each host
+    has a circuit breaker.
+    The client can be used from any thread.
+    """
+
+    def __init__(self, connect_timeout: float = 3.05, read_timeout: float = 10, retries: int = 2,
+                 backoff: float = 0.5, failure_threshold: int = 3, reset_timeout: float = 60, pool_size: int = 4,
+                 user_agent: str = USER_AGENT, sleep=time.sleep, clock=time.monotonic):
+        """
+        :param connect_timeout: time (seconds) to wait for a connection
+        :param read_timeout: time (seconds) to wait for data from the server
+        :param retries: number of times a failed call is retried
+        :param backoff: delay (seconds) before the first retry (doubled for each retry)
+        :param failure_threshold: number of consecutive failed calls that open the circuit breaker of a host
+        :param reset_timeout: time (seconds) a host is not called once its circuit breaker is open
+        :param pool_size: number of connections kept alive for each host
+        :param user_agent: the User-Agent header sent
+        :param sleep: function(seconds) used to wait between retries
+        :param clock: function returning the current time (seconds), used by the circuit breakers
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._sleep = sleep
+        self._clock = clock
+
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = user_agent
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get_breaker(self, url):
+        """
+        :return: the CircuitBreaker of the host of a URL
+        """
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout, self._clock)
+            return self._breakers[host]
+
+    def get(self, url, **kwargs):
+        """
+        Send a GET request, retrying connection errors, timeouts and server errors
+
+        :param url: the URL
+        :param kwargs: other arguments for requests.Session.get (e.g. params, headers)
+        :return: the requests.Response (which may have an error status once the retries are used up)
+        :except CircuitOpenError: if the host has failed repeatedly and is not being called
+        :except requests.exceptions.RequestException: if the request failed on every try
+        """
+        breaker = self.get_breaker(url)
+        if not breaker.allow_request():
+            raise CircuitOpenError("Not calling %s: it failed repeatedly" % urlsplit(url).netloc)
+
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            try:
+                response = self._session.get(url, **kwargs)
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                if attempt >= self.retries:
+                    breaker.record_failure()
+                    return response
+                logger.debug("HTTP %d from %s. Retrying", response.status_code, url)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.retries:
+                    breaker.record_failure()
+                    raise
+                logger.debug("Error calling %s (%s). Retrying", url, e)
+            except requests.exceptions.RequestException:
+                breaker.record_failure()
+                raise
+
+            self._sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def close(self):
+        self._session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client():
+    """
+    :return: the HttpClient shared by the frame (created with the default settings if not set)
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
+
+
+def set_default_client(client: HttpClient):
+    """
+    Replace the HttpClient shared by the frame (e.g. with one using the settings from the config file)
+    """
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
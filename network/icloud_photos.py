@@ -1,14 +1,29 @@
+import json
 import logging
 import os
+import re
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlencode
 
+from hurry.filesize import size as naturalsize
 from pyicloud import PyiCloudService
+from pyicloud.services.photos import PhotoAsset
 from tqdm import tqdm
 
+from network.sync_manifest import SyncedAsset, get_part_path
 from utils import photo_utils
 
 logger = logging.getLogger(__name__)
 
+DOWNLOAD_CHUNK_SIZE = 256 * 1024  # bytes
+DOWNLOAD_TIMEOUT = (10, 60)  # connect, read (seconds)
+ALBUM_REFRESH_DAYS = 7  # time before the whole of a cached album is read again
+
+_claim_lock = threading.Lock()  # see IcloudPhotos.get_local_path
+
 
 class IcloudPhotos:
 
@@ -112,52 +127,278 @@ class IcloudPhotos:
         logger.debug("[requested_orientation %s OK]", photo_orientation)
         return True
 
-    def get_all_photos(self, album, requested_orientation):
+    def iter_photos(self, album, requested_orientation):
         """
-        Retrieve all network from the specified icloud album. Only network that are images and match the requested requested_orientation are returned.
+        Go through the specified icloud album, one photo at a time (the album is read from the icloud as the photos are
+        needed). Only network that are images and match the requested requested_orientation are returned.
 
         @:param album: the icloud album to search
         @:param requested_orientation: the requested_orientation of the network (portrait, landscape or None)
-        @:return: a list of matching network
+        @:return: a generator of matching network
         """
         logger.debug("requested_orientation = %s", requested_orientation)
-        eligible_photos = []
         for i, photo in enumerate(self.api.photos.albums[album]):
             logger.debug("%d - Checking %s", i, photo.filename)
             # asset_types.add(photo._master_record["fields"]["itemType"]["value"])
             if IcloudPhotos.is_image(photo) and IcloudPhotos.is_correct_format(photo, requested_orientation):
                 logger.debug("Adding photo")
-                eligible_photos.append(photo)
+                yield photo
             else:
                 logger.debug("Skipping %s", photo.filename)
 
-        return eligible_photos
+    def get_all_photos(self, album, requested_orientation):
+        """
+        Retrieve all network from the specified icloud album. Only network that are images and match the requested requested_orientation are returned.
+
+        @:param album: the icloud album to search
+        @:param requested_orientation: the requested_orientation of the network (portrait, landscape or None)
+        @:return: a list of matching network
+        """
+        return list(self.iter_photos(album, requested_orientation))
+
+    @staticmethod
+    def _get_newest_first(album):
+        """
+        :return: the album, ordered from the last photo (normally the most recently added) to the first
+        """
+        if album.direction == "DESCENDING":
+            return album
+        return type(album)(album.service, album.name, album.list_type, album.obj_type, "DESCENDING",
+                           album.query_filter, album.page_size)
+
+    def refresh_album(self, cache, album, max_age=ALBUM_REFRESH_DAYS * 24 * 3600):
+        """
+        Update the cached metadata of the photos in an album. Only the new photos at the end of the album are read from
+        the icloud, unless the photos in the album changed in other ways (e.g. photos were removed) or the whole album
+        has not been read for max_age.
+
+        :param cache: the AlbumCache
+        :param album: the icloud album
+        :param max_age: time (seconds) before the whole album is read again (0 to read it now)
+        :return: the number of photos read from the icloud
+        """
+        icloud_album = self.api.photos.albums[album]
+        item_count = len(icloud_album)
+        cached = cache.get_album(album)
+        now = time.time()
+
+        if cached and now - cached.full_refresh < max_age:
+            cached_ids = cache.get_asset_ids(album)
+            new_photos = []
+            for photo in self._get_newest_first(icloud_album):
+                if photo.id in cached_ids:
+                    break
+                new_photos.append(photo)
+
+            if cached.item_count + len(new_photos) == item_count:
+                logger.info("Album %s: %d new photos", album, len(new_photos))
+                cache.add_assets(album, reversed(new_photos), item_count, now)
+                return len(new_photos)
+            logger.info("Album %s changed (%d photos, %d cached, %d new). Reading the whole album", album, item_count,
+                        cached.item_count, len(new_photos))
+
+        logger.info("Reading album %s (%d photos)", album, item_count)
+        cache.replace_album(album, icloud_album, item_count, now)
+        return item_count
+
+    def iter_cached_photos(self, cache, album, requested_orientation):
+        """
+        Go through the cached photos of an album (see refresh_album). Only network that are images and match the
+        requested requested_orientation are returned.
+        The photos cannot be downloaded until they are updated with get_current_photos (the download links expire).
+
+        :param cache: the AlbumCache
+        :param album: the album name
+        :param requested_orientation: the requested_orientation of the network (portrait, landscape or None)
+        :return: a generator of matching network
+        """
+        for asset in cache.iter_assets(album):
+            photo = PhotoAsset(self.api.photos, asset.master_record, asset.asset_record)
+            if IcloudPhotos.is_image(photo) and IcloudPhotos.is_correct_format(photo, requested_orientation):
+                yield photo
+
+    def get_current_photos(self, photos):
+        """
+        Read the current records (with new download links) of photos from the icloud, in one request
+
+        :param photos: the photos
+        :return: list of the photos, updated (photos no longer in the icloud are left out)
+        """
+        if not photos:
+            return []
+
+        service = self.api.photos
+        record_names = [name for photo in photos for name in (photo.id, photo._asset_record["recordName"])]
+        response = service.session.post(
+            "%s/records/lookup?%s" % (service.service_endpoint, urlencode(service.params)),
+            data=json.dumps({"records": [{"recordName": name} for name in record_names],
+                             "zoneID": {"zoneName": "PrimarySync"}}),
+            headers={"Content-type": "text/plain"})
+        records = {record["recordName"]: record for record in response.json()["records"] if "fields" in record}
+
+        current_photos = []
+        for photo in photos:
+            master_record, asset_record = records.get(photo.id), records.get(photo._asset_record["recordName"])
+            if master_record and asset_record:
+                current_photos.append(PhotoAsset(service, master_record, asset_record))
+            else:
+                logger.warning("%s is no longer in the icloud", photo.filename)
+        return current_photos
+
+    @staticmethod
+    def _get_download_resource(photo):
+        """
+        Get the version of a photo to download
+
+        :type photo: pyicloud.services.photos.PhotoAsset
+        :param photo: the photo
+        :return: dictionary with the downloadURL, size and fileChecksum of the version
+        """
+        # try latest record first (if available)
+        try:
+            return photo._asset_record["fields"]["resJPEGFullRes"]["value"]
+
+        # otherwise get original record
+        except KeyError:
+            return photo._master_record["fields"]["resOriginalRes"]["value"]
+
+    @staticmethod
+    def get_local_path(photo, folder, claimed, manifest=None):
+        """
+        Get where to store a photo: under its filename, unless another photo with the same name (e.g. IMG_0001.JPG
+        from two cameras) is already stored there, in which case the ID of the photo is added to the name
+
+        :param photo: the photo
+        :param folder: the folder to store the photo
+        :param claimed: dictionary of path -> ID of the photo stored there, shared by the downloads to the folder
+        :param manifest: the SyncManifest of the folder (the paths of the photos downloaded by earlier syncs)
+        :return: the path of the photo
+        """
+        name, extension = os.path.splitext(photo.filename)
+        paths = [os.path.join(folder, filename)
+                 for filename in (photo.filename, "%s_%s%s" % (name, re.sub(r"\W", "", photo.id), extension))]
+        asset = manifest.get(photo.id) if manifest else None
+        if asset and asset.path in paths:  # keep the name of a photo already downloaded
+            paths.insert(0, asset.path)
+
+        with _claim_lock:
+            for path in paths:
+                if claimed.get(path, photo.id) == photo.id and not (manifest and manifest.is_path_used(path, photo.id)):
+                    claimed[path] = photo.id
+                    return path
+        raise ValueError("%s is already used by another photo" % paths[-1])
+
+    @staticmethod
+    def _download_photo(photo, path, chunk_size, manifest=None, cancel=None):
+        """
+        Download a photo to a part file, streamed in chunks, then rename it (so a partly downloaded photo is never
+        left under the photo's name).
+        With a manifest, a photo already downloaded is skipped and an interrupted download is resumed from its part file.
+
+        :param path: where to store the photo (see get_local_path)
+        :param cancel: a threading.Event set to stop the download (between chunks)
+        :return: the number of bytes downloaded
+        :except InterruptedError: if the download is cancelled
+        """
+        logger.debug("[%s %s %s]", photo.filename, photo.dimensions,
+                     photo._master_record["fields"]["originalOrientation"]["value"])
+
+        resource = IcloudPhotos._get_download_resource(photo)
+        size, checksum = resource.get("size"), resource.get("fileChecksum")
+        if manifest and manifest.is_synced(photo.id, path, size, checksum):
+            logger.debug("%s already downloaded", photo.filename)
+            return 0
+
+        part_path = get_part_path(path)
+        offset = 0
+        if manifest:
+            asset = manifest.get(photo.id)
+            if asset and not asset.complete and (asset.path, asset.size, asset.checksum) == (path, size, checksum) \
+                    and size and os.path.exists(part_path):
+                offset = os.path.getsize(part_path)
+                if offset >= size:
+                    offset = 0  # not a part of this photo
+            manifest.put(SyncedAsset(photo.id, path, size, checksum, time.time(), False))
+
+        headers = {"Range": "bytes=%d-" % offset} if offset else {}
+        with photo._service.session.get(resource["downloadURL"], stream=True, timeout=DOWNLOAD_TIMEOUT,
+                                        headers=headers) as response:
+            response.raise_for_status()
+            if offset and response.status_code != 206:
+                offset = 0  # the server sent the whole photo
+            logger.debug("Downloading %s from byte %d", photo.filename, offset)
+
+            downloaded = 0
+            try:
+                with open(part_path, "ab" if offset else "wb") as opened_file:
+                    for chunk in response.iter_content(chunk_size):
+                        if cancel is not None and cancel.is_set():
+                            raise InterruptedError("download cancelled")
+                        opened_file.write(chunk)
+                        downloaded += len(chunk)
+                if size is not None and offset + downloaded != size:
+                    raise OSError("downloaded %d of %d bytes" % (offset + downloaded, size))
+            except BaseException:
+                if not manifest:  # the download cannot be resumed
+                    os.remove(part_path)
+                raise
+
+        os.replace(part_path, path)
+        if manifest:
+            manifest.put(SyncedAsset(photo.id, path, offset + downloaded, checksum, time.time(), True))
+        return downloaded
 
     @staticmethod
-    def download(photos, folder):
+    def download(photos, folder, workers=4, chunk_size=DOWNLOAD_CHUNK_SIZE, manifest=None):
         """
-        Download the specific network from the icloud and store them locally
+        Download the specific network from the icloud and store them locally.
+        Several photos are downloaded at once, each streamed to disk in chunks (a photo is never held in memory).
 
         :param photos: list of network to download
         :param folder: the folder to store the network locally
+        :param workers: number of photos downloaded at once
+        :param chunk_size: size (bytes) of the chunks written to disk
+        :param manifest: the SyncManifest of the folder, to skip the photos already downloaded (None to download all)
+        :return: list of the photos that could not be downloaded
         """
-        for i, photo in tqdm(enumerate(photos), desc="Downloading photos", unit="photo", total=len(photos)):
-            with open(os.path.join(folder, photo.filename), 'wb') as opened_file:
-                logger.debug("%d - [%s %s %s]", i, photo.filename, photo.dimensions,
-                             photo._master_record["fields"]["originalOrientation"]["value"])
-
-                # try latest record first (if available)
-                try:
-                    url = photo._asset_record["fields"]["resJPEGFullRes"]["value"]["downloadURL"]
-                    data = photo._service.session.get(
-                        url,
-                        stream=True
-                    ).raw.read()
-
-                # otherwise get original record
-                except KeyError:
-                    data = photo.download().raw.read()
-                opened_file.write(data)
+        claimed = {}
+        paths = []  # where to store the photos (in the order of the photos), or the error finding it
+        paths_lock = threading.Lock()
+
+        def download_photo(index):
+            # where to store a photo is found by its task, so a photo that cannot be stored only fails itself, but in
+            # the order of the photos, so photos with the same filename always get the same names
+            with paths_lock:
+                for photo in photos[len(paths):index + 1]:
+                    try:
+                        paths.append(IcloudPhotos.get_local_path(photo, folder, claimed, manifest))
+                    except ValueError as e:
+                        paths.append(e)
+            if isinstance(paths[index], ValueError):
+                raise paths[index]
+            return IcloudPhotos._download_photo(photos[index], paths[index], chunk_size, manifest)
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as executor, \
+                tqdm(desc="Downloading photos", unit="photo", total=len(photos)) as progress:
+            futures = {executor.submit(download_photo, index): photo for index, photo in enumerate(photos)}
+            total_size = 0
+            try:
+                for future in as_completed(futures):
+                    photo = futures[future]
+                    try:
+                        total_size += future.result()
+                    except Exception as e:  # keep going: one bad photo (e.g. no download link) must not stop the others
+                        logger.error("Error downloading %s - %s", photo.filename, e)
+                        failed.append(photo)
+                    progress.set_postfix_str(naturalsize(total_size), refresh=False)
+                    progress.update()
+            except BaseException:  # e.g. Ctrl-C: do not start the photos still waiting
+                for future in futures:
+                    future.cancel()
+                raise
+
+        return failed
 
     def get_albums(self):
         return self.api.photos.albums
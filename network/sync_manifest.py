@@ -0,0 +1,178 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from utils.photo_convert import get_target_filename
+
+logger = logging.getLogger(__name__)
+
+# a photo downloaded (or being downloaded) from the cloud
+# size and checksum are those of the cloud copy: a new download is needed if they change
+# complete is False while the photo is only partly downloaded (in the part file)
+SyncedAsset = namedtuple("SyncedAsset", ["asset_id", "path", "size", "checksum", "last_seen", "complete"])
+
+_COLUMNS = ", ".join(SyncedAsset._fields)
+
+
+class SyncManifest:
+    """
+    SQLite record of the photos downloaded from the cloud, so a sync only downloads new or changed photos, resumes
+    interrupted downloads and can remove photos that are no longer in the album.
+    Several albums (or syncs for different orientations) can share a folder: the manifest records the albums each
+    photo has been seen in, and a photo is only removed once it is no longer in any of them.
+    The manifest can be used from any thread.
+    """
+
+    def __init__(self, db_filename: str):
+        """
+        Open (or create) the manifest
+
+        :param db_filename: the location of the SQLite database (":memory:" for a temporary manifest)
+        """
+        if db_filename != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_filename)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_filename, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS assets ("
+                             "asset_id TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER, checksum TEXT, "
+                             "last_seen REAL, complete INTEGER)")
+            # the albums each photo was seen in (when the album was last listed)
+            self._db.execute("CREATE TABLE IF NOT EXISTS album_assets ("
+                             "album TEXT NOT NULL, asset_id TEXT NOT NULL, last_seen REAL, "
+                             "PRIMARY KEY (album, asset_id))")
+
+    def get(self, asset_id):
+        """
+        :param asset_id: the cloud ID of the photo
+        :return: the SyncedAsset or None if the photo has never been downloaded
+        """
+        with self._lock:
+            row = self._db.execute("SELECT %s FROM assets WHERE asset_id = ?" % _COLUMNS, (asset_id,)).fetchone()
+        return SyncedAsset(*row[:5], bool(row[5])) if row else None
+
+    def is_synced(self, asset_id, path, size, checksum):
+        """
+        Check if a photo has already been downloaded and is unchanged (in the cloud and on disk)
+
+        :param asset_id: the cloud ID of the photo
+        :param path: where the photo is stored
+        :param size: the size of the photo in the cloud (bytes, None if unknown)
+        :param checksum: the checksum of the photo in the cloud (None if unknown)
+        :return: True if the photo does not need to be downloaded
+        """
+        asset = self.get(asset_id)
+        if asset is None or not asset.complete or asset.path != path or asset.checksum != checksum:
+            return False
+        if size is not None and asset.size != size:
+            return False
+        try:
+            return os.path.getsize(path) == asset.size
+        except OSError:
+            return False
+
+    def is_path_used(self, path, asset_id):
+        """
+        :return: True if a path is recorded for another photo than asset_id
+        """
+        with self._lock:
+            return self._is_path_used(path, asset_id)
+
+    def _is_path_used(self, path, asset_id):
+        return self._db.execute("SELECT 1 FROM assets WHERE path = ? AND asset_id != ? LIMIT 1",
+                                (path, asset_id)).fetchone() is not None
+
+    def put(self, asset: SyncedAsset):
+        """
+        Record a photo
+
+        :except ValueError: if the path is already recorded for another photo (each photo needs its own file)
+        """
+        with self._lock, self._db:
+            if self._is_path_used(asset.path, asset.asset_id):
+                raise ValueError("%s is already used by another photo" % asset.path)
+            self._db.execute("INSERT OR REPLACE INTO assets (%s) VALUES (?, ?, ?, ?, ?, ?)" % _COLUMNS, asset)
+
+    def mark_seen(self, album, asset_ids, seen=None):
+        """
+        Record that photos are in an album (all the photos of the album, whatever their type or orientation, so the
+        photos downloaded by other syncs to the folder are not removed)
+
+        :param album: the album name
+        :param asset_ids: the cloud IDs of the photos
+        :param seen: the time the album was listed (default: now)
+        """
+        seen = time.time() if seen is None else seen
+        asset_ids = list(asset_ids)
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO album_assets VALUES (?, ?, ?)",
+                                 ((album, asset_id, seen) for asset_id in asset_ids))
+            self._db.executemany("UPDATE assets SET last_seen = ? WHERE asset_id = ?",
+                                 ((seen, asset_id) for asset_id in asset_ids))
+
+    def get_unseen(self, album, since):
+        """
+        :param album: the album name
+        :param since: the time the album was listed
+        :return: list of the SyncedAssets not seen in the album since then, and not in any other album
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT %s FROM assets WHERE asset_id IN "
+                                    "(SELECT asset_id FROM album_assets WHERE album = ? AND last_seen < ?) "
+                                    "AND asset_id NOT IN "
+                                    "(SELECT asset_id FROM album_assets WHERE album != ?)"
+                                    % _COLUMNS, (album, since, album)).fetchall()
+        return [SyncedAsset(*row[:5], bool(row[5])) for row in rows]
+
+    def remove(self, asset_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM assets WHERE asset_id = ?", (asset_id,))
+            self._db.execute("DELETE FROM album_assets WHERE asset_id = ?", (asset_id,))
+
+    def prune(self, album, since, target_folders=()):
+        """
+        Delete the local copies of the photos not seen in an album since a time (i.e. removed from the album), unless
+        they are in another album synced to the folder. Photos never seen in an album are kept.
+
+        :param album: the album name
+        :param since: the time the album was listed
+        :param target_folders: the folders of the photos converted for the frames (see utils.photo_convert), to
+            delete the converted copies too
+        :return: the number of photos deleted
+        """
+        unseen = self.get_unseen(album, since)
+        for asset in unseen:
+            targets = [os.path.join(folder, get_target_filename(os.path.basename(asset.path)))
+                       for folder in target_folders]
+            for path in [asset.path, get_part_path(asset.path)] + targets:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.remove(asset.asset_id)
+            logger.info("Removed %s (no longer in the album)", asset.path)
+
+        # forget the other photos removed from the album (e.g. never downloaded, or still in another album)
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM album_assets WHERE album = ? AND last_seen < ?", (album, since))
+        return len(unseen)
+
+    def get_stats(self):
+        """
+        :return: number of photos, total size of the photos (bytes)
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM assets WHERE complete").fetchone()
+
+
+def get_part_path(path):
+    """
+    :return: where a photo is stored while it is being downloaded (a hidden file next to the photo)
+    """
+    folder, filename = os.path.split(path)
+    return os.path.join(folder, "." + filename + ".part")
@@ -0,0 +1,315 @@
+import functools
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from hurry.filesize import size as naturalsize
+from tqdm import tqdm
+
+from network.icloud_photos import DOWNLOAD_CHUNK_SIZE, IcloudPhotos
+from utils import photo_convert
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_BATCH_SIZE = 100  # photos looked up in the icloud at once (for their current download links)
+QUEUE_SIZE = 8  # photos waiting between two stages of the pipeline
+
+# the result of a sync
+# failed_downloads are the photos that could not be downloaded, failed_conversions the ConvertResults with errors
+SyncResult = namedtuple("SyncResult", ["photos", "downloaded", "converted", "failed_downloads", "failed_conversions"])
+
+_DONE = object()  # end of the photos in a queue
+
+
+def _get_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class SyncPipeline:
+    """
+    Download photos from the icloud and prepare them for the frame profiles, as a pipeline of stages running at the
+    same time: photos are looked up (for their download links), downloaded (by several threads) and converted (by a
+    pool of processes) as they go, so converting the photos runs while the next photos are downloaded.
+
+    The stages are joined by bounded queues: a stage waits when the next one is behind, so only a few photos are in
+    the pipeline at once. Without keep_originals, the downloaded photos are deleted once converted, so the disk space
+    used by the originals depends on the size of the queues and not on the number of photos.
+    The pipeline stops cleanly if it is interrupted (e.g. Ctrl-C): the photos waiting are dropped, and interrupted
+    downloads are resumed on the next sync (with a manifest).
+    """
+
+    def __init__(self, folder, profiles=(), manifest=None, lookup=None, download_workers=4, convert_workers=None,
+                 queue_size=QUEUE_SIZE, keep_originals=True, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                 quality=photo_convert.JPEG_QUALITY):
+        """
+        :param folder: the folder to download the photos to
+        :param profiles: the FrameProfiles to prepare the photos for (none to only download the photos)
+        :param manifest: the SyncManifest of the folder, to skip the photos already downloaded (None to download all)
+        :param lookup: function returning the current version of a list of photos, e.g. IcloudPhotos.get_current_photos
+            for photos read from the album cache (None to download the photos as they are)
+        :param download_workers: number of photos downloaded at once
+        :param convert_workers: number of processes converting photos (default: the number of CPUs)
+        :param queue_size: number of photos waiting between two stages
+        :param keep_originals: keep the downloaded photos (False to delete them once converted for every profile)
+        :param chunk_size: size (bytes) of the chunks written to disk
+        :param quality: the JPEG quality of the converted photos
+        """
+        if not keep_originals and not profiles:
+            raise ValueError("The downloaded photos can only be deleted once converted for a frame profile")
+
+        self.folder = folder
+        self.profiles = list(profiles)
+        self.manifest = manifest
+        self.lookup = lookup
+        self.download_workers = download_workers
+        self.convert_workers = convert_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.keep_originals = keep_originals
+        self.chunk_size = chunk_size
+        self.quality = quality
+
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def _put(self, items, item):
+        """
+        Add to a queue, waiting while it is full (unless the pipeline is cancelled)
+
+        :return: False if the pipeline has been cancelled
+        """
+        while not self._cancel.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, items):
+        """
+        Take from a queue, waiting while it is empty (unless the pipeline is cancelled)
+
+        :return: the item or _DONE if the pipeline has been cancelled
+        """
+        while not self._cancel.is_set():
+            try:
+                return items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _get_renders(self, photo, source):
+        """
+        :param source: where the photo is stored (see IcloudPhotos.get_local_path)
+        :return: list of (FrameProfile, target) for the profiles of the photo's orientation that need the photo
+        """
+        renders = []
+        for profile in self.profiles:
+            if not IcloudPhotos.is_correct_format(photo, profile.orientation):
+                continue
+            target = os.path.join(profile.output, photo_convert.get_target_filename(os.path.basename(source)))
+            if self.keep_originals:
+                # the original may have changed since it was converted
+                if photo_convert.is_converted(source, target):
+                    continue
+            elif os.path.exists(target):
+                continue
+            renders.append((profile, target))
+        return renders
+
+    def _enumerate(self, photos, downloads):
+        """
+        Stage 1: look up the photos (in batches) and queue them for downloading, with where to store them
+        """
+        claimed = {}
+        try:
+            for batch in _get_batches(photos, LOOKUP_BATCH_SIZE):
+                if self._cancel.is_set():
+                    return
+                for photo in self.lookup(batch) if self.lookup else batch:
+                    path = IcloudPhotos.get_local_path(photo, self.folder, claimed, self.manifest)
+                    if not self._put(downloads, (photo, path)):
+                        return
+        except Exception as e:
+            logger.error("Error listing the photos - %s", e)
+            self._error = e
+            self._cancel.set()
+        finally:
+            for _ in range(self.download_workers):
+                self._put(downloads, _DONE)
+
+    def _download(self, downloads, conversions, progress):
+        """
+        Stage 2: download the photos (unless already downloaded) and queue them for converting
+        """
+        try:
+            while True:
+                download = self._get(downloads)
+                if download is _DONE:
+                    return
+                photo, path = download
+
+                try:
+                    # without keep_originals, a photo already converted for every frame is not downloaded again
+                    renders = None if self.keep_originals else self._get_renders(photo, path)
+                    if renders is None or renders:
+                        downloaded = IcloudPhotos._download_photo(photo, path, self.chunk_size, self.manifest,
+                                                                  self._cancel)
+                        with self._lock:
+                            self._downloaded += downloaded
+
+                        if self.keep_originals:  # the photo may be new or have changed since it was converted
+                            renders = self._get_renders(photo, path)
+                except Exception as e:  # keep going: one bad photo (e.g. no download link) must not stop the others
+                    if self._cancel.is_set():
+                        return
+                    logger.error("Error downloading %s - %s", photo.filename, e)
+                    with self._lock:
+                        self._failed_downloads.append(photo)
+                    self._finish_photo(progress)
+                    continue
+
+                if renders:
+                    if not self._put(conversions, (path, renders)):
+                        return
+                else:
+                    self._finish_photo(progress)
+        finally:
+            self._put(conversions, _DONE)
+
+    def _convert(self, conversions, executor, progress):
+        """
+        Stage 3: convert the photos on the pool of processes, a few at a time (so photos wait in the queue, not in
+        the pool)
+        """
+        running = threading.Semaphore(self.convert_workers)
+        downloaders = self.download_workers
+
+        def on_converted(source, future):
+            running.release()
+            with self._lock:
+                self._futures.discard(future)
+            if future.cancelled():
+                return
+            try:
+                result = future.result()
+            except Exception as e:  # e.g. the process was killed
+                result = photo_convert.ConvertResult(source, [], 0, str(e) or type(e).__name__)
+            if result.error:
+                logger.error("Error converting %s - %s", result.source, result.error)
+                with self._lock:
+                    self._failed_conversions.append(result)
+            else:
+                logger.info("Converted %s to %d frames in %.0f ms", result.source, len(result.targets),
+                            result.seconds * 1000)
+                with self._lock:
+                    self._converted += 1
+            if not self.keep_originals:
+                try:
+                    os.remove(result.source)
+                except FileNotFoundError:
+                    pass
+            self._finish_photo(progress)
+
+        try:
+            while downloaders:
+                conversion = self._get(conversions)
+                if conversion is _DONE:
+                    if self._cancel.is_set():
+                        return
+                    downloaders -= 1
+                    continue
+                while not running.acquire(timeout=0.1):
+                    if self._cancel.is_set():
+                        return
+                source, renders = conversion
+                future = executor.submit(photo_convert.render_photo_job, source, renders, self.quality)
+                with self._lock:
+                    self._futures.add(future)
+                future.add_done_callback(functools.partial(on_converted, source))
+        except Exception as e:  # e.g. the pool is broken (a process was killed): stop the other stages
+            logger.error("Error converting the photos - %s", e)
+            self._error = e
+            self._cancel.set()
+            return
+
+        # wait for the last photos
+        for _ in range(self.convert_workers):
+            while not running.acquire(timeout=0.1):
+                if self._cancel.is_set():
+                    return
+
+    def _finish_photo(self, progress):
+        with self._lock:
+            self._photos += 1
+            progress.set_postfix_str(naturalsize(self._downloaded), refresh=False)
+            progress.update()
+
+    def run(self, photos, total=None):
+        """
+        Sync photos. Returns when every photo has been downloaded and converted
+
+        :param photos: iterable of photos (read as they are needed)
+        :param total: the number of photos, if known (for the progress bar)
+        :return: the SyncResult
+        :except KeyboardInterrupt: if interrupted (once the pipeline has stopped)
+        """
+        self._cancel.clear()
+        self._error = None
+        self._photos = self._downloaded = self._converted = 0
+        self._failed_downloads = []
+        self._failed_conversions = []
+        self._futures = set()  # the conversions submitted and not finished
+
+        os.makedirs(self.folder, exist_ok=True)
+        for profile in self.profiles:
+            os.makedirs(profile.output, exist_ok=True)
+
+        start = time.perf_counter()
+        downloads = queue.Queue(self.queue_size)
+        conversions = queue.Queue(self.queue_size)
+        # the pool is created before the threads of the stages (see photo_convert.create_process_pool)
+        with tqdm(desc="Syncing photos", unit="photo", total=total) as progress, \
+                photo_convert.create_process_pool(self.convert_workers) as executor:
+            threads = [threading.Thread(target=self._enumerate, args=(photos, downloads), name="sync-lookup")]
+            threads += [threading.Thread(target=self._download, args=(downloads, conversions, progress),
+                                         name="sync-download-%d" % i) for i in range(self.download_workers)]
+            threads += [threading.Thread(target=self._convert, args=(conversions, executor, progress),
+                                         name="sync-convert")]
+            for thread in threads:
+                thread.start()
+
+            try:
+                for thread in threads:
+                    while thread.is_alive():
+                        thread.join(0.1)
+            except BaseException:  # e.g. Ctrl-C: stop every stage, dropping the photos waiting
+                logger.warning("Stopping the sync...")
+                self._cancel.set()
+                with self._lock:
+                    futures = list(self._futures)
+                for future in futures:  # the photos not being converted yet
+                    future.cancel()
+                executor.shutdown(wait=False)
+                for thread in threads:
+                    thread.join()
+                raise
+
+        if self._error is not None:
+            raise self._error
+
+        elapsed = time.perf_counter() - start
+        logger.info("Synced %d photos in %.1f s (%.1f photos/s): %s downloaded, %d converted", self._photos, elapsed,
+                    self._photos / elapsed if elapsed else 0, naturalsize(self._downloaded), self._converted)
+        return SyncResult(self._photos, self._downloaded, self._converted, self._failed_downloads,
+                          self._failed_conversions)
@@ -0,0 +1,124 @@
+#! /usr/bin/env python3
+
+import argparse
+import logging.config
+import os
+import sys
+import time
+
+import requests
+import yaml
+
+from network.http_client import CircuitOpenError, HttpClient
+from utils.catalog import MediaCatalog
+from utils.config import Config
+from utils.tile_store import TileStore, get_tiles_around
+
+LOG_CONFIG = "logging.yml"
+with open(LOG_CONFIG, 'rt') as f:
+    logging.config.dictConfig(yaml.safe_load(f.read()))
+
+logger = logging.getLogger(__name__)
+
+TILE_URL = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+MAP_SIZE = 350  # size of the map in the popup
+
+# the OpenStreetMap tile server does not allow bulk downloads (https://operations.osmfoundation.org/policies/tiles/),
+# so only a few tiles are downloaded from it at once: use --url for a tile server that allows more
+OSM_MAX_ZOOM = 16  # highest zoom level downloaded from OpenStreetMap
+OSM_MAX_TILES = 250  # tiles downloaded from OpenStreetMap per run
+
+
+def get_media_folders(config):
+    """
+    Get the folders of all the photo players in the frame config
+    """
+    frame_config = config.get_config_value("frame", config.root)
+    root_folder = config.get_config_value("root_folder", frame_config)
+    players_config = config.get_config_value("players", config.root) or {}
+    return [os.path.join(root_folder, config.get_config_value("folder", player_config))
+            for player_config in players_config.values() if player_config["type"] == "photo_player"]
+
+
+def get_locations(folders, catalog):
+    """
+    Find the GPS locations of all the photos in some folders (using the catalog, so photos are only read once)
+
+    :return: set of (latitude, longitude)
+    """
+    locations = set()
+    for folder in folders:
+        try:
+            with os.scandir(folder) as entries:
+                paths = [os.path.join(folder, e.name) for e in entries if not e.name.startswith(".") and e.is_file()]
+        except OSError as e:  # e.g. a player folder that does not exist (yet): seed the tiles for the other folders
+            logger.error("Cannot read folder %s - %s", folder, e)
+            continue
+        for path in paths:
+            info = catalog.get_or_scan(path)
+            if info and info.latitude is not None and info.longitude is not None:
+                locations.add((info.latitude, info.longitude))
+    return locations
+
+
+def main():
+    """
+    Read command-line args and download the map tiles needed to show the location of every photo
+    """
+    parser = argparse.ArgumentParser(
+        description="download the map tiles for the locations of the photos, so the popup can show maps offline")
+    parser.add_argument("--config", help="frame config file", default="config.yml")
+    parser.add_argument("--zoom", help="zoom level (default: map_zoom in the config)", type=int, action="append")
+    parser.add_argument("--url", help="tile server URL template (default: OpenStreetMap, limited to zoom %d and %d "
+                                      "tiles per run)" % (OSM_MAX_ZOOM, OSM_MAX_TILES))
+    parser.add_argument("--delay", help="delay between tile downloads (seconds)", type=float, default=0.1)
+    args = parser.parse_args()
+
+    config = Config(args.config)
+    frame_config = config.get_config_value("frame", config.root)
+    cache_folder = config.get_config_value("cache_folder", frame_config) or os.path.join(
+        config.get_config_value("root_folder", frame_config), ".cache")
+    tiles_filename = config.get_config_value("map_tiles", frame_config) or os.path.join(cache_folder,
+                                                                                       "map_tiles.mbtiles")
+    zoom_levels = args.zoom or [int(config.get_config_value("map_zoom", frame_config))]
+    if not args.url and max(zoom_levels) > OSM_MAX_ZOOM:
+        parser.error("tiles above zoom %d cannot be downloaded from OpenStreetMap: use --url for another tile server"
+                     % OSM_MAX_ZOOM)
+
+    catalog = MediaCatalog(os.path.join(cache_folder, "catalog.db"))
+    locations = get_locations(get_media_folders(config), catalog)
+    logger.info("Found %d photo locations", len(locations))
+
+    tile_store = TileStore(tiles_filename)
+    tiles = {(zoom, x, y) for zoom in zoom_levels for latitude, longitude in locations
+             for x, y, _left, _top in get_tiles_around(latitude, longitude, zoom, MAP_SIZE, MAP_SIZE)}
+    missing = sorted(tile for tile in tiles if not tile_store.has_tile(*tile))
+    if not args.url and len(missing) > OSM_MAX_TILES:
+        logger.warning("Only downloading %d of the %d missing tiles from OpenStreetMap: run again later for the "
+                       "others, or use --url for another tile server", OSM_MAX_TILES, len(missing))
+        missing = missing[:OSM_MAX_TILES]
+    logger.info("Downloading %d tiles (%d already stored) to %s", len(missing), len(tiles) - len(missing),
+                tiles_filename)
+
+    http_client = HttpClient(read_timeout=30, user_agent="pi-cloud-frame tile seeder")
+    errors = 0
+    for zoom, x, y in missing:
+        try:
+            response = http_client.get((args.url or TILE_URL).format(z=zoom, x=x, y=y))
+            response.raise_for_status()
+            tile_store.put_tile(zoom, x, y, response.content)
+        except CircuitOpenError as e:
+            logger.error("Stopping - %s", e)
+            errors += 1
+            break
+        except requests.exceptions.RequestException as e:
+            logger.error("Error downloading tile %d/%d/%d - %s", zoom, x, y, e)
+            errors += 1
+        time.sleep(args.delay)
+
+    logger.info("Tile store holds %d tiles (%d bytes)", *tile_store.get_stats())
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
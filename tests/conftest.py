@@ -0,0 +1,14 @@
+import pytest
+
+from utils.config import Config
+
+
+@pytest.fixture(autouse=True)
+def cache_folder(tmp_path, monkeypatch):
+    """
+    Keep the files generated by the frame (catalog, caches, derivatives, shuffle state) in a temporary folder, so the
+    tests do not write into the test media and each test starts without them
+    """
+    folder = tmp_path / "cache"
+    monkeypatch.setitem(Config.default, "cache_folder", str(folder))
+    return folder
@@ -0,0 +1,10 @@
+import socketserver
+from http.server import HTTPServer
+
+
+class LocalServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    HTTP server handling each request in its own thread, for the tests (same as http.server.ThreadingHTTPServer, which
+    needs Python 3.7)
+    """
+    daemon_threads = True
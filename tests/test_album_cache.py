@@ -0,0 +1,222 @@
+import base64
+import json
+
+import pytest
+
+from network import icloud_photos
+from network.album_cache import AlbumCache
+from network.icloud_photos import IcloudPhotos
+
+
+def _create_records(i, item_type="public.jpeg", width=400, height=300):
+    master = {"recordName": "M%d" % i, "recordType": "CPLMaster", "modified": {"timestamp": 1000 + i},
+              "fields": {"filenameEnc": {"value": base64.b64encode(b"IMG_%04d.JPG" % i).decode()},
+                         "itemType": {"value": item_type}, "originalOrientation": {"value": 1},
+                         "resOriginalWidth": {"value": width}, "resOriginalHeight": {"value": height},
+                         "resOriginalRes": {"value": {"downloadURL": "https://example.com/%d?v=1" % i}}}}
+    asset = {"recordName": "A%d" % i, "recordType": "CPLAsset",
+             "fields": {"masterRef": {"value": {"recordName": master["recordName"]}}}}
+    return master, asset
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeSession:
+    """
+    Answers the icloud photos requests made by pyicloud (0.10) from a list of photo records, counting the requests
+    """
+
+    def __init__(self):
+        self.records = []  # (master, asset) in album order
+        self.requests = {"count": 0, "page": 0, "lookup": 0}
+
+    def post(self, url, data, headers=None):
+        query = json.loads(data)
+        if "/internal/records/query/batch" in url:
+            self.requests["count"] += 1
+            return FakeResponse({"batch": [{"records": [{"fields": {"itemCount": {"value": len(self.records)}}}]}]})
+
+        if "/records/query" in url:
+            self.requests["page"] += 1
+            filters = {f["fieldName"]: f["fieldValue"]["value"] for f in query["query"]["filterBy"]}
+            offset, page_size = filters["startRank"], query["resultsLimit"] // 2
+            if filters["direction"] == "ASCENDING":
+                page = self.records[offset:offset + page_size]
+            else:
+                page = self.records[max(offset - page_size + 1, 0):offset + 1][::-1] if offset >= 0 else []
+            return FakeResponse({"records": [record for master, asset in page for record in (asset, master)]})
+
+        if "/records/lookup" in url:
+            self.requests["lookup"] += 1
+            records = {record["recordName"]: record for pair in self.records for record in pair}
+            return FakeResponse({"records": [records.get(r["recordName"], {"recordName": r["recordName"],
+                                                                            "serverErrorCode": "NOT_FOUND"})
+                                             for r in query["records"]]})
+        raise ValueError(url)
+
+
+class FakeAsset:
+    """
+    Same as pyicloud.services.photos.PhotoAsset
+    """
+
+    def __init__(self, service, master_record, asset_record):
+        self._service = service
+        self._master_record = master_record
+        self._asset_record = asset_record
+
+    @property
+    def id(self):
+        return self._master_record["recordName"]
+
+    @property
+    def filename(self):
+        return base64.b64decode(self._master_record["fields"]["filenameEnc"]["value"]).decode("utf-8")
+
+    @property
+    def dimensions(self):
+        return (self._master_record["fields"]["resOriginalWidth"]["value"],
+                self._master_record["fields"]["resOriginalHeight"]["value"])
+
+
+class FakeAlbum:
+    """
+    Same as pyicloud.services.photos.PhotoAlbum (0.10), paging through the records 100 photos at a time
+    """
+
+    def __init__(self, service, name, list_type, obj_type, direction, query_filter=None, page_size=100):
+        self.service = service
+        self.name = name
+        self.list_type = list_type
+        self.obj_type = obj_type
+        self.direction = direction
+        self.query_filter = query_filter
+        self.page_size = page_size
+
+    def __len__(self):
+        url = "%s/internal/records/query/batch" % self.service.service_endpoint
+        return self.service.session.post(url, json.dumps({})).json()["batch"][0]["records"][0]["fields"][
+            "itemCount"]["value"]
+
+    def __iter__(self):
+        offset = len(self) - 1 if self.direction == "DESCENDING" else 0
+        while True:
+            query = {"query": {"filterBy": [
+                {"fieldName": "startRank", "fieldValue": {"value": offset}},
+                {"fieldName": "direction", "fieldValue": {"value": self.direction}}]}, "resultsLimit": self.page_size * 2}
+            records = self.service.session.post("%s/records/query" % self.service.service_endpoint,
+                                                json.dumps(query)).json()["records"]
+            masters = [r for r in records if r["recordType"] == "CPLMaster"]
+            if not masters:
+                return
+            assets = {r["fields"]["masterRef"]["value"]["recordName"]: r for r in records if r["recordType"] == "CPLAsset"}
+            offset += -len(masters) if self.direction == "DESCENDING" else len(masters)
+            for master in masters:
+                yield FakeAsset(self.service, master, assets[master["recordName"]])
+
+
+class FakePhotosService:
+    def __init__(self):
+        self.service_endpoint = "https://photos.example.com"
+        self.params = {}
+        self.session = FakeSession()
+        self.albums = {"All Photos": FakeAlbum(self, "All Photos", "CPLAssetAndMasterByAddedDate",
+                                               "CPLAssetByAddedDate", "ASCENDING")}
+
+
+@pytest.fixture
+def icloud(monkeypatch):
+    monkeypatch.setattr(icloud_photos, "PhotoAsset", FakeAsset)
+    icloud = IcloudPhotos.__new__(IcloudPhotos)
+    icloud.api = type("FakeApi", (), {})()
+    icloud.api.photos = FakePhotosService()
+    return icloud
+
+
+def _get_cached_ids(icloud, cache):
+    return [photo.id for photo in icloud.iter_cached_photos(cache, "All Photos", None)]
+
+
+def test_refresh_new_photos(icloud):
+    """
+    Test the whole album is read the first time, then only the new photos
+    """
+    session = icloud.api.photos.session
+    session.records = [_create_records(i) for i in range(250)]
+    cache = AlbumCache(":memory:")
+
+    assert icloud.refresh_album(cache, "All Photos") == 250
+    assert session.requests == {"count": 1, "page": 4, "lookup": 0}  # 3 pages of photos and an empty page
+    assert _get_cached_ids(icloud, cache) == ["M%d" % i for i in range(250)]
+
+    # unchanged: one page (newest first) to check there are no new photos
+    session.requests.update(count=0, page=0)
+    assert icloud.refresh_album(cache, "All Photos") == 0
+    assert session.requests["page"] == 1
+
+    session.records += [_create_records(i) for i in range(250, 260)]
+    session.requests.update(count=0, page=0)
+    assert icloud.refresh_album(cache, "All Photos") == 10
+    assert session.requests["page"] == 1
+    assert _get_cached_ids(icloud, cache) == ["M%d" % i for i in range(260)]
+    assert cache.get_album("All Photos").item_count == 260
+
+
+def test_refresh_removed_photos(icloud):
+    """
+    Test the whole album is read again if photos were removed, or if it has not been read for max_age
+    """
+    session = icloud.api.photos.session
+    session.records = [_create_records(i) for i in range(150)]
+    cache = AlbumCache(":memory:")
+    icloud.refresh_album(cache, "All Photos")
+
+    del session.records[10]
+    session.requests.update(page=0)
+    assert icloud.refresh_album(cache, "All Photos") == 149
+    assert session.requests["page"] == 1 + 3
+    assert "M10" not in _get_cached_ids(icloud, cache)
+
+    session.requests.update(page=0)
+    assert icloud.refresh_album(cache, "All Photos", max_age=0) == 149
+    assert session.requests["page"] == 3
+
+
+def test_cached_photos_filtered(icloud):
+    """
+    Test the cached photos are filtered by type and orientation without reading the icloud
+    """
+    session = icloud.api.photos.session
+    session.records = [_create_records(0), _create_records(1, item_type="public.mpeg"),
+                       _create_records(2, width=300, height=400)]
+    cache = AlbumCache(":memory:")
+    icloud.refresh_album(cache, "All Photos")
+
+    session.requests.update(count=0, page=0)
+    assert [photo.filename for photo in icloud.iter_cached_photos(cache, "All Photos", "landscape")] == ["IMG_0000.JPG"]
+    assert [photo.id for photo in icloud.iter_cached_photos(cache, "All Photos", "portrait")] == ["M2"]
+    assert session.requests == {"count": 0, "page": 0, "lookup": 0}
+
+
+def test_get_current_photos(icloud):
+    """
+    Test the records of cached photos are read again in one request (e.g. for new download links)
+    """
+    session = icloud.api.photos.session
+    session.records = [_create_records(i) for i in range(3)]
+    cache = AlbumCache(":memory:")
+    icloud.refresh_album(cache, "All Photos")
+    photos = list(icloud.iter_cached_photos(cache, "All Photos", None))
+
+    session.records[0][0]["fields"]["resOriginalRes"]["value"]["downloadURL"] = "https://example.com/0?v=2"
+    del session.records[1]
+    current = icloud.get_current_photos(photos)
+    assert session.requests["lookup"] == 1
+    assert [photo.id for photo in current] == ["M0", "M2"]
+    assert current[0]._master_record["fields"]["resOriginalRes"]["value"]["downloadURL"].endswith("v=2")
@@ -0,0 +1,159 @@
+import os
+import shutil
+import struct
+
+from PIL import Image
+
+import utils.catalog
+from utils.catalog import MediaCatalog, read_media_info, read_media_infos
+from utils.exif_reader import read_exif
+
+
+def _create_gps_photo(filename):
+    """
+    Create a JPEG with a capture date and GPS co-ordinates (Brighton, UK)
+    """
+    exif = Image.Exif()
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x9003] = "2019:07:14 10:20:30"  # DateTimeOriginal
+    gps_ifd = exif.get_ifd(0x8825)
+    gps_ifd[1] = "N"
+    gps_ifd[2] = (50.0, 49.0, 8.59)
+    gps_ifd[3] = "W"
+    gps_ifd[4] = (0.0, 8.0, 12.45)
+    Image.new("RGB", (60, 40)).save(filename, exif=exif)
+
+
+def test_read_media_info(tmp_path):
+    photo = str(tmp_path / "gps.jpg")
+    _create_gps_photo(photo)
+
+    info = read_media_info(photo)
+    assert (info.width, info.height) == (60, 40)
+    assert info.date == "2019:07:14 10:20:30"
+    assert abs(info.latitude - 50.8190527) < 1e-6
+    assert abs(info.longitude + 0.1367917) < 1e-6
+
+
+def test_read_media_info_no_exif():
+    info = read_media_info("tests/portrait_no_exif.jpg")
+    assert (info.width, info.height) == (333, 446)
+    assert info.orientation is None
+    assert info.latitude is None
+
+
+def test_read_media_infos(tmp_path):
+    """
+    Reading many files at once gives the same metadata as reading them one by one (missing files are skipped)
+    """
+    photo = str(tmp_path / "gps.jpg")
+    _create_gps_photo(photo)
+    paths = [photo, "tests/portrait_no_exif.jpg", photo]
+
+    infos = read_media_infos([(path, os.stat(path)) for path in paths] + [(str(tmp_path / "missing.jpg"), None)])
+    assert len(infos) == 3
+    for info, path in zip(infos, paths):
+        expected = read_media_info(path)
+        assert info._replace(latitude=None, longitude=None) == expected._replace(latitude=None, longitude=None)
+        if expected.latitude is None:
+            assert info.latitude is None and info.longitude is None
+        else:
+            assert abs(info.latitude - expected.latitude) < 1e-8
+            assert abs(info.longitude - expected.longitude) < 1e-8
+
+
+def test_read_media_infos_bad_gps(tmp_path, monkeypatch):
+    """
+    Test a file with a malformed GPS location is skipped, without losing the locations of the other files
+    """
+    photo, bad_photo = str(tmp_path / "gps.jpg"), str(tmp_path / "bad_gps.jpg")
+    _create_gps_photo(photo)
+    _create_gps_photo(bad_photo)
+
+    def read_bad_exif(path):
+        exif = read_exif(path)
+        return exif._replace(gps=("x",) + exif.gps[1:]) if path == bad_photo else exif
+
+    monkeypatch.setattr(utils.catalog, "read_exif", read_bad_exif)
+    infos = read_media_infos([(path, os.stat(path)) for path in (photo, bad_photo, "tests/portrait_no_exif.jpg")])
+    assert [info.path for info in infos] == [photo, "tests/portrait_no_exif.jpg"]
+    assert abs(infos[0].latitude - 50.8190527) < 1e-6
+
+
+def test_catalog_signature(tmp_path):
+    """
+    Test catalogued metadata is only used while the file is unchanged
+    """
+    photo = str(tmp_path / "photo.jpg")
+    shutil.copy("tests/portrait_no_exif.jpg", photo)
+    catalog = MediaCatalog(str(tmp_path / "catalog.db"))
+
+    assert catalog.get(photo) is None
+    assert catalog.get_or_scan(photo).width == 333
+    assert catalog.get(photo).height == 446
+
+    os.utime(photo, ns=(0, 0))
+    assert catalog.get(photo) is None
+
+
+def test_catalog_bad_metadata(tmp_path, monkeypatch):
+    """
+    Test a file with metadata that cannot be read (not only an OSError) gets no metadata
+    """
+    def read_bad_exif(path):
+        raise struct.error("unpack requires a buffer of 8 bytes")
+
+    monkeypatch.setattr(utils.catalog, "read_exif", read_bad_exif)
+    catalog = MediaCatalog(str(tmp_path / "catalog.db"))
+    assert catalog.get_or_scan("tests/portrait_no_exif.jpg") is None
+    assert catalog.get_stats() == (0, 0)
+
+
+def test_catalog_update_keeps_id(tmp_path):
+    """
+    Test a file keeps its row (and ID) when its metadata is read again
+    """
+    photo = str(tmp_path / "photo.jpg")
+    shutil.copy("tests/portrait_no_exif.jpg", photo)
+    catalog = MediaCatalog(str(tmp_path / "catalog.db"))
+    catalog.get_or_scan(photo)
+    media_id = catalog._db.execute("SELECT id FROM media WHERE path = ?", (photo,)).fetchone()[0]
+
+    os.utime(photo, ns=(0, 0))
+    assert catalog.get_or_scan(photo).mtime == 0
+    assert catalog._db.execute("SELECT id FROM media WHERE path = ?", (photo,)).fetchall() == [(media_id,)]
+
+
+def test_background_scanner(tmp_path):
+    photo = str(tmp_path / "gps.jpg")
+    _create_gps_photo(photo)
+    catalog = MediaCatalog(str(tmp_path / "catalog.db"))
+
+    catalog.scan_in_background([photo, "tests/portrait_no_exif.jpg", str(tmp_path / "missing.jpg")])
+    catalog.wait_for_scanner()
+
+    assert catalog.get(photo).date == "2019:07:14 10:20:30"
+    assert catalog.get_stats() == (2, 1)
+
+    # the catalog is persistent
+    assert MediaCatalog(str(tmp_path / "catalog.db")).get(photo).latitude is not None
+
+
+def test_background_scanner_error(tmp_path, monkeypatch):
+    """
+    Test an error scanning files does not block wait_for_scanner or stop the scanner
+    """
+    catalog = MediaCatalog(str(tmp_path / "catalog.db"))
+
+    def fail(files):
+        raise RuntimeError("scan failed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(utils.catalog, "read_media_infos", fail)
+        catalog.scan_in_background(["tests/portrait_no_exif.jpg"])
+        catalog.wait_for_scanner()
+    assert catalog.get_stats() == (0, 0)
+
+    catalog.scan_in_background(["tests/portrait_no_exif.jpg"])
+    catalog.wait_for_scanner()
+    assert catalog.get_stats() == (1, 0)
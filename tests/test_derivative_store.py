@@ -0,0 +1,65 @@
+import os
+import shutil
+
+from PyQt5.QtGui import QImage
+
+from gui import image_loader
+from gui.derivative_store import DerivativeStore
+from gui.image_loader import RenderSettings
+
+SETTINGS = RenderSettings(400, 240, 0, None)
+
+
+def _copy_photo(tmp_path):
+    photo = str(tmp_path / "photo.png")
+    shutil.copy("tests/test_media/photos/1.png", photo)
+    return photo
+
+
+def test_save_and_load(tmp_path):
+    """
+    Test a prepared copy is served until the original photo is changed
+    """
+    photo = _copy_photo(tmp_path)
+    store = DerivativeStore(str(tmp_path / "cache"), 400, 240)
+    assert store.load(photo, SETTINGS) is None
+
+    store.save(photo, SETTINGS, QImage(400, 204, QImage.Format_RGB32))
+    image = store.load(photo, SETTINGS)
+    assert (image.width(), image.height()) == (400, 204)
+
+    # different render settings (e.g. frame rotation or orientation) need a different copy
+    assert store.load(photo, RenderSettings(400, 240, 90, True)) is None
+    assert store.load(photo, RenderSettings(400, 240, 0, False)) is None
+    assert store.load(photo, RenderSettings(240, 400, 0, None)) is None
+
+    # original photo changed: copy is stale
+    os.utime(photo, ns=(0, 0))
+    assert store.load(photo, SETTINGS) is None
+
+
+def test_geometry_changed(tmp_path):
+    """
+    Test copies made for another screen size are removed
+    """
+    photo = _copy_photo(tmp_path)
+    cache = str(tmp_path / "cache")
+    DerivativeStore(cache, 400, 240).save(photo, SETTINGS, QImage(400, 204, QImage.Format_RGB32))
+
+    DerivativeStore(cache, 800, 480)
+    assert "400x240" not in os.listdir(cache)
+
+
+def test_builder(tmp_path):
+    """
+    Test the background builder prepares copies of all photos and removes unused copies
+    """
+    photo = _copy_photo(tmp_path)
+    store = DerivativeStore(str(tmp_path / "cache"), 400, 240)
+    store.save("tests/test_media/photos/2.png", SETTINGS, QImage(400, 204, QImage.Format_RGB32))
+
+    store.start_builder([photo], SETTINGS, lambda f, s: image_loader.prepare_photo(f, s, None))
+    store._builder.join()
+
+    assert store.is_fresh(photo, SETTINGS)
+    assert not os.path.exists(store.get_path("tests/test_media/photos/2.png", SETTINGS))
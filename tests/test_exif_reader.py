@@ -0,0 +1,63 @@
+from PIL import Image
+
+from utils.exif_reader import ExifData, read_exif, read_exif_with_exifread
+
+
+def _create_photo(filename, orientation=6, **kwargs):
+    """
+    Create a JPEG with an orientation, capture date and GPS co-ordinates (Brighton, UK)
+    """
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x9003] = "2019:07:14 10:20:30"  # DateTimeOriginal
+    exif_ifd[0x927c] = b"\0" * 20000  # a large maker note, as written by cameras
+    gps_ifd = exif.get_ifd(0x8825)
+    gps_ifd[1] = "N"
+    gps_ifd[2] = (50.0, 49.0, 8.59)
+    gps_ifd[3] = "W"
+    gps_ifd[4] = (0.0, 8.0, 12.45)
+    Image.new("RGB", (60, 40)).save(filename, exif=exif, **kwargs)
+
+
+def test_read_exif(tmp_path):
+    photo = str(tmp_path / "photo.jpg")
+    _create_photo(photo)
+
+    exif = read_exif(photo)
+    assert exif.orientation == 6
+    assert exif.date == "2019:07:14 10:20:30"
+    assert exif.gps == (50.0, 49.0, 8.59, "N", 0.0, 8.0, 12.45, "W")
+    assert exif == read_exif_with_exifread(photo)
+
+
+def test_mirrored_orientation(tmp_path):
+    photo = str(tmp_path / "photo.jpg")
+    _create_photo(photo, orientation=5)
+    assert read_exif(photo).orientation is None
+
+
+def test_no_exif():
+    assert read_exif("tests/portrait_no_exif.jpg") == ExifData(None, None, None)
+
+
+def test_other_file_types(tmp_path):
+    """
+    Test files other than JPEGs are read with exifread
+    """
+    assert read_exif("tests/test_media/photos/1.png") == ExifData(None, None, None)
+
+    photo = str(tmp_path / "photo.tiff")
+    _create_photo(photo)
+    assert read_exif(photo) == read_exif_with_exifread(photo)
+
+
+def test_truncated_file(tmp_path):
+    photo = str(tmp_path / "photo.jpg")
+    _create_photo(photo)
+    with open(photo, "rb") as f:
+        data = f.read(1000)  # the GPS tags are after the maker note
+    with open(photo, "wb") as f:
+        f.write(data)
+
+    assert read_exif(photo).orientation == 6  # no exception
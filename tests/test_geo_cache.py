@@ -0,0 +1,72 @@
+from utils.geo_cache import GeoCache
+
+
+def test_nearby_locations_share_entries():
+    """
+    Test locations in the same grid cell use the same cached value, and other cells are fetched
+    """
+    cache = GeoCache(":memory:", grid=0.01)
+    fetched = []
+
+    def fetch(latitude, longitude):
+        fetched.append((latitude, longitude))
+        return "address %d" % len(fetched)
+
+    assert cache.get_or_fetch("address", 50.8190, -0.1368, fetch) == "address 1"
+    assert cache.get_or_fetch("address", 50.8211, -0.1371, fetch) == "address 1"
+    assert cache.get_or_fetch("address", 50.8400, -0.1368, fetch) == "address 2"
+    assert len(fetched) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_not_found_not_cached():
+    cache = GeoCache(":memory:")
+    assert cache.get_or_fetch("map", 50.819, -0.137, lambda latitude, longitude: None) is None
+    assert cache.get_or_fetch("map", 50.819, -0.137, lambda latitude, longitude: b"png") == b"png"
+
+
+def test_ttl():
+    cache = GeoCache(":memory:", ttl=-1)  # everything has expired
+    cache.put("address", 50.819, -0.137, "Brighton")
+    assert cache.get("address", 50.819, -0.137) is None
+    assert cache.get_stats() == (0, 0)
+
+
+def test_lru_eviction():
+    """
+    Test the least recently used entries are removed when the cache is full
+    """
+    cache = GeoCache(":memory:", max_bytes=25, access_resolution=0)  # every read updates the access time
+    cache.put("map", 1, 1, b"1" * 10)
+    cache.put("map", 2, 2, b"2" * 10)
+    cache.get("map", 1, 1)
+    cache.put("map", 3, 3, b"3" * 10)
+
+    assert cache.get("map", 1, 1) is not None
+    assert cache.get("map", 2, 2) is None
+    assert cache.get("map", 3, 3) is not None
+    assert cache.get_stats() == (2, 20)
+
+
+def test_access_time_resolution():
+    """
+    Test reading an entry only writes its access time again once the access time is older than the resolution
+    """
+    cache = GeoCache(":memory:", access_resolution=3600)
+    cache.put("address", 50.819, -0.137, "Brighton")
+    changes = cache._db.total_changes
+
+    for _ in range(5):
+        assert cache.get("address", 50.819, -0.137) == "Brighton"
+    assert cache._db.total_changes == changes
+
+    cache._db.execute("UPDATE geo SET accessed = accessed - 7200")
+    changes = cache._db.total_changes
+    assert cache.get("address", 50.819, -0.137) == "Brighton"
+    assert cache._db.total_changes == changes + 1
+
+
+def test_persistent(tmp_path):
+    db_filename = str(tmp_path / "geo.db")
+    GeoCache(db_filename).put("address", 50.819, -0.137, "Brighton")
+    assert GeoCache(db_filename).get("address", 50.819, -0.137) == "Brighton"
@@ -0,0 +1,64 @@
+from utils import geocoder
+from utils.geocoder import OfflineGeocoder, ReverseGeocoder
+
+PLACES = """lat,lon,name,admin1,cc
+50.82838,-0.13947,Brighton,England,GB
+48.85341,2.3488,Paris,Ile-de-France,FR
+-36.84853,174.76349,Auckland,Auckland,NZ
+-16.5,-179.9,Labasa,Northern,FJ
+"""
+
+
+def _create_geocoder(tmp_path):
+    places_filename = tmp_path / "places.csv"
+    places_filename.write_text(PLACES)
+    return OfflineGeocoder(str(places_filename))
+
+
+def test_lookup(tmp_path):
+    offline = _create_geocoder(tmp_path)
+    assert offline.lookup(50.819, -0.137).name == "Brighton"
+    assert offline.get_address(48.9, 2.4) == "Paris, Ile-de-France, FR"
+
+    # across the date line
+    assert offline.lookup(-16.5, 179.9).name == "Labasa"
+
+
+def test_too_far(tmp_path):
+    """
+    Test no address is found in the middle of the ocean
+    """
+    offline = _create_geocoder(tmp_path)
+    assert offline.lookup(0.0, -140.0) is None
+    assert offline.get_address(0.0, -140.0) == ""
+
+
+def test_missing_places_file(tmp_path):
+    offline = OfflineGeocoder(str(tmp_path / "missing.csv"))
+    assert not offline.load()
+    assert offline.lookup(50.819, -0.137) is None
+
+
+def test_bundled_places():
+    assert OfflineGeocoder().get_address(50.81905, -0.13679) == "Brighton, England, GB"
+
+
+def test_online_fallback(tmp_path, monkeypatch):
+    """
+    Test the online geocoder is only used if enabled and the offline geocoder has no answer
+    """
+    lookups = []
+
+    def get_gps_dd_location(latitude, longitude, http_client=None):
+        lookups.append((latitude, longitude))
+        return "Pacific Ocean"
+
+    monkeypatch.setattr(geocoder.photo_utils, "get_gps_dd_location", get_gps_dd_location)
+
+    assert ReverseGeocoder(_create_geocoder(tmp_path)).get_address(0.0, -140.0) == ""
+    assert lookups == []
+
+    online = ReverseGeocoder(_create_geocoder(tmp_path), online=True)
+    assert online.get_address(50.819, -0.137) == "Brighton, England, GB"
+    assert online.get_address(0.0, -140.0) == "Pacific Ocean"
+    assert lookups == [(0.0, -140.0)]
@@ -1,8 +1,12 @@
+import threading
+
 import pytest
+import requests
 from PyQt5 import QtCore
 
 import gui.media_players
-from gui.photo_app import PhotoFrame
+from gui.photo_app import PhotoFrame, Popup
+from utils.catalog import MediaInfo
 from utils.config import Config
 
 
@@ -68,6 +72,96 @@ def test_show_popup(qtbot, window):
     assert window.popup.isVisible()
 
 
+def _gps_media_info(filename):
+    return MediaInfo(filename, 0, 0, None, 800, 407, "2019:07:14 10:20:30", 50.819, -0.137)
+
+
+def test_popup_lookup_in_background(qtbot, window, monkeypatch):
+    """
+    Test the popup opens before the address is found, and shows the address when it arrives
+    """
+    lookup_done = threading.Event()
+
+    def get_location_address(latitude, longitude):
+        lookup_done.wait(5)
+        return "Brighton, England, GB"
+
+    monkeypatch.setattr(window, "get_location_address", get_location_address)
+    monkeypatch.setattr(window, "get_location_map", lambda latitude, longitude: None)
+
+    popup = Popup(window, 12)
+    popup.update_popup("photo.jpg", _gps_media_info("photo.jpg"))
+    assert popup.isVisible()
+    assert popup.value_widgets[2].text() == "Looking up..."
+
+    with qtbot.waitSignal(popup.lookup_signals.map_found):
+        lookup_done.set()
+    assert popup.value_widgets[2].text() == "Brighton\nEngland\nGB"
+
+
+def test_popup_discards_stale_lookup(qtbot, window, monkeypatch):
+    """
+    Test an address found after the popup was closed is not shown
+    """
+    lookup_done = threading.Event()
+
+    def get_location_address(latitude, longitude):
+        lookup_done.wait(5)
+        return "Brighton, England, GB"
+
+    monkeypatch.setattr(window, "get_location_address", get_location_address)
+    monkeypatch.setattr(window, "get_location_map", lambda latitude, longitude: None)
+
+    popup = Popup(window, 12)
+    popup.update_popup("photo.jpg", _gps_media_info("photo.jpg"))
+    popup.hide()
+
+    with qtbot.assertNotEmitted(popup.lookup_signals.address_found, wait=200):
+        lookup_done.set()
+    assert popup.value_widgets[2].text() == "Looking up..."
+
+
+def test_google_map_zoom(window, monkeypatch):
+    """
+    Test maps are downloaded from Google Maps at the zoom level of the config
+    """
+    urls = []
+
+    def get(url):
+        urls.append(url)
+        raise requests.exceptions.ConnectionError("no network")
+
+    monkeypatch.setattr(window, "google_maps", "key")
+    monkeypatch.setattr(window, "map_zoom", 14)
+    monkeypatch.setattr(window.http_client, "get", get)
+
+    assert window.get_location_map(50.819, -0.137) is None
+    assert len(urls) == 1 and "zoom=14&" in urls[0]
+
+
+def test_location_offline(window, monkeypatch):
+    """
+    Test the popup warm-up lookups (online=False) do not call Nominatim or Google Maps
+    """
+    urls = []
+
+    def get(url, **kwargs):
+        urls.append(url)
+        raise requests.exceptions.ConnectionError("no network")
+
+    monkeypatch.setattr(window, "google_maps", "key")
+    monkeypatch.setattr(window.geocoder, "online", True)
+    monkeypatch.setattr(window.http_client, "get", get)
+
+    # in the Atlantic, far from any place in the places file
+    assert window.get_location_address(0.0, -30.0, online=False) == ""
+    assert window.get_location_map(0.0, -30.0, online=False) is None
+    assert urls == []
+
+    window.get_location_map(0.0, -30.0)
+    assert len(urls) == 1
+
+
 def test_player_folder(window):
     """
     Test method to retrieve playlist folder
@@ -0,0 +1,52 @@
+from utils.history import BrowsingHistory
+
+
+def test_back_and_forward():
+    """
+    Test the cursor moves back and forward through the entries
+    """
+    history = BrowsingHistory(10)
+    for media_id in [4, 7, 1]:
+        history.push(media_id)
+
+    assert history.current() == 1
+    assert history.back() == 7
+    assert history.back() == 4
+    assert history.back() is None
+    assert history.back() is None
+
+    assert history.peek_forward(2) == [4, 7]
+    assert history.forward() == 4
+    assert history.forward() == 7
+    assert history.forward() == 1
+    assert history.forward() is None
+    assert history.current() == 1
+
+
+def test_push_drops_forward_entries():
+    """
+    Test visiting a new entry after going back replaces the forward entries
+    """
+    history = BrowsingHistory(10)
+    for media_id in [4, 7, 1]:
+        history.push(media_id)
+    history.back()
+    history.push(9)
+
+    assert list(history) == [4, 7, 9]
+    assert not history.has_forward()
+
+
+def test_capacity():
+    """
+    Test the oldest entries are overwritten when the history is full
+    """
+    history = BrowsingHistory(3)
+    for media_id in range(10):
+        history.push(media_id)
+
+    assert len(history) == 3
+    assert list(history) == [7, 8, 9]
+    assert history.back() == 8
+    assert history.back() == 7
+    assert history.back() is None
@@ -0,0 +1,159 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from network.http_client import CircuitBreaker, CircuitOpenError, HttpClient
+from tests.http_server import LocalServer
+from utils import photo_utils
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Replies with the next status in the server's list of statuses (200 once the list is used up)
+    """
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        body = self.server.body
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    http_server = LocalServer(("127.0.0.1", 0), _Handler)
+    http_server.statuses = []
+    http_server.paths = []
+    http_server.body = b"{}"
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield http_server
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def _get_url(http_server, path="/"):
+    return "http://127.0.0.1:%d%s" % (http_server.server_address[1], path)
+
+
+def _get_closed_port_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return "http://127.0.0.1:%d/" % s.getsockname()[1]
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_retry_server_errors(server):
+    """
+    Server errors are retried with an exponential backoff
+    """
+    server.statuses = [503, 500]
+    delays = []
+    client = HttpClient(retries=2, backoff=0.5, sleep=delays.append)
+
+    assert client.get(_get_url(server)).status_code == 200
+    assert len(server.paths) == 3
+    assert delays == [0.5, 1.0]
+
+
+def test_retries_used_up(server):
+    server.statuses = [503, 503, 503]
+    client = HttpClient(retries=1, sleep=lambda _: None)
+
+    assert client.get(_get_url(server)).status_code == 503
+    assert len(server.paths) == 2
+
+
+def test_client_errors_not_retried(server):
+    server.statuses = [404]
+    client = HttpClient(sleep=lambda _: None)
+
+    assert client.get(_get_url(server)).status_code == 404
+    assert len(server.paths) == 1
+
+
+def test_circuit_breaker_stops_calls():
+    """
+    A host that cannot be reached is not called again until the circuit breaker resets
+    """
+    clock = _FakeClock()
+    client = HttpClient(retries=1, failure_threshold=2, reset_timeout=60, sleep=lambda _: None, clock=clock)
+    url = _get_closed_port_url()
+
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client.get(url)
+    assert client.get_breaker(url).is_open()
+
+    with pytest.raises(CircuitOpenError):
+        client.get(url)
+
+    # other hosts are still called
+    assert not client.get_breaker("http://localhost:1/").is_open()
+
+
+def test_circuit_breaker_trial_call(server):
+    """
+    Once the reset timeout has passed, one trial call is allowed and closes the breaker if it succeeds
+    """
+    clock = _FakeClock()
+    client = HttpClient(retries=0, failure_threshold=1, reset_timeout=60, sleep=lambda _: None, clock=clock)
+    url = _get_url(server)
+
+    server.statuses = [503]
+    client.get(url)
+    with pytest.raises(CircuitOpenError):
+        client.get(url)
+
+    clock.now = 61
+    assert client.get(url).status_code == 200
+    assert not client.get_breaker(url).is_open()
+
+
+def test_circuit_breaker_failed_trial():
+    clock = _FakeClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60, clock=clock)
+    for _ in range(3):
+        breaker.record_failure()
+    assert not breaker.allow_request()
+
+    clock.now = 61
+    assert breaker.allow_request()
+    assert not breaker.allow_request()  # only one trial call at a time
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+    clock.now = 122
+    assert breaker.allow_request()
+
+
+def test_gps_dd_location(server, monkeypatch):
+    """
+    Addresses are looked up with Nominatim's reverse API
+    """
+    monkeypatch.setattr(photo_utils, "NOMINATIM_REVERSE_URL", _get_url(server, "/reverse"))
+    server.body = b'{"display_name": "Brighton, England"}'
+    client = HttpClient()
+
+    assert photo_utils.get_gps_dd_location(50.8, -0.1, client) == "Brighton, England"
+    assert server.paths[0] == "/reverse?format=json&lat=50.8&lon=-0.1"
+
+    server.statuses = [404]
+    assert photo_utils.get_gps_dd_location(50.8, -0.1, client) == ""
@@ -1,9 +1,19 @@
 # noinspection PyPackageRequirements,PyPackageRequirements
+import hashlib
+import itertools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
 import mock
 import pytest
+import requests
 from mock import PropertyMock
 
 from network.icloud_photos import IcloudPhotos
+from network.sync_manifest import SyncManifest, SyncedAsset
+from tests.http_server import LocalServer
 
 
 class DummyPhoto:
@@ -118,3 +128,221 @@ def test_format(mock_photo_master_record, mock_photo_asset_record, mock_photo_di
     mock_photo_dimensions.return_value = (100, 50)
     assert IcloudPhotos.is_correct_format(photo, "portrait")
     assert not IcloudPhotos.is_correct_format(photo, "landscape")
+
+
+class _PhotoHandler(BaseHTTPRequestHandler):
+    """
+    Serves the photos in the server's dictionary of path -> data (404 for other paths), supporting "Range: bytes=n-".
+    Paths in the server's set of broken paths send half of the data and close the connection.
+    Records the requests and the number of requests being served at once
+    """
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append((self.path, self.headers.get("Range")))
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        try:
+            time.sleep(self.server.delay)
+            data = self.server.photos.get(self.path)
+            if data is None:
+                self.send_error(404)
+                return
+            data_range = self.headers.get("Range")
+            if data_range:
+                start = int(data_range[len("bytes="):-1])
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes %d-%d/%d" % (start, len(data) - 1, len(data)))
+                data = data[start:]
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if self.path in self.server.broken:
+                self.wfile.write(data[:len(data) // 2])
+                self.close_connection = True
+            else:
+                self.wfile.write(data)
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def photo_server():
+    server = LocalServer(("127.0.0.1", 0), _PhotoHandler)
+    server.photos = {}
+    server.broken = set()
+    server.requests = []
+    server.delay = 0
+    server.lock = threading.Lock()
+    server.active = server.max_active = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class StreamedPhoto:
+    """
+    A photo asset served by a local server (as the full resolution JPEG or as the original)
+    """
+
+    def __init__(self, server, filename, data=None, full_res=True, asset_id=None):
+        self.id = asset_id or "id-" + filename
+        self.filename = filename
+        self.dimensions = (100, 50)
+        url_path = "/" + filename if asset_id is None else "/%s/%s" % (asset_id, filename)
+        url = "http://127.0.0.1:%d%s" % (server.server_address[1], url_path)
+        resource = {"value": {"downloadURL": url}}
+        if data is not None:
+            server.photos[url_path] = data
+            resource["value"].update(size=len(data), fileChecksum=hashlib.sha1(data).hexdigest())
+        self._master_record = {"fields": {"originalOrientation": {"value": 1}, "resOriginalRes": resource}}
+        self._asset_record = {"fields": {"resJPEGFullRes": resource} if full_res else {}}
+        self._service = mock.Mock(session=requests.Session())
+
+
+def test_download(photo_server, tmp_path):
+    """
+    Test photos are downloaded at once, in chunks
+    """
+    photo_server.delay = 0.2
+    photos = [StreamedPhoto(photo_server, "photo%d.jpg" % i, bytes([i]) * (10000 + i), full_res=i % 2 == 0)
+              for i in range(4)]
+
+    assert IcloudPhotos.download(photos, str(tmp_path), workers=4, chunk_size=1000) == []
+    for i, photo in enumerate(photos):
+        assert (tmp_path / photo.filename).read_bytes() == bytes([i]) * (10000 + i)
+    assert photo_server.max_active > 1
+    assert sorted(os.listdir(str(tmp_path))) == ["photo%d.jpg" % i for i in range(4)]
+
+
+def test_download_errors(photo_server, tmp_path):
+    """
+    Test a photo that cannot be downloaded is reported and leaves no file behind, while the others are downloaded
+    """
+    photos = [StreamedPhoto(photo_server, "ok.jpg", b"photo"), StreamedPhoto(photo_server, "missing.jpg"),
+              StreamedPhoto(photo_server, "broken.jpg", b"x" * 100000)]
+    photo_server.broken.add("/broken.jpg")
+
+    assert sorted(IcloudPhotos.download(photos, str(tmp_path), workers=2), key=photos.index) == photos[1:]
+    assert os.listdir(str(tmp_path)) == ["ok.jpg"]
+
+
+def test_download_bad_photos(photo_server, tmp_path):
+    """
+    Test photos without a download link or without a free name are reported, while the others are downloaded
+    """
+    folder = tmp_path / "photos"
+    folder.mkdir()
+    manifest = SyncManifest(str(tmp_path / "manifest.db"))
+    for asset_id, filename in (("B1", "IMG_0001.JPG"), ("B2", "IMG_0001_A1.JPG")):  # both names of the next photo
+        manifest.put(SyncedAsset(asset_id, str(folder / filename), 1, "", 0, True))
+    no_link = StreamedPhoto(photo_server, "no_link.jpg", b"photo")
+    del no_link._master_record["fields"]["resOriginalRes"], no_link._asset_record["fields"]["resJPEGFullRes"]
+    photos = [StreamedPhoto(photo_server, "IMG_0001.JPG", b"photo", asset_id="A1"), no_link,
+              StreamedPhoto(photo_server, "ok.jpg", b"photo")]
+
+    assert sorted(IcloudPhotos.download(photos, str(folder), workers=2, manifest=manifest),
+                  key=photos.index) == photos[:2]
+    assert os.listdir(str(folder)) == ["ok.jpg"]
+
+
+def test_download_same_filename(photo_server, tmp_path):
+    """
+    Test photos with the same filename (e.g. from two cameras) are stored under different names
+    """
+    photo_server.delay = 0.2
+    photos = [StreamedPhoto(photo_server, "IMG_0001.JPG", bytes([i]) * 10000, asset_id="A%d" % i) for i in range(2)]
+
+    assert IcloudPhotos.download(photos, str(tmp_path), workers=4, chunk_size=1000) == []
+    assert sorted(os.listdir(str(tmp_path))) == ["IMG_0001.JPG", "IMG_0001_A1.JPG"]
+    assert (tmp_path / "IMG_0001.JPG").read_bytes() == bytes([0]) * 10000
+    assert (tmp_path / "IMG_0001_A1.JPG").read_bytes() == bytes([1]) * 10000
+
+
+def test_sync_same_filename(photo_server, tmp_path):
+    """
+    Test photos with the same filename keep their own names between syncs, so they are not downloaded again
+    """
+    manifest = SyncManifest(str(tmp_path / "manifest.db"))
+    photos = [StreamedPhoto(photo_server, "IMG_0001.JPG", bytes([i]) * 1000, asset_id="A%d" % i) for i in range(2)]
+    assert IcloudPhotos.download(photos, str(tmp_path), manifest=manifest) == []
+
+    photo_server.requests.clear()
+    assert IcloudPhotos.download(photos[::-1], str(tmp_path), manifest=manifest) == []
+    assert photo_server.requests == []
+    assert manifest.get("A0").path == str(tmp_path / "IMG_0001.JPG")
+    assert manifest.get("A1").path == str(tmp_path / "IMG_0001_A1.JPG")
+
+
+def test_sync_unchanged(photo_server, tmp_path):
+    """
+    Test photos already downloaded are not downloaded again, unless they change in the cloud or on disk
+    """
+    manifest = SyncManifest(str(tmp_path / "manifest.db"))
+    photos = [StreamedPhoto(photo_server, "photo%d.jpg" % i, bytes([i]) * 1000) for i in range(3)]
+    assert IcloudPhotos.download(photos, str(tmp_path), manifest=manifest) == []
+    assert len(photo_server.requests) == 3
+
+    photo_server.requests.clear()
+    assert IcloudPhotos.download(photos, str(tmp_path), manifest=manifest) == []
+    assert photo_server.requests == []
+
+    photos[0] = StreamedPhoto(photo_server, "photo0.jpg", b"edited")
+    (tmp_path / "photo1.jpg").unlink()
+    assert IcloudPhotos.download(photos, str(tmp_path), manifest=manifest) == []
+    assert sorted(photo_server.requests) == [("/photo0.jpg", None), ("/photo1.jpg", None)]
+    assert (tmp_path / "photo0.jpg").read_bytes() == b"edited"
+    assert manifest.get_stats() == (3, 6 + 1000 + 1000)
+
+
+def test_sync_resume(photo_server, tmp_path):
+    """
+    Test an interrupted download is resumed from where it stopped
+    """
+    manifest = SyncManifest(str(tmp_path / "manifest.db"))
+    data = bytes(range(256)) * 400
+    photos = [StreamedPhoto(photo_server, "photo.jpg", data)]
+    photo_server.broken.add("/photo.jpg")
+    assert IcloudPhotos.download(photos, str(tmp_path), chunk_size=1000, manifest=manifest) == photos
+    assert not (tmp_path / "photo.jpg").exists()
+    part_size = (tmp_path / ".photo.jpg.part").stat().st_size
+    assert 0 < part_size < len(data)
+
+    photo_server.broken.clear()
+    assert IcloudPhotos.download(photos, str(tmp_path), manifest=manifest) == []
+    assert photo_server.requests[-1] == ("/photo.jpg", "bytes=%d-" % part_size)
+    assert (tmp_path / "photo.jpg").read_bytes() == data
+    assert not (tmp_path / ".photo.jpg.part").exists()
+
+
+class DummyAlbumPhoto:
+    def __init__(self, item_type):
+        self.filename = "photo.jpg"
+        self._master_record = {"fields": {"itemType": {"value": item_type}}}
+
+
+def test_iter_photos():
+    """
+    Test the album is read as the eligible photos are needed
+    """
+    read = []
+
+    def album():
+        for i in range(100):
+            read.append(i)
+            yield DummyAlbumPhoto("public.jpeg" if i % 2 else "public.mpeg")
+
+    icloud = IcloudPhotos.__new__(IcloudPhotos)
+    icloud.api = mock.Mock()
+    icloud.api.photos.albums = {"All Photos": album()}
+
+    photos = icloud.iter_photos("All Photos", None)
+    first = list(itertools.islice(photos, 2))
+    assert len(first) == 2 and all(IcloudPhotos.is_image(photo) for photo in first)
+    assert read == [0, 1, 2, 3]
@@ -0,0 +1,85 @@
+from PIL import Image
+from PyQt5.QtGui import QImage, QImageReader, QTransform
+
+from gui import image_loader
+from gui.image_loader import RenderSettings
+
+LANDSCAPE_PHOTO = "tests/test_media/photos/1.png"  # 800x407
+PORTRAIT_PHOTO = "tests/portrait_no_exif.jpg"  # 333x446
+
+
+def test_fit_size():
+    assert image_loader.get_fit_size(4032, 3024, 800, 480) == (640, 480)
+    assert image_loader.get_fit_size(3024, 4032, 800, 480) == (360, 480)
+    assert image_loader.get_fit_size(100, 50, 800, 480) == (800, 400)  # small photos are scaled up
+
+
+def test_prepare_photo_scaled():
+    """
+    Test the photo is scaled to fit the frame
+    """
+    photo = image_loader.prepare_photo(LANDSCAPE_PHOTO, RenderSettings(400, 400, 0, None), None)
+    assert photo.compatible
+    assert (photo.image.width(), photo.image.height()) == (400, 204)
+
+
+def test_prepare_photo_rotated_frame():
+    """
+    Test a portrait photo on a frame rotated into portrait mode is rotated once and scaled to fit
+    """
+    photo = image_loader.prepare_photo(PORTRAIT_PHOTO, RenderSettings(800, 480, 90, True),
+                                       image_loader.Watermark(QImage("logo.png").scaledToWidth(50)))
+    assert photo.compatible
+    assert (photo.image.width(), photo.image.height()) == (643, 480)
+
+
+def test_prepare_photo_incompatible():
+    """
+    Test a portrait photo is rejected (without being decoded) by a landscape frame
+    """
+    photo = image_loader.prepare_photo(PORTRAIT_PHOTO, RenderSettings(800, 480, 0, False), None)
+    assert not photo.compatible
+    assert photo.image is None
+
+
+def test_prepare_missing_photo():
+    photo = image_loader.prepare_photo("tests/does_not_exist.jpg", RenderSettings(800, 480, 0, None), None)
+    assert photo.image is None
+
+
+def test_watermark_rotated():
+    """
+    Test the pre-rotated watermark drawn on a rotated photo matches the watermark drawn before rotating the photo
+    """
+    logo = QImage("logo.png").scaledToWidth(50)
+    watermark = image_loader.Watermark(logo)
+    photo = QImage(LANDSCAPE_PHOTO).convertToFormat(QImage.Format_RGB32)
+
+    for angle in (0, 90, 180, 270, -90):
+        expected = QImage(photo)
+        image_loader.paint_watermark(expected, logo)
+        expected = expected.transformed(QTransform().rotate(angle))
+
+        image = photo.transformed(QTransform().rotate(angle))
+        watermark.paint(image, angle)
+        assert image == expected
+
+
+def test_prepare_photo_exif_rotation(tmp_path):
+    """
+    Test photos are turned the right way up using the EXIF orientation (the same way as Qt's own auto-transform)
+    """
+    for orientation in (1, 3, 6, 8):
+        photo = str(tmp_path / ("%d.jpg" % orientation))
+        image = Image.new("RGB", (60, 40), "blue")
+        image.paste((255, 0, 0), (0, 0, 20, 10))  # mark the top-left corner
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        image.save(photo, exif=exif)
+
+        reader = QImageReader(photo)
+        reader.setAutoTransform(True)
+        expected = reader.read().convertToFormat(QImage.Format_RGB32)
+
+        prepared = image_loader.prepare_photo(photo, RenderSettings(expected.width(), expected.height(), 0, None), None)
+        assert prepared.image.convertToFormat(QImage.Format_RGB32) == expected
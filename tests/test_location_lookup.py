@@ -0,0 +1,63 @@
+import threading
+
+from gui.location_lookup import LocationLookup, LocationLookupSignals, LocationWarmup
+from utils.catalog import MediaInfo
+
+MEDIA_INFO = {
+    "gps.jpg": MediaInfo("gps.jpg", 0, 0, None, 800, 600, None, 50.819, -0.137),
+    "no_gps.jpg": MediaInfo("no_gps.jpg", 0, 0, None, 800, 600, None, None, None)
+}
+
+
+def test_warmup(qapp):
+    """
+    Test the address and map are looked up for the photos with GPS data
+    """
+    lookups = []
+    warmup = LocationWarmup(["no_gps.jpg", "gps.jpg"], MEDIA_INFO.get,
+                            lambda latitude, longitude: lookups.append(("address", latitude, longitude)),
+                            lambda latitude, longitude: lookups.append(("map", latitude, longitude)),
+                            lambda: False)
+    warmup.run()
+    assert lookups == [("address", 50.819, -0.137), ("map", 50.819, -0.137)]
+
+
+def test_warmup_waits_while_busy(qapp):
+    """
+    Test the warm-up waits while photos are being decoded, and stops if it is cancelled
+    """
+    lookups = []
+    busy = threading.Event()
+    busy.set()
+    warmup = LocationWarmup(["gps.jpg"], MEDIA_INFO.get, lambda latitude, longitude: lookups.append("address"),
+                            lambda latitude, longitude: lookups.append("map"), busy.is_set, poll_interval=0.01)
+
+    thread = threading.Thread(target=warmup.run)
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive()
+    assert lookups == []
+
+    warmup.cancel()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert lookups == []
+
+
+def test_lookup_error(qapp):
+    """
+    Test a lookup that fails still sends (empty) results, so the popup does not keep waiting for them
+    """
+    def fail(latitude, longitude):
+        raise OSError("no network")
+
+    results = []
+    signals = LocationLookupSignals()
+    signals.address_found.connect(lambda lookup_id, address: results.append((lookup_id, address)))
+    signals.map_found.connect(lambda lookup_id, image: results.append((lookup_id, image.isNull())))
+    LocationLookup(signals, 7, 50.819, -0.137, fail, lambda latitude, longitude: None).run()
+    assert results == [(7, ""), (7, True)]
+
+    results.clear()
+    LocationLookup(signals, 8, 50.819, -0.137, lambda latitude, longitude: "Brighton", fail).run()
+    assert results == [(8, "Brighton"), (8, True)]
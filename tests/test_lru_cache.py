@@ -0,0 +1,52 @@
+from utils.lru_cache import LruCache
+
+
+def test_cache_hit_miss():
+    """
+    Test lookup of cached and missing values
+    """
+    cache = LruCache(100, len)
+    cache.put("a", "aaa")
+
+    assert cache.get("a") == "aaa"
+    assert cache.get("b") is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_cache_byte_budget():
+    """
+    Test the least recently used values are evicted when the byte budget is exceeded
+    """
+    cache = LruCache(10, len)
+    cache.put("a", "x" * 4)
+    cache.put("b", "x" * 4)
+    cache.get("a")  # b is now the least recently used
+    cache.put("c", "x" * 4)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.current_bytes == 8
+    assert cache.evictions == 1
+
+
+def test_cache_oversize_value():
+    """
+    Test values bigger than the budget are not cached
+    """
+    cache = LruCache(10, len)
+    cache.put("a", "x" * 11)
+    assert "a" not in cache
+    assert cache.current_bytes == 0
+
+
+def test_cache_replace_and_invalidate():
+    cache = LruCache(10, len)
+    cache.put("a", "x" * 4)
+    cache.put("a", "x" * 6)
+    assert cache.current_bytes == 6
+
+    cache.invalidate("a")
+    assert not cache
+    assert cache.current_bytes == 0
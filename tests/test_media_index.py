@@ -0,0 +1,83 @@
+import os
+import shutil
+
+from gui.media_index import MediaIndex
+
+
+def _create_folder(tmp_path, names):
+    for name in names:
+        shutil.copy("tests/test_media/photos/1.png", str(tmp_path / name))
+    return str(tmp_path)
+
+
+def test_scan(tmp_path):
+    """
+    Test the index lists the files in the folder (sorted, ignoring hidden files and sub-folders)
+    """
+    folder = _create_folder(tmp_path, ["b.png", "a.png", ".hidden.png"])
+    os.mkdir(os.path.join(folder, "sub"))
+
+    index = MediaIndex(folder, watch=False)
+    assert index.get_paths() == [os.path.join(folder, "a.png"), os.path.join(folder, "b.png")]
+
+
+def test_missing_folder(tmp_path):
+    index = MediaIndex(str(tmp_path / "missing"))
+    assert index.get_paths() == []
+
+
+def test_rescan_changes(tmp_path):
+    """
+    Test added/removed files are applied to the index
+    """
+    folder = _create_folder(tmp_path, ["a.png", "c.png"])
+    index = MediaIndex(folder, watch=False)
+    paths = index.get_paths()
+    assert not index.rescan()  # nothing changed
+
+    _create_folder(tmp_path, ["b.png"])
+    os.remove(os.path.join(folder, "c.png"))
+    assert index.rescan()
+
+    assert index.get_paths() == [os.path.join(folder, "a.png"), os.path.join(folder, "b.png")]
+    assert len(paths) == 2  # old list is not modified
+
+
+def test_find(tmp_path):
+    folder = _create_folder(tmp_path, ["a.png", "c.png"])
+    index = MediaIndex(folder, watch=False)
+
+    assert index.find(os.path.join(folder, "c.png")) == 1
+    assert index.find(os.path.join(folder, "b.png")) == 0  # missing: position of the file before it
+    assert index.find(os.path.join(folder, "0.png")) is None
+
+
+def test_watch_folder(qtbot, tmp_path):
+    """
+    Test the index is updated automatically when a file is added to the folder
+    """
+    folder = _create_folder(tmp_path, ["a.png"])
+    index = MediaIndex(folder)
+
+    with qtbot.waitSignal(index.changed, timeout=5000):
+        _create_folder(tmp_path, ["b.png"])
+
+    assert len(index.get_paths()) == 2
+
+
+def test_watch_folder_burst(qtbot, tmp_path):
+    """
+    Test a burst of changes to the folder only re-scans the folder once, when the changes stop
+    """
+    folder = _create_folder(tmp_path, ["a.png"])
+    index = MediaIndex(folder, rescan_delay=300)
+    changes = []
+    index.changed.connect(lambda: changes.append(len(index.get_paths())))
+
+    with qtbot.waitSignal(index.changed, timeout=5000):
+        for i in range(5):
+            _create_folder(tmp_path, ["b%d.png" % i])
+            qtbot.wait(20)
+
+    qtbot.wait(400)
+    assert changes == [6]
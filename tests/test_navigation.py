@@ -1,3 +1,6 @@
+import os
+import shutil
+
 from gui.photo_app import PhotoFrame
 from utils.config import Config
 
@@ -96,3 +99,115 @@ def test_prev_no_history():
 
     player.prev()
     assert player.current_media_index is None
+
+
+def test_next_after_prev():
+    """
+    Test that 'next' after 'prev' moves forward through the browsing history before showing new photos.
+    """
+    frame = PhotoFrame(Config("tests/test_navigation_shuffle.yml"))
+    frame.setup()
+    frame.start()
+    player = frame.get_current_player()
+
+    browsing_history = []
+    for _ in range(5):
+        player.next()
+        browsing_history.append(player.current_media_index)
+
+    for _ in range(3):
+        player.prev()
+    assert player.current_media_index == browsing_history[1]
+
+    for j in browsing_history[2:]:
+        player.next()
+        assert player.current_media_index == j
+
+
+def test_prev_uses_pixmap_cache():
+    """
+    Test that going back to a photo re-uses the cached pixmap instead of re-loading the file.
+    """
+    frame = PhotoFrame(Config("tests/test_navigation.yml"))
+    frame.setup()
+    frame.start()
+    player = frame.get_current_player()
+
+    player.next()
+    player.next()
+    hits = frame.pixmap_cache.hits
+
+    player.prev()
+    assert frame.pixmap_cache.hits == hits + 1
+
+
+def test_position_kept_when_files_change(tmp_path):
+    """
+    Test the playlist position stays on the same photo when other photos are added or removed.
+    """
+    folder = tmp_path / "photos"
+    folder.mkdir()
+    for name in ["1.png", "3.png", "5.png"]:
+        shutil.copy("tests/test_media/navigation/" + name, str(folder / name))
+    config = tmp_path / "config.yml"
+    config.write_text("frame:\n  root_folder: %s\n\nplayers:\n  Player:\n    type: photo_player\n    folder: photos\n"
+                      % tmp_path)
+
+    frame = PhotoFrame(Config(str(config)))
+    frame.setup()
+    frame.start()
+    player = frame.get_current_player()
+    player.next()
+    assert player.current_media_index == 1  # 3.png
+
+    # add a photo before the current one
+    shutil.copy("tests/test_media/navigation/2.png", str(folder / "2.png"))
+    player.refresh_media_list()
+    assert player.get_playlist()[player.current_media_index].endswith("3.png")
+
+    # remove the current photo: next() continues with the photo after it
+    os.remove(str(folder / "3.png"))
+    player.refresh_media_list()
+    player.next()
+    assert player.get_playlist()[player.current_media_index].endswith("5.png")
+
+
+def test_orientation_playlists(tmp_path):
+    """
+    Test that with a compass, only photos matching the frame rotation are loaded (after their orientation is known),
+    and that rotating the frame switches to the other photos.
+    """
+    folder = tmp_path / "photos"
+    folder.mkdir()
+    for name in ["1.png", "3.png"]:
+        shutil.copy("tests/test_media/navigation/" + name, str(folder / name))  # landscape
+    for name in ["2.jpg", "4.jpg"]:
+        shutil.copy("tests/portrait_no_exif.jpg", str(folder / name))  # portrait
+    config = tmp_path / "config.yml"
+    config.write_text("frame:\n  root_folder: %s\n  compass: fake\n  rotation: 0\n\n"
+                      "players:\n  Player:\n    type: photo_player\n    folder: photos\n" % tmp_path)
+
+    frame = PhotoFrame(Config(str(config)))
+    frame.setup()
+    frame.start()
+    player = frame.get_current_player()
+
+    shown = []
+    show_current_media = player.show_current_media
+
+    def record_show():
+        shown.append(os.path.basename(player.get_playlist()[player.current_media_index]))
+        return show_current_media()
+
+    player.show_current_media = record_show
+
+    for _ in range(4):
+        player.next()
+    assert set(shown) == {"1.png", "3.png"}
+
+    # rotate into portrait mode
+    frame.compass.set_angle(90)
+    shown.clear()
+    for _ in range(4):
+        player.next()
+    assert set(shown) == {"2.jpg", "4.jpg"}
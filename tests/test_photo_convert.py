@@ -0,0 +1,179 @@
+import os
+
+import pytest
+from PIL import Image
+
+from utils.config import Config
+from utils.exif_reader import read_exif
+from utils.photo_convert import FrameProfile, convert_photo, convert_photos, create_frame_profile, \
+    get_conversions, get_crop_box, get_download_orientation, get_frame_profiles, parse_aspect, parse_size, \
+    render_photo
+
+
+def _create_photo(filename, size, orientation=1):
+    """
+    Create a JPEG: red on the left half, blue on the right half (as stored, before the orientation is applied),
+    with an orientation, capture date and GPS co-ordinates
+    """
+    image = Image.new("RGB", size, (255, 0, 0))
+    image.paste((0, 0, 255), (size[0] // 2, 0, size[0], size[1]))
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    exif.get_ifd(0x8769)[0x9003] = "2019:07:14 10:20:30"  # DateTimeOriginal
+    gps_ifd = exif.get_ifd(0x8825)
+    gps_ifd[1] = "N"
+    gps_ifd[2] = (50.0, 49.0, 8.59)
+    gps_ifd[3] = "W"
+    gps_ifd[4] = (0.0, 8.0, 12.45)
+    image.save(filename, exif=exif, quality=95)
+
+
+def test_parse():
+    assert parse_aspect("16:9") == pytest.approx(16 / 9)
+    assert parse_aspect("1.5") == 1.5
+    assert parse_size("800x480") == (800, 480)
+    with pytest.raises(ValueError):
+        parse_aspect("16:0")
+    with pytest.raises(ValueError):
+        parse_size("800")
+
+
+def test_crop_box():
+    assert get_crop_box(400, 300, 1) == (50, 0, 350, 300)
+    assert get_crop_box(300, 400, 1) == (0, 50, 300, 350)
+    assert get_crop_box(1600, 900, 16 / 9) == (0, 0, 1600, 900)
+
+
+def test_convert_photo(tmp_path):
+    """
+    Test the photo is rotated upright, cropped in the centre, scaled down and keeps its EXIF tags
+    """
+    source, target = str(tmp_path / "photo.jpg"), str(tmp_path / "out.jpg")
+    _create_photo(source, (1200, 800), orientation=6)  # rotated 90° clockwise when displayed
+
+    convert_photo(source, target, size=(240, 400))
+    with Image.open(target) as image:
+        assert image.size == (240, 400)
+        # the left half (red) of the stored photo is at the top once rotated
+        assert image.getpixel((120, 10))[0] > 200
+        assert image.getpixel((120, 390))[2] > 200
+        assert image.getexif().get(0x0112, 1) == 1
+
+    exif = read_exif(target)
+    assert exif.date == "2019:07:14 10:20:30"
+    assert exif.gps == (50.0, 49.0, 8.59, "N", 0.0, 8.0, 12.45, "W")
+    assert sorted(os.listdir(tmp_path)) == ["out.jpg", "photo.jpg"]  # no temporary file left
+
+
+def test_convert_no_upscale(tmp_path):
+    """
+    Test a photo smaller than the frame is cropped but not scaled up
+    """
+    source, target = str(tmp_path / "photo.jpg"), str(tmp_path / "out.jpg")
+    _create_photo(source, (300, 300))
+
+    convert_photo(source, target, aspect=parse_aspect("16:9"))
+    with Image.open(target) as image:
+        assert image.size == (300, 169)
+
+    convert_photo(source, target, size=(800, 480))
+    with Image.open(target) as image:
+        assert image.size == (300, 180)
+
+
+def test_render_profiles(tmp_path):
+    """
+    Test a photo is prepared for several frames at once, and only for the frames with the same orientation
+    """
+    source = str(tmp_path / "photo.jpg")
+    _create_photo(source, (1200, 800))
+    landscape = create_frame_profile("landscape", str(tmp_path), size=(800, 480), orientation="landscape")
+    square = create_frame_profile("square", str(tmp_path), aspect=1, size=(100, 100))
+    portrait = create_frame_profile("portrait", str(tmp_path), size=(480, 800), orientation="portrait")
+
+    renders = [(landscape, str(tmp_path / "landscape.jpg")), (square, str(tmp_path / "square.jpg")),
+               (portrait, str(tmp_path / "portrait.jpg"))]
+    assert render_photo(source, renders) == [str(tmp_path / "landscape.jpg"), str(tmp_path / "square.jpg")]
+    with Image.open(str(tmp_path / "landscape.jpg")) as image:
+        assert image.size == (800, 480)
+    with Image.open(str(tmp_path / "square.jpg")) as image:
+        assert image.size == (100, 100)
+    assert not (tmp_path / "portrait.jpg").exists()
+
+
+def test_render_square(tmp_path):
+    """
+    Test a square photo is prepared for the portrait frames, as it is downloaded for them (see IcloudPhotos)
+    """
+    source = str(tmp_path / "photo.jpg")
+    _create_photo(source, (600, 600))
+    landscape = create_frame_profile("landscape", str(tmp_path), size=(800, 480), orientation="landscape")
+    portrait = create_frame_profile("portrait", str(tmp_path), size=(480, 800), orientation="portrait")
+
+    renders = [(landscape, str(tmp_path / "landscape.jpg")), (portrait, str(tmp_path / "portrait.jpg"))]
+    assert render_photo(source, renders) == [str(tmp_path / "portrait.jpg")]
+    with Image.open(str(tmp_path / "portrait.jpg")) as image:
+        assert image.size == (360, 600)
+    assert not (tmp_path / "landscape.jpg").exists()
+
+
+def test_frame_profiles(tmp_path):
+    config_file = tmp_path / "config.yml"
+    config_file.write_text("""
+profiles:
+    nixplay:
+        output: media/nixplay
+        aspect: "16:9"
+        orientation: landscape
+    pi:
+        output: media/photos
+        size: 480x800
+""")
+    config = Config(str(config_file))
+
+    nixplay, pi = get_frame_profiles(config)
+    assert nixplay == FrameProfile("nixplay", "media/nixplay", pytest.approx(16 / 9), None, "landscape")
+    assert pi == FrameProfile("pi", "media/photos", 0.6, (480, 800), None)
+    assert get_frame_profiles(config, ["pi"]) == [pi]
+    assert get_download_orientation([nixplay]) == "landscape"
+    assert get_download_orientation([nixplay, pi]) is None
+    with pytest.raises(KeyError):
+        get_frame_profiles(config, ["unknown"])
+
+    # YAML reads an unquoted 16:9 as a number
+    config_file.write_text("profiles:\n    nixplay:\n        output: media\n        aspect: 16:9\n")
+    with pytest.raises(ValueError):
+        get_frame_profiles(Config(str(config_file)))
+
+
+def test_convert_photos(tmp_path):
+    """
+    Test the photos not converted yet are converted on a process pool, and errors are reported for each photo
+    """
+    source_folder, target_folder, small_folder = tmp_path / "raw", tmp_path / "out", tmp_path / "small"
+    for folder in (source_folder, target_folder, small_folder):
+        folder.mkdir()
+    _create_photo(str(source_folder / "IMG 1.JPG"), (400, 300))
+    _create_photo(str(source_folder / "IMG_2.JPG"), (400, 300))
+    (source_folder / "broken.JPG").write_bytes(b"not a photo")
+    (source_folder / ".sync_manifest.db").write_bytes(b"")
+    profiles = [create_frame_profile("frame", str(target_folder), size=(200, 100)),
+                create_frame_profile("small", str(small_folder), size=(20, 10))]
+
+    conversions = get_conversions(str(source_folder), profiles[:1])
+    assert [os.path.basename(target) for source, renders in conversions for profile, target in renders] == \
+        ["IMG_1.JPG.jpg", "IMG_2.JPG.jpg", "broken.JPG.jpg"]
+
+    results = convert_photos(conversions, workers=2)
+    assert [result.error is None for result in results] == [True, True, False]
+    assert all(result.seconds >= 0 for result in results)
+    assert sorted(os.listdir(target_folder)) == ["IMG_1.JPG.jpg", "IMG_2.JPG.jpg"]
+
+    # converted photos are skipped, unless the photo has changed since (or is needed for another frame)
+    assert [(os.path.basename(source), [profile.name for profile, target in renders])
+            for source, renders in get_conversions(str(source_folder), profiles)] == \
+        [("IMG 1.JPG", ["small"]), ("IMG_2.JPG", ["small"]), ("broken.JPG", ["frame", "small"])]
+    converted = os.stat(str(target_folder / "IMG_2.JPG.jpg")).st_mtime
+    os.utime(str(source_folder / "IMG_2.JPG"), (converted + 10, converted + 10))
+    assert [os.path.basename(source) for source, renders in get_conversions(str(source_folder), profiles[:1])] \
+        == ["IMG_2.JPG", "broken.JPG"]
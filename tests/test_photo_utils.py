@@ -1,3 +1,5 @@
+import random
+
 import pytest
 
 from utils import photo_utils as pu
@@ -94,3 +96,64 @@ def test_no_exif_orientation():
 def test_exif_orientation():
     # TODO unit test for EXIF orientation
     pass
+
+
+def test_gps_dms_to_dd_array():
+    """
+    Batch GPS conversion gives the same results as converting each location (gps_dms_to_dd rounds the minutes and
+    seconds to 6 decimal places, so allow ~1 mm)
+    """
+    rng = random.Random(42)
+    gps_values = [(rng.randint(0, 89), rng.randint(0, 59), rng.uniform(0, 60), rng.choice("NS"),
+                   rng.randint(0, 179), rng.uniform(0, 60), rng.uniform(0, 60), rng.choice("EW"))
+                  for _ in range(1000)]
+    gps_values.append((50.0, 49.0, 8.59, "N", 0.0, 8.0, 12.45, "W"))
+
+    latitudes, longitudes = pu.gps_dms_to_dd_array(gps_values)
+    for gps, latitude, longitude in zip(gps_values, latitudes, longitudes):
+        expected_latitude, expected_longitude, _altitude = pu.gps_dms_to_dd(*gps)
+        assert latitude == pytest.approx(expected_latitude, abs=1e-8)
+        assert longitude == pytest.approx(expected_longitude, abs=1e-8)
+
+
+def test_gps_dms_to_dd_array_empty():
+    latitudes, longitudes = pu.gps_dms_to_dd_array([])
+    assert len(latitudes) == len(longitudes) == 0
+
+
+def test_dms_to_dd_array_rationals():
+    """
+    Angles can be given as EXIF rationals (numerator, denominator). A zero denominator is read as 0
+    """
+    dms = [[(50, 1), (49, 1), (859, 100)], [(0, 1), (8, 1), (249, 20)], [(10, 1), (30, 0), (0, 1)]]
+    degrees = pu.dms_to_dd_array(dms, ["E", "W", "e"], "W")
+    assert degrees == pytest.approx([50.8190527, -0.1367917, 10.0], abs=1e-6)
+
+
+def test_stream_sample():
+    """
+    Test sampling a stream reads it once and returns n items (or all of them if there are not enough)
+    """
+    photos = iter(range(1000))
+    sample = pu.get_stream_sample(photos, 5)
+    assert len(set(sample)) == 5
+    assert all(0 <= photo < 1000 for photo in sample)
+    assert next(photos, None) is None
+
+    assert sorted(pu.get_stream_sample(iter(range(3)), 5)) == [0, 1, 2]
+    assert pu.get_stream_sample(iter(range(3)), 0) == []
+    assert pu.get_stream_sample(iter(range(3)), -1) == []
+
+
+def test_stream_sample_uniform():
+    """
+    Test every item has the same chance of being sampled
+    """
+    rng = random.Random(7)
+    counts = [0] * 10
+    for _ in range(20000):
+        for photo in pu.get_stream_sample(range(10), 3, rng):
+            counts[photo] += 1
+
+    # each item is expected 20000 * 3 / 10 = 6000 times
+    assert all(5700 < count < 6300 for count in counts)
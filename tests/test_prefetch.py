@@ -0,0 +1,90 @@
+from PyQt5.QtGui import QImage
+
+from gui.image_loader import RenderSettings
+from gui.photo_app import PhotoFrame
+from gui.prefetch import PhotoPrefetcher
+from utils.config import Config
+
+
+def _create_player(config_filename):
+    frame = PhotoFrame(Config(config_filename))
+    frame.setup()
+    frame.start()
+    return frame, frame.get_current_player()
+
+
+def test_prefetch_next_photos():
+    """
+    Test that the next photos in the playlist are prepared in the background
+    """
+    frame, player = _create_player("tests/test_navigation.yml")
+    depth = player._prefetcher.depth
+    assert depth > 0
+
+    upcoming = [player.get_playlist()[i] for i in player.get_upcoming_indices(depth)]
+    assert player._prefetcher.get_pending() == upcoming
+
+    # the prefetched photo is used when moving to the next photo
+    photo = player._prefetcher.take(upcoming[0], frame.get_render_settings())
+    assert photo.compatible
+    assert photo.image.width() <= frame.frame_size.width()
+    assert photo.image.height() <= frame.frame_size.height()
+
+
+def test_prepared_copy_orientation():
+    """
+    Test that a copy prepared for the frame is only used if the photo matches the frame orientation
+    """
+    frame, player = _create_player("tests/test_navigation.yml")
+    photo = player.get_playlist()[0]  # landscape
+    landscape = RenderSettings(frame.frame_size.width(), frame.frame_size.height(), 0, False)
+    portrait = RenderSettings(frame.frame_size.width(), frame.frame_size.height(), 90, True)
+    for settings in (landscape, portrait):
+        frame.derivative_store.save(photo, settings, QImage(40, 20, QImage.Format_RGB32))
+
+    prepared = player._load_photo(photo, landscape)
+    assert prepared.compatible and prepared.image.width() == 40  # the copy
+    prepared = player._load_photo(photo, portrait)
+    assert not prepared.compatible and prepared.image is None
+
+
+def test_prefetch_shuffle_order():
+    """
+    Test that in shuffle mode the photos are shown in the order they were prefetched
+    """
+    _frame, player = _create_player("tests/test_navigation_shuffle.yml")
+
+    for _ in range(10):
+        expected = player.get_upcoming_indices(3)
+        player.next()
+        assert player.current_media_index == expected[0]
+
+
+def test_prefetch_settings_changed():
+    """
+    Test that prefetched photos are discarded if the frame is rotated
+    """
+    loaded = []
+
+    def loader(filename, settings):
+        loaded.append((filename, settings))
+        return filename
+
+    prefetcher = PhotoPrefetcher(loader, 2, workers=1)
+    landscape = RenderSettings(800, 480, 0, False)
+    portrait = RenderSettings(800, 480, 90, True)
+
+    prefetcher.schedule(["a", "b", "c"], landscape)
+    assert prefetcher.get_pending() == ["a", "b"]
+
+    # wrong settings - ignore prefetched photo
+    assert prefetcher.take("a", portrait) is None
+
+    prefetcher.schedule(["a", "b"], portrait)
+    assert prefetcher.take("a", portrait) == "a"
+    assert prefetcher.take("a", portrait) is None  # can only be taken once
+    assert ("a", portrait) in loaded
+
+    prefetcher.cancel()
+    assert not prefetcher.get_pending()
+    prefetcher.shutdown()
@@ -0,0 +1,71 @@
+import random
+
+from utils.shuffle import ShuffleEngine, PersistentShuffleEngine
+
+
+def test_no_repeats():
+    """
+    Test every ID is played exactly once per cycle
+    """
+    engine = ShuffleEngine(range(20), rng=random.Random(1))
+    for _ in range(3):
+        cycle = [engine.next() for _ in range(20)]
+        assert sorted(cycle) == list(range(20))
+
+
+def test_peek():
+    """
+    Test peeked IDs are the next ones played
+    """
+    engine = ShuffleEngine(range(10), rng=random.Random(2))
+    engine.next()
+    upcoming = engine.peek(3)
+    assert [engine.next() for _ in range(3)] == upcoming
+
+
+def test_add_remove_during_cycle():
+    """
+    Test IDs can be added/removed during a cycle, without repeats or losing the rest of the cycle
+    """
+    engine = ShuffleEngine(range(10), rng=random.Random(3))
+    played = [engine.next() for _ in range(4)]
+    upcoming = engine.peek(2)
+
+    engine.remove(played[0])  # already played
+    engine.remove(upcoming[1])  # chosen in advance
+    engine.add(10)
+    assert engine.get_cursor() == 3
+    assert engine.peek(1) == upcoming[:1]
+
+    rest = [engine.next() for _ in range(len(engine) - engine.get_cursor())]
+    assert sorted(played[1:] + rest) == sorted(set(range(11)) - {played[0], upcoming[1]})
+
+
+def test_sync():
+    engine = ShuffleEngine(range(5))
+    engine.sync([3, 4, 5, 6])
+    assert sorted(engine.peek(10)) == [3, 4, 5, 6]
+
+
+def test_persistent_state(tmp_path):
+    """
+    Test a restart resumes the same cycle, even if the IDs have changed
+    """
+    filename = str(tmp_path / "shuffle.json")
+    paths = ["a", "b", "c", "d", "e"]
+
+    engine = PersistentShuffleEngine(filename, lambda i: paths[i], paths.index, rng=random.Random(4))
+    engine.sync(range(5))
+    played = [engine.next() for _ in range(2)]
+    upcoming = engine.peek(3)
+    engine.flush()
+
+    # after restart, the IDs are in reverse order
+    new_paths = list(reversed(paths))
+    restored = PersistentShuffleEngine(filename, lambda i: new_paths[i], new_paths.index)
+    restored.sync(range(5))
+    assert restored.get_cursor() == 2
+    # played IDs are not repeated in this cycle
+    rest = restored.peek(len(restored) - restored.get_cursor())
+    assert not {paths[i] for i in played} & {new_paths[i] for i in rest}
+    assert [new_paths[restored.next()] for _ in range(3)] == [paths[i] for i in upcoming]
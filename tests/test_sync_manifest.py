@@ -0,0 +1,111 @@
+import pytest
+
+from network.sync_manifest import SyncedAsset, SyncManifest, get_part_path
+
+
+def _add_photo(manifest, tmp_path, asset_id, data, last_seen, complete=True):
+    path = str(tmp_path / (asset_id + ".jpg"))
+    with open(path if complete else get_part_path(path), "wb") as f:
+        f.write(data)
+    manifest.put(SyncedAsset(asset_id, path, len(data), "checksum", last_seen, complete))
+    return path
+
+
+def test_is_synced(tmp_path):
+    manifest = SyncManifest(":memory:")
+    path = _add_photo(manifest, tmp_path, "a", b"photo", 100)
+
+    assert manifest.is_synced("a", path, 5, "checksum")
+    assert not manifest.is_synced("a", path, 5, "new checksum")
+    assert not manifest.is_synced("a", path, 6, "checksum")
+    assert not manifest.is_synced("b", path, 5, "checksum")
+
+    # changed on disk
+    with open(path, "ab") as f:
+        f.write(b"!")
+    assert not manifest.is_synced("a", path, 5, "checksum")
+
+
+def test_partial_download_not_synced(tmp_path):
+    manifest = SyncManifest(":memory:")
+    path = _add_photo(manifest, tmp_path, "a", b"pho", 100, complete=False)
+    assert not manifest.is_synced("a", path, 3, "checksum")
+    assert manifest.get_stats() == (0, 0)
+
+
+def test_prune(tmp_path):
+    """
+    Test photos not seen in the album are deleted, with any part file
+    """
+    manifest = SyncManifest(":memory:")
+    _add_photo(manifest, tmp_path, "kept", b"photo", 100)
+    _add_photo(manifest, tmp_path, "removed", b"photo", 100)
+    _add_photo(manifest, tmp_path, "partial", b"pho", 100, complete=False)
+
+    manifest.mark_seen("album", ["kept", "removed", "partial"], 100)
+    manifest.mark_seen("album", ["kept", "unknown"], 200)
+    assert manifest.prune("album", 200) == 2
+
+    assert manifest.get("kept").last_seen == 200
+    assert manifest.get("removed") is None and manifest.get("partial") is None
+    assert [p.name for p in tmp_path.iterdir()] == ["kept.jpg"]
+
+
+def test_path_used_once(tmp_path):
+    """
+    Test a path cannot be recorded for two photos
+    """
+    manifest = SyncManifest(":memory:")
+    path = _add_photo(manifest, tmp_path, "a", b"photo", 100)
+
+    assert manifest.is_path_used(path, "b")
+    assert not manifest.is_path_used(path, "a")
+    with pytest.raises(ValueError):
+        manifest.put(SyncedAsset("b", path, 5, "checksum", 100, True))
+
+
+def test_prune_converted(tmp_path):
+    """
+    Test the copies of a removed photo converted for the frames are deleted too
+    """
+    manifest = SyncManifest(":memory:")
+    frame = tmp_path / "frame"
+    frame.mkdir()
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    _add_photo(manifest, raw, "removed", b"photo", 100)
+    (frame / "removed.jpg.jpg").write_bytes(b"converted")
+    (frame / "other.jpg.jpg").write_bytes(b"converted")
+
+    manifest.mark_seen("album", ["removed"], 100)
+    assert manifest.prune("album", 200, [str(frame)]) == 1
+    assert [p.name for p in frame.iterdir()] == ["other.jpg.jpg"]
+
+
+def test_prune_shared_folder(tmp_path):
+    """
+    Test photos synced to the same folder from another album (or for another orientation) are not deleted, and a
+    photo is only deleted once it is in none of the albums
+    """
+    manifest = SyncManifest(":memory:")
+    for asset_id in ("landscape", "portrait", "other album", "both albums"):
+        _add_photo(manifest, tmp_path, asset_id, b"photo", 100)
+    manifest.mark_seen("album", ["landscape", "portrait", "both albums"], 100)
+    manifest.mark_seen("other", ["other album", "both albums"], 100)
+    never_seen = _add_photo(manifest, tmp_path, "never seen", b"photo", 100)
+
+    # the portrait photos are downloaded by another sync, but the album is listed whatever the orientation
+    manifest.mark_seen("album", ["landscape", "portrait", "both albums"], 200)
+    assert manifest.prune("album", 200) == 0
+
+    # removed from the album, but still in the other album
+    manifest.mark_seen("album", ["landscape", "portrait"], 300)
+    assert manifest.prune("album", 300) == 0
+    assert manifest.get("both albums") is not None
+
+    manifest.mark_seen("other", ["other album"], 400)
+    assert manifest.prune("other", 400) == 1
+    assert manifest.get("both albums") is None
+    assert sorted(p.name for p in tmp_path.iterdir()) == \
+        ["landscape.jpg", "never seen.jpg", "other album.jpg", "portrait.jpg"]
+    assert manifest.get("never seen").path == never_seen
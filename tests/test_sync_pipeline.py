@@ -0,0 +1,165 @@
+import _thread
+import io
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from PIL import Image
+
+from network.sync_manifest import SyncManifest
+from network.sync_pipeline import SyncPipeline
+from tests.test_icloud import StreamedPhoto, photo_server  # noqa: F401 (fixture)
+from utils.photo_convert import create_frame_profile
+
+
+def _create_jpeg(i):
+    data = io.BytesIO()
+    Image.new("RGB", (200, 100), (i, 0, 0)).save(data, "JPEG")
+    return data.getvalue()
+
+
+def _create_photos(server, count):
+    return [StreamedPhoto(server, "photo%d.jpg" % i, _create_jpeg(i)) for i in range(count)]
+
+
+def test_sync(photo_server, tmp_path):
+    """
+    Test photos are downloaded and converted, and are not downloaded or converted again by the next sync
+    """
+    photos = _create_photos(photo_server, 5)
+    profile = create_frame_profile("frame", str(tmp_path / "frame"), size=(100, 100))
+    portrait = create_frame_profile("portrait", str(tmp_path / "portrait"), size=(50, 100), orientation="portrait")
+    manifest = SyncManifest(str(tmp_path / "raw" / ".sync_manifest.db"))
+    pipeline = SyncPipeline(str(tmp_path / "raw"), [profile, portrait], manifest, convert_workers=2, queue_size=2)
+
+    result = pipeline.run(photos, len(photos))
+    assert (result.photos, result.converted, result.failed_downloads, result.failed_conversions) == (5, 5, [], [])
+    assert sorted(os.listdir(profile.output)) == ["photo%d.jpg.jpg" % i for i in range(5)]
+    assert os.listdir(portrait.output) == []  # the photos are landscape
+    with Image.open(os.path.join(profile.output, "photo0.jpg.jpg")) as image:
+        assert image.size == (100, 100)
+
+    photo_server.requests.clear()
+    result = pipeline.run(photos, len(photos))
+    assert (result.photos, result.downloaded, result.converted) == (5, 0, 0)
+    assert photo_server.requests == []
+
+
+def test_sync_errors(photo_server, tmp_path):
+    """
+    Test photos that cannot be downloaded or converted are reported, while the others are synced
+    """
+    no_link = StreamedPhoto(photo_server, "no_link.jpg", b"photo")
+    del no_link._master_record["fields"]["resOriginalRes"], no_link._asset_record["fields"]["resJPEGFullRes"]
+    photos = _create_photos(photo_server, 2) + [StreamedPhoto(photo_server, "missing.jpg"),
+                                                StreamedPhoto(photo_server, "broken.jpg", b"not a photo"), no_link]
+    profile = create_frame_profile("frame", str(tmp_path / "frame"), size=(100, 100))
+
+    result = SyncPipeline(str(tmp_path / "raw"), [profile], download_workers=1, convert_workers=1).run(photos)
+    assert result.photos == 5
+    assert result.failed_downloads == [photos[2], no_link]
+    assert [os.path.basename(failed.source) for failed in result.failed_conversions] == ["broken.jpg"]
+    assert sorted(os.listdir(profile.output)) == ["photo0.jpg.jpg", "photo1.jpg.jpg"]
+
+
+def test_sync_lookup(photo_server, tmp_path):
+    """
+    Test the photos are looked up in batches as they go, and a look up error stops the sync
+    """
+    photos = _create_photos(photo_server, 3)
+    batches = []
+
+    def lookup(batch):
+        batches.append(len(batch))
+        return batch[1:]
+
+    result = SyncPipeline(str(tmp_path), lookup=lookup).run(photos)
+    assert batches == [3]
+    assert result.photos == 2
+    assert sorted(os.listdir(str(tmp_path))) == ["photo1.jpg", "photo2.jpg"]
+
+    def broken_lookup(batch):
+        raise ConnectionError("no network")
+
+    with pytest.raises(ConnectionError):
+        SyncPipeline(str(tmp_path), lookup=broken_lookup).run(photos)
+
+
+def test_sync_broken_pool(photo_server, tmp_path, monkeypatch):
+    """
+    Test the sync stops (instead of waiting forever) if the photos cannot be sent to the pool of processes
+    """
+    def submit(*args, **kwargs):
+        raise BrokenProcessPool("a process was killed")
+
+    monkeypatch.setattr(ProcessPoolExecutor, "submit", submit)
+    pipeline = SyncPipeline(str(tmp_path / "raw"), [create_frame_profile("frame", str(tmp_path / "frame"),
+                                                                          size=(100, 100))], queue_size=1)
+    with pytest.raises(BrokenProcessPool):
+        pipeline.run(_create_photos(photo_server, 10))
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith("sync-")]
+
+
+def test_sync_bounded_disk(photo_server, tmp_path):
+    """
+    Test the originals are deleted once converted, and only a few are on disk at once (depending on the queues)
+    """
+    photos = _create_photos(photo_server, 30)
+    raw_folder, profile = tmp_path / "raw", create_frame_profile("frame", str(tmp_path / "frame"), size=(100, 100))
+    raw_folder.mkdir()
+    manifest = SyncManifest(str(raw_folder / ".sync_manifest.db"))
+    pipeline = SyncPipeline(str(raw_folder), [profile], manifest, download_workers=2, convert_workers=1,
+                            queue_size=2, keep_originals=False)
+
+    most_originals = 0
+    running = True
+
+    def count_originals():
+        nonlocal most_originals
+        while running:
+            originals = [name for name in os.listdir(str(raw_folder)) if not name.startswith(".")]
+            most_originals = max(most_originals, len(originals))
+            time.sleep(0.005)
+
+    counter = threading.Thread(target=count_originals)
+    counter.start()
+    try:
+        result = pipeline.run(photos)
+    finally:
+        running = False
+        counter.join()
+
+    assert result.converted == 30
+    assert len(os.listdir(profile.output)) == 30
+    assert [name for name in os.listdir(str(raw_folder)) if not name.startswith(".")] == []
+    # downloading + waiting to be converted + being converted (+ 1 being deleted)
+    assert most_originals <= 2 + 2 + 1 + 1
+
+    # photos already converted are not downloaded again
+    photo_server.requests.clear()
+    assert pipeline.run(photos).downloaded == 0
+    assert photo_server.requests == []
+
+
+def test_sync_interrupted(photo_server, tmp_path):
+    """
+    Test an interrupted sync stops every stage straight away
+    """
+    photo_server.delay = 0.5
+    photos = _create_photos(photo_server, 20)
+    manifest = SyncManifest(str(tmp_path / ".sync_manifest.db"))
+    pipeline = SyncPipeline(str(tmp_path), [create_frame_profile("frame", str(tmp_path / "frame"), size=(10, 10))],
+                            manifest, download_workers=2, queue_size=2)
+
+    timer = threading.Timer(0.2, _thread.interrupt_main)
+    timer.start()
+    with pytest.raises(KeyboardInterrupt):
+        pipeline.run(photos)
+    timer.join()
+
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith("sync-")]
+    assert len(photo_server.requests) <= 2  # the photos waiting were not downloaded
+    assert manifest.get_stats() == (0, 0)
@@ -0,0 +1,57 @@
+from PyQt5 import QtGui
+from PyQt5.QtCore import QBuffer
+from PyQt5.QtGui import QImage
+
+from gui.tile_map import render_map
+from utils.tile_store import TileStore, get_tiles_around, get_world_pixel
+
+
+def _create_tile(colour):
+    image = QImage(256, 256, QImage.Format_RGB32)
+    image.fill(QtGui.QColor(colour))
+    buffer = QBuffer()
+    buffer.open(QBuffer.ReadWrite)
+    image.save(buffer, "PNG")
+    return bytes(buffer.data())
+
+
+def test_world_pixel():
+    assert get_world_pixel(0.0, 0.0, 0) == (128.0, 128.0)
+    x, y = get_world_pixel(50.819, -0.137, 11)
+    assert (int(x // 256), int(y // 256)) == (1023, 687)  # tile containing Brighton
+
+
+def test_tiles_around():
+    tiles = get_tiles_around(50.819, -0.137, 11, 350, 350)
+    assert len(tiles) in (4, 6, 9)
+    assert all(0 <= x < 2 ** 11 and 0 <= y < 2 ** 11 for x, y, _left, _top in tiles)
+
+    # across the date line
+    columns = {x for x, _y, _left, _top in get_tiles_around(0.0, 179.99, 3, 350, 350)}
+    assert columns == {0, 7}
+
+
+def test_put_get_tile():
+    store = TileStore(":memory:")
+    assert store.get_tile(11, 1023, 687) is None
+    store.put_tile(11, 1023, 687, b"png")
+    assert store.has_tile(11, 1023, 687)
+    assert store.get_tile(11, 1023, 687) == b"png"
+    assert store.get_stats() == (1, 3)
+
+
+def test_render_map(qapp):
+    """
+    Test the map is drawn from the stored tiles, with a marker in the centre
+    """
+    store = TileStore(":memory:")
+    assert render_map(store, 50.819, -0.137) is None  # no tiles
+
+    tile = _create_tile("green")
+    for x, y, _left, _top in get_tiles_around(50.819, -0.137, 11, 350, 350):
+        store.put_tile(11, x, y, tile)
+
+    image = render_map(store, 50.819, -0.137)
+    assert (image.width(), image.height()) == (350, 350)
+    assert image.pixelColor(10, 10) == QtGui.QColor("green")
+    assert image.pixelColor(175, 175) == QtGui.QColor(220, 30, 30)  # marker
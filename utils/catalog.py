@@ -0,0 +1,251 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from collections import namedtuple
+
+from PIL import Image
+
+from utils import photo_utils
+from utils.exif_reader import read_exif
+
+logger = logging.getLogger(__name__)
+
+# metadata of a media file
+# size and mtime are the file signature: the metadata is only valid while they match the file
+MediaInfo = namedtuple("MediaInfo", ["path", "size", "mtime", "orientation", "width", "height", "date", "latitude",
+                                     "longitude"])
+
+_COLUMNS = ", ".join(MediaInfo._fields)
+
+# increase when the way the metadata is read changes, so the catalog is rebuilt
+# 2: the EXIF orientation is read from the correct tag
+_SCHEMA_VERSION = 2
+
+_SCAN_BATCH_SIZE = 200  # files read by the background scanner before their GPS locations are converted
+
+
+def _read_file_metadata(path):
+    """
+    :return: width, height, ExifData of a media file
+    """
+    width = height = None
+    try:
+        with Image.open(path) as image:  # only the header is read
+            width, height = image.size
+    except OSError as e:
+        logger.debug("Cannot read dimensions of %s - %s", path, e)
+
+    return width, height, read_exif(path)
+
+
+def read_media_info(path, stat=None):
+    """
+    Read the metadata of a media file from disk (image header and EXIF tags)
+
+    :param path: the location of the file
+    :param stat: the os.stat of the file (if already known)
+    :return: a MediaInfo
+    :except OSError: if the file cannot be read
+    """
+    stat = stat or os.stat(path)
+    width, height, exif = _read_file_metadata(path)
+
+    latitude = longitude = None
+    if exif.gps:
+        latitude, longitude, _altitude = photo_utils.gps_dms_to_dd(*exif.gps)
+
+    return MediaInfo(path, stat.st_size, stat.st_mtime_ns, exif.orientation, width, height, exif.date, latitude,
+                     longitude)
+
+
+def read_media_infos(files):
+    """
+    Read the metadata of many media files, converting all the GPS locations in one batch
+
+    :param files: list of (path, os.stat of the file)
+    :return: list of MediaInfo (files that cannot be read are logged and skipped)
+    """
+    metadata = []
+    for path, stat in files:
+        try:
+            metadata.append((path, stat) + _read_file_metadata(path))
+        except Exception as e:  # keep going: one bad file must not stop the others
+            logger.error("Cannot read metadata of %s - %s", path, e)
+
+    try:
+        latitudes, longitudes = photo_utils.gps_dms_to_dd_array([exif.gps for *_, exif in metadata if exif.gps])
+        locations = iter(zip(latitudes.tolist(), longitudes.tolist()))
+    except Exception as e:  # e.g. a malformed GPS tag: convert the locations one file at a time
+        logger.debug("Cannot convert GPS locations in one batch - %s", e)
+        locations = None
+
+    infos = []
+    for path, stat, width, height, exif in metadata:
+        latitude = longitude = None
+        if exif.gps and locations is not None:
+            latitude, longitude = next(locations)
+        elif exif.gps:
+            try:
+                latitude, longitude, _altitude = photo_utils.gps_dms_to_dd(*exif.gps)
+            except Exception as e:  # keep going: one bad file must not stop the others
+                logger.error("Cannot read metadata of %s - %s", path, e)
+                continue
+        infos.append(MediaInfo(path, stat.st_size, stat.st_mtime_ns, exif.orientation, width, height, exif.date,
+                               latitude, longitude))
+    return infos
+
+
+class MediaCatalog:
+    """
+    SQLite catalog of media metadata (one row per file), so EXIF tags and image headers only need to be read once.
+    Files are scanned on a background thread. The catalog can be used from any thread.
+    """
+
+    def __init__(self, db_filename: str):
+        """
+        Open (or create) the catalog
+
+        :param db_filename: the location of the SQLite database (":memory:" for a temporary catalog)
+        """
+        if db_filename != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_filename)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_filename, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+                logger.info("Catalog %s is out of date. Rebuilding it", db_filename)
+                self._db.execute("DROP TABLE IF EXISTS media")
+                self._db.execute("PRAGMA user_version = %d" % _SCHEMA_VERSION)
+            self._db.execute("CREATE TABLE IF NOT EXISTS media ("
+                             "id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, size INTEGER, mtime INTEGER, "
+                             "orientation INTEGER, width INTEGER, height INTEGER, date TEXT, "
+                             "latitude REAL, longitude REAL)")
+
+        self._queue = queue.Queue()
+        self._scanner = None
+
+    def get(self, path):
+        """
+        Get the metadata of a file, if it is in the catalog and the file has not changed since it was scanned
+
+        :param path: the location of the file
+        :return: the MediaInfo or None if unknown/out-of-date
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return self._get(path, stat)
+
+    def _get(self, path, stat):
+        with self._lock:
+            row = self._db.execute("SELECT %s FROM media WHERE path = ?" % _COLUMNS, (path,)).fetchone()
+        if row is None:
+            return None
+
+        info = MediaInfo(*row)
+        if (info.size, info.mtime) != (stat.st_size, stat.st_mtime_ns):
+            return None
+        return info
+
+    def find_all(self, paths):
+        """
+        Get the catalogued metadata of many files at once. The file signatures are not checked.
+
+        :param paths: the locations of the files
+        :return: dictionary of path -> MediaInfo (files not in the catalog are missing)
+        """
+        paths = list(paths)
+        found = {}
+        with self._lock:
+            for i in range(0, len(paths), 500):  # stay below the SQLite limit on query parameters
+                chunk = paths[i:i + 500]
+                rows = self._db.execute("SELECT %s FROM media WHERE path IN (%s)" % (_COLUMNS, ",".join("?" * len(chunk))),
+                                        chunk)
+                found.update((row[0], MediaInfo(*row)) for row in rows)
+        return found
+
+    def get_or_scan(self, path):
+        """
+        Get the metadata of a file, reading it from the file if it is not (or no longer) in the catalog
+
+        :param path: the location of the file
+        :return: the MediaInfo or None if the file cannot be read
+        """
+        try:
+            stat = os.stat(path)
+            info = self._get(path, stat)
+            if info is None:
+                info = read_media_info(path, stat)
+                self.put(info)
+            return info
+        except Exception as e:  # e.g. malformed EXIF tags: the file is shown without its metadata
+            logger.error("Cannot read metadata of %s - %s", path, e)
+            return None
+
+    def put(self, info):
+        # update in place, so a file keeps its id (no upsert: needs SQLite 3.24)
+        with self._lock, self._db:
+            cursor = self._db.execute("UPDATE media SET size = ?, mtime = ?, orientation = ?, width = ?, height = ?, "
+                                      "date = ?, latitude = ?, longitude = ? WHERE path = ?", info[1:] + info[:1])
+            if cursor.rowcount == 0:
+                self._db.execute("INSERT INTO media (%s) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)" % _COLUMNS, info)
+
+    def remove(self, path):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM media WHERE path = ?", (path,))
+
+    def get_stats(self):
+        """
+        Get a summary of the catalog
+
+        :return: number of files, number of files with GPS data
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*), COUNT(latitude) FROM media").fetchone()
+
+    def scan_in_background(self, paths):
+        """
+        Queue files to be added to the catalog by the background scanner (files already catalogued are skipped)
+
+        :param paths: the locations of the files
+        """
+        self._queue.put(list(paths))
+        if self._scanner is None:
+            self._scanner = threading.Thread(target=self._scan, name="catalog-scanner", daemon=True)
+            self._scanner.start()
+
+    def wait_for_scanner(self):
+        """
+        Block until all queued files have been scanned
+        """
+        self._queue.join()
+
+    def _scan(self):
+        while True:
+            paths = self._queue.get()
+            scanned = 0
+            try:
+                for i in range(0, len(paths), _SCAN_BATCH_SIZE):
+                    changed = []
+                    for path in paths[i:i + _SCAN_BATCH_SIZE]:
+                        try:
+                            stat = os.stat(path)
+                            if self._get(path, stat) is None:
+                                changed.append((path, stat))
+                        except Exception as e:  # keep going: one bad file must not stop the scanner
+                            logger.error("Cannot read metadata of %s - %s", path, e)
+
+                    for info in read_media_infos(changed):
+                        self.put(info)
+                        scanned += 1
+
+                logger.info("Catalog scanned %d new/changed files (%d checked)", scanned, len(paths))
+            except Exception as e:  # e.g. the catalog cannot be written: keep the scanner for the next files
+                logger.error("Error scanning files for the catalog - %s", e)
+            finally:  # wait_for_scanner must not block forever
+                self._queue.task_done()
@@ -17,7 +17,29 @@ class Config:
         "flip_rotation": False,  # rotation values are inverted to handle upside down accelerometer
         "shuffle": False,  # shuffle slideshow
         "google_maps": None,  # Google Maps API key to download map thumbnails in popup
-        "players": None  # section containing configuration of media players
+        "places_file": None,  # dataset of places for finding addresses offline (default: the bundled dataset)
+        "online_geocoder": False,  # look up addresses online (Nominatim) if they cannot be found offline
+        "popup_warmup": True,  # look up the popup information of the current/next photos in the background
+        "map_tiles": None,  # MBTiles file of map tiles for drawing maps offline (default: map_tiles.mbtiles in cache_folder)
+        "map_zoom": 11,  # zoom level of the maps in the popup
+        "geo_cache_grid": 0.01,  # photos within the same grid cell (decimal degrees) share their address and map
+        "geo_cache_mb": 50,  # maximum size (MB) of the cache of addresses and maps
+        "geo_cache_days": 90,  # time before cached addresses and maps are looked up again
+        "http_connect_timeout": 3.05,  # time (s) to wait for a connection to a web server
+        "http_read_timeout": 10,  # time (s) to wait for data from a web server
+        "http_retries": 2,  # number of times a failed download is retried
+        "http_circuit_reset": 60,  # time (s) a web server is not called after failing repeatedly
+        "pixmap_cache_mb": 64,  # memory budget (MB) for recently shown photos (0 to disable)
+        "cache_folder": None,  # folder for files generated by the frame (default: .cache under the root folder)
+        "derivative_cache": True,  # keep copies of the photos already scaled/rotated for the screen
+        "players": None,  # section containing configuration of media players
+        "prefetch": 2,  # number of upcoming photos each photo player prepares in the background
+        "history_size": 1000,  # number of visited media each player remembers for going back
+        "profiles": None,  # section containing the frame profiles the downloader prepares photos for
+        "output": None,  # folder to save the photos prepared for a frame profile
+        "aspect": None,  # aspect ratio of a frame profile e.g. "16:9" (default: from the size)
+        "size": None,  # resolution of a frame profile e.g. 800x480 (default: photos are not scaled down)
+        "orientation": None  # orientation of the photos for a frame profile (portrait | landscape)
     }
 
     def __init__(self, filename: str):
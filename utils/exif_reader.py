@@ -0,0 +1,212 @@
+import logging
+import struct
+from collections import namedtuple
+
+import exifread
+
+from utils import photo_utils
+
+logger = logging.getLogger(__name__)
+
+# the EXIF tags used by the frame
+# orientation is None for mirrored photos (only rotations are supported, see photo_utils.get_exif_rotation_angle)
+# gps is a tuple of lat_d, lat_m, lat_s, lat_ref, long_d, long_m, long_s, long_ref (as photo_utils.get_exif_gps_dms)
+ExifData = namedtuple("ExifData", ["orientation", "date", "gps"])
+
+NO_EXIF = ExifData(None, None, None)
+
+_CHUNK_SIZE = 4096
+
+_SUPPORTED_ORIENTATIONS = (1, 3, 6, 8)
+
+# TIFF tags
+_ORIENTATION = 0x0112
+_EXIF_IFD = 0x8769
+_GPS_IFD = 0x8825
+_DATE_TIME_ORIGINAL = 0x9003
+_GPS_LATITUDE_REF = 1
+_GPS_LATITUDE = 2
+_GPS_LONGITUDE_REF = 3
+_GPS_LONGITUDE = 4
+
+# TIFF field type -> size of one value (bytes)
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+
+class _UnsupportedFile(Exception):
+    pass
+
+
+class _Buffer:
+    """
+    Part of a file, read in small chunks as it is needed (the EXIF tags are normally in the first few KB)
+    """
+
+    def __init__(self, f, start, length):
+        self._f = f
+        self._start = start
+        self._length = length
+        self._data = b""
+
+    def get(self, offset, size):
+        end = offset + size
+        if offset < 0 or end > self._length:
+            raise _UnsupportedFile("offset %d beyond end of EXIF data" % end)
+        if end > len(self._data):
+            wanted = min(self._length, max(end, len(self._data) + _CHUNK_SIZE))
+            self._f.seek(self._start + len(self._data))
+            self._data += self._f.read(wanted - len(self._data))
+            if end > len(self._data):
+                raise _UnsupportedFile("file truncated")
+        return self._data[offset:end]
+
+
+def _find_jpeg_exif(f):
+    """
+    Find the EXIF data (APP1 segment) of a JPEG file
+
+    :return: start and length of the EXIF (TIFF) data or None if the file has no EXIF data
+    """
+    pos = 2
+    while True:
+        f.seek(pos)
+        header = f.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            raise _UnsupportedFile("bad JPEG marker at %d" % pos)
+
+        marker = header[1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD9, 0xDA):  # end of image/start of scan: the EXIF data would be before the image data
+            return None
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # markers without a length
+            pos += 2
+            continue
+
+        length = struct.unpack(">H", header[2:])[0]
+        if marker == 0xE1 and f.read(6) == b"Exif\0\0":
+            return pos + 10, length - 8
+        pos += 2 + length
+
+
+def _read_tiff(buffer):
+    """
+    Read the tags used by the frame from TIFF formatted EXIF data
+    """
+    byte_order = {b"II": "<", b"MM": ">"}.get(buffer.get(0, 2))
+    if byte_order is None:
+        raise _UnsupportedFile("bad TIFF header")
+    magic, ifd0_offset = struct.unpack(byte_order + "HI", buffer.get(2, 6))
+    if magic != 42:
+        raise _UnsupportedFile("bad TIFF header")
+
+    def read_ifd(offset):
+        """
+        :return: dictionary of tag -> (type, count, position of value)
+        """
+        count = struct.unpack(byte_order + "H", buffer.get(offset, 2))[0]
+        entries = {}
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            tag, field_type, value_count = struct.unpack(byte_order + "HHI", buffer.get(entry, 8))
+            size = _TYPE_SIZES.get(field_type, 1) * value_count
+            if size > 4:
+                position = struct.unpack(byte_order + "I", buffer.get(entry + 8, 4))[0]
+            else:
+                position = entry + 8  # small values are stored in the entry
+            entries[tag] = (field_type, value_count, position)
+        return entries
+
+    def get_int(entries, tag):
+        if tag not in entries:
+            return None
+        field_type, _count, position = entries[tag]
+        if field_type == 3:
+            return struct.unpack(byte_order + "H", buffer.get(position, 2))[0]
+        if field_type == 4:
+            return struct.unpack(byte_order + "I", buffer.get(position, 4))[0]
+        return None
+
+    def get_ascii(entries, tag):
+        if tag not in entries:
+            return None
+        _type, count, position = entries[tag]
+        return buffer.get(position, count).split(b"\0", 1)[0].decode("ascii", "replace").strip()
+
+    def get_rationals(entries, tag):
+        if tag not in entries:
+            return None
+        _type, count, position = entries[tag]
+        values = struct.unpack(byte_order + "%dI" % (count * 2), buffer.get(position, count * 8))
+        return [num / den if den else 0.0 for num, den in zip(values[::2], values[1::2])]
+
+    ifd0 = read_ifd(ifd0_offset)
+    orientation = get_int(ifd0, _ORIENTATION)
+
+    date = None
+    exif_offset = get_int(ifd0, _EXIF_IFD)
+    if exif_offset:
+        date = get_ascii(read_ifd(exif_offset), _DATE_TIME_ORIGINAL) or None
+
+    gps = None
+    gps_offset = get_int(ifd0, _GPS_IFD)
+    if gps_offset:
+        gps_ifd = read_ifd(gps_offset)
+        lat_ref, long_ref = get_ascii(gps_ifd, _GPS_LATITUDE_REF), get_ascii(gps_ifd, _GPS_LONGITUDE_REF)
+        lat, long = get_rationals(gps_ifd, _GPS_LATITUDE), get_rationals(gps_ifd, _GPS_LONGITUDE)
+        if lat_ref and long_ref and lat and long and len(lat) == 3 and len(long) == 3:
+            gps = (lat[0], lat[1], lat[2], lat_ref, long[0], long[1], long[2], long_ref)
+
+    return ExifData(_get_supported_orientation(orientation), date, gps)
+
+
+def _get_supported_orientation(orientation):
+    if orientation is not None and orientation not in _SUPPORTED_ORIENTATIONS:
+        logger.debug("Ignoring EXIF orientation %s", orientation)
+        return None
+    return orientation
+
+
+def read_exif_with_exifread(filename):
+    """
+    Read the EXIF tags used by the frame with exifread (slower, but supports more file types)
+
+    :param filename: the location of the photo
+    :return: ExifData
+    """
+    with open(filename, "rb") as f:
+        exif_tags = exifread.process_file(f, details=False)
+
+    orientation = exif_tags.get("Image Orientation")
+    date = exif_tags.get("EXIF DateTimeOriginal")
+    return ExifData(_get_supported_orientation(orientation.values[0] if orientation is not None else None),
+                    str(date) if date is not None else None,
+                    photo_utils.get_exif_gps_dms(exif_tags))
+
+
+def read_exif(filename):
+    """
+    Read the EXIF tags used by the frame (orientation, date taken and GPS location).
+    For JPEG and TIFF files only the tags needed are read, from the start of the file. Other files (or files that
+    cannot be parsed) are read with exifread.
+
+    :param filename: the location of the photo
+    :return: ExifData (the fields are None if the tags are missing)
+    :except OSError: if the file cannot be read
+    """
+    with open(filename, "rb") as f:
+        try:
+            signature = f.read(4)
+            if signature[:2] == b"\xff\xd8":
+                exif = _find_jpeg_exif(f)
+                if exif is None:
+                    return NO_EXIF
+                return _read_tiff(_Buffer(f, *exif))
+            if signature in (b"II*\0", b"MM\0*"):
+                f.seek(0, 2)
+                return _read_tiff(_Buffer(f, 0, f.tell()))
+        except (_UnsupportedFile, struct.error, UnicodeError) as e:
+            logger.debug("Cannot read EXIF data of %s (%s). Using exifread", filename, e)
+
+    return read_exif_with_exifread(filename)
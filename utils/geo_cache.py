@@ -0,0 +1,149 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ACCESS_RESOLUTION = 3600  # time (seconds) before reading an entry again updates its access time
+
+
+class GeoCache:
+    """
+    Persistent cache of data looked up for a GPS location (addresses, map images).
+    Locations are snapped to a grid, so photos taken close to each other (e.g. a holiday album) share the same entries.
+    Entries expire after a time-to-live and the least recently used entries are removed when the cache is too big.
+    The access times used to find the least recently used entries are only updated to the nearest access_resolution,
+    so most reads do not write to the database.
+    The cache can be used from any thread.
+    """
+
+    def __init__(self, db_filename: str, grid: float = 0.01, max_bytes: int = 50 * 1024 * 1024,
+                 ttl: float = 90 * 24 * 3600, access_resolution: float = ACCESS_RESOLUTION):
+        """
+        Open (or create) the cache
+
+        :param db_filename: the location of the SQLite database (":memory:" for a temporary cache)
+        :param grid: size of the grid cells (decimal degrees, 0.01 is about 1 km)
+        :param max_bytes: maximum total size of the cached values
+        :param ttl: time (seconds) before an entry expires
+        :param access_resolution: time (seconds) before reading an entry again updates its access time
+        """
+        if db_filename != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_filename)), exist_ok=True)
+
+        self.grid = grid
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.access_resolution = access_resolution
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_filename, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS geo ("
+                             "kind TEXT NOT NULL, lat_cell INTEGER NOT NULL, long_cell INTEGER NOT NULL, "
+                             "value BLOB, size INTEGER, created REAL, accessed REAL, "
+                             "PRIMARY KEY (kind, lat_cell, long_cell))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS geo_accessed ON geo (accessed)")
+
+    def get_cell(self, latitude, longitude):
+        """
+        :return: the grid cell containing a location
+        """
+        return round(latitude / self.grid), round(longitude / self.grid)
+
+    def get(self, kind, latitude, longitude):
+        """
+        Get a cached value
+
+        :param kind: the type of data (e.g. "address")
+        :param latitude: latitude (decimal degrees)
+        :param longitude: longitude (decimal degrees)
+        :return: the value (str or bytes) or None if not cached/expired
+        """
+        key = (kind,) + self.get_cell(latitude, longitude)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created, accessed FROM geo "
+                                   "WHERE kind = ? AND lat_cell = ? AND long_cell = ?", key).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                with self._db:
+                    self._db.execute("DELETE FROM geo WHERE kind = ? AND lat_cell = ? AND long_cell = ?", key)
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            if now - row[2] >= self.access_resolution:
+                with self._db:
+                    self._db.execute("UPDATE geo SET accessed = ? WHERE kind = ? AND lat_cell = ? AND long_cell = ?",
+                                     (now,) + key)
+        self.hits += 1
+        return row[0]
+
+    def put(self, kind, latitude, longitude, value):
+        """
+        Add a value to the cache, removing the least recently used values if the cache is too big
+
+        :param kind: the type of data (e.g. "address")
+        :param latitude: latitude (decimal degrees)
+        :param longitude: longitude (decimal degrees)
+        :param value: the value (str or bytes)
+        """
+        size = len(value)
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO geo VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (kind,) + self.get_cell(latitude, longitude) + (value, size, now, now))
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM geo").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self._db.execute("SELECT kind, lat_cell, long_cell, size FROM geo ORDER BY accessed").fetchall()
+        evicted = []
+        for kind, lat_cell, long_cell, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((kind, lat_cell, long_cell))
+            total -= size
+        self._db.executemany("DELETE FROM geo WHERE kind = ? AND lat_cell = ? AND long_cell = ?", evicted)
+        logger.debug("Removed %d entries from geo cache", len(evicted))
+
+    def get_or_fetch(self, kind, latitude, longitude, fetch):
+        """
+        Get a cached value, fetching it (and adding it to the cache) if needed
+
+        :param kind: the type of data (e.g. "address")
+        :param latitude: latitude (decimal degrees)
+        :param longitude: longitude (decimal degrees)
+        :param fetch: function(latitude, longitude) returning the value, or None/empty if not found (not cached)
+        :return: the value or None
+        """
+        value = self.get(kind, latitude, longitude)
+        if value is None:
+            value = fetch(latitude, longitude)
+            if value:
+                self.put(kind, latitude, longitude, value)
+        return value
+
+    def get_stats(self):
+        """
+        Get a summary of the cache
+
+        :return: number of entries, total size of the values (bytes)
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM geo").fetchone()
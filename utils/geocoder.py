@@ -0,0 +1,197 @@
+import csv
+import gzip
+import logging
+import math
+import os
+import threading
+from array import array
+from collections import namedtuple
+
+from utils import photo_utils
+
+logger = logging.getLogger(__name__)
+
+# cities/towns with a population over 1000 and their regions, from GeoNames (https://www.geonames.org, CC BY 4.0)
+DEFAULT_PLACES_FILENAME = os.path.join(os.path.dirname(__file__), "..", "data", "places.csv.gz")
+
+EARTH_RADIUS_KM = 6371.0
+
+# a place in the dataset
+Place = namedtuple("Place", ["name", "admin1", "country_code", "latitude", "longitude"])
+
+
+def _to_xyz(latitude, longitude):
+    """
+    Convert a location to a point on the unit sphere, so straight-line distances order places the same way as
+    distances over the Earth's surface (and there is no problem at the poles or across the date line)
+    """
+    lat, long = math.radians(latitude), math.radians(longitude)
+    return math.cos(lat) * math.cos(long), math.cos(lat) * math.sin(long), math.sin(lat)
+
+
+class _KdTree:
+    """
+    Static 3-d tree over points on the unit sphere, stored implicitly in arrays: the node for the range [lo, hi)
+    is the median (lo + hi) // 2, with the points before it on one side of its splitting plane and the points after it
+    on the other side.
+    """
+
+    def __init__(self, points):
+        """
+        :param points: list of (x, y, z) tuples
+        """
+        order = list(range(len(points)))
+        self._build(points, order, 0, len(order), 0)
+
+        self.indices = array("l", order)  # position in the tree -> position in points
+        self.coords = [array("d", (points[i][axis] for i in order)) for axis in range(3)]
+
+    @staticmethod
+    def _build(points, order, lo, hi, axis):
+        # iterative, so a large dataset cannot exceed the recursion limit
+        stack = [(lo, hi, axis)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if hi - lo <= 1:
+                continue
+            order[lo:hi] = sorted(order[lo:hi], key=lambda i: points[i][axis])
+            mid = (lo + hi) // 2
+            stack.append((lo, mid, (axis + 1) % 3))
+            stack.append((mid + 1, hi, (axis + 1) % 3))
+
+    def nearest(self, point):
+        """
+        Find the point closest to a given point
+
+        :param point: (x, y, z) tuple
+        :return: position of the nearest point (in the list given to the constructor), squared distance to it
+        """
+        if not self.indices:
+            return None, math.inf
+
+        coords = self.coords
+        best = [math.inf, -1]
+
+        def search(lo, hi, axis):
+            while lo < hi:
+                mid = (lo + hi) // 2
+                dx = point[0] - coords[0][mid]
+                dy = point[1] - coords[1][mid]
+                dz = point[2] - coords[2][mid]
+                d = dx * dx + dy * dy + dz * dz
+                if d < best[0]:
+                    best[0], best[1] = d, mid
+
+                diff = point[axis] - coords[axis][mid]
+                next_axis = (axis + 1) % 3
+                if diff < 0:
+                    near, far = (lo, mid), (mid + 1, hi)
+                else:
+                    near, far = (mid + 1, hi), (lo, mid)
+
+                search(near[0], near[1], next_axis)
+                if diff * diff >= best[0]:
+                    return
+                lo, hi, axis = far[0], far[1], next_axis  # continue with the far side (no recursion needed)
+
+        search(0, len(self.indices), 0)
+        return self.indices[best[1]], best[0]
+
+
+class OfflineGeocoder:
+    """
+    Reverse geocoder using a local dataset of places, so addresses can be found without a network connection.
+    Lookups use a k-d tree and take microseconds. The dataset is loaded on the first lookup (or by calling load()).
+    """
+
+    def __init__(self, places_filename: str = DEFAULT_PLACES_FILENAME, max_distance_km: float = 100.0):
+        """
+        :param places_filename: CSV file (optionally gzipped) with columns lat, lon, name, admin1, cc
+        :param max_distance_km: places further away than this are not returned
+        """
+        self.places_filename = places_filename
+        self.max_distance_km = max_distance_km
+        self._places = None
+        self._tree = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Load the dataset and build the index (if not already done)
+
+        :return: True if the dataset is available
+        """
+        with self._lock:
+            if self._places is None:
+                self._places = []
+                try:
+                    self._places = self._read_places(self.places_filename)
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error("Cannot load places from %s - %s", self.places_filename, e)
+                self._tree = _KdTree([_to_xyz(p.latitude, p.longitude) for p in self._places])
+                logger.info("Loaded %d places for offline geocoding", len(self._places))
+        return bool(self._places)
+
+    @staticmethod
+    def _read_places(filename):
+        opener = gzip.open if filename.endswith(".gz") else open
+        with opener(filename, "rt", encoding="utf-8", newline="") as f:
+            return [Place(row["name"], row["admin1"], row["cc"], float(row["lat"]), float(row["lon"]))
+                    for row in csv.DictReader(f)]
+
+    def lookup(self, latitude, longitude):
+        """
+        Find the place nearest to a location
+
+        :param latitude: latitude (decimal degrees, -ve for S)
+        :param longitude: longitude (decimal degrees, -ve for W)
+        :return: the Place or None if there is no place within max_distance_km
+        """
+        self.load()
+        i, chord_squared = self._tree.nearest(_to_xyz(latitude, longitude))
+        if i is None:
+            return None
+
+        # convert the straight-line distance through the sphere into a distance over the surface
+        distance_km = 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_squared) / 2))
+        if distance_km > self.max_distance_km:
+            logger.debug("Nearest place to %f, %f is %.0f km away", latitude, longitude, distance_km)
+            return None
+        return self._places[i]
+
+    def get_address(self, latitude, longitude):
+        """
+        :return: the address of the place nearest to a location (e.g. "Brighton, England, GB") or "" if not found
+        """
+        place = self.lookup(latitude, longitude)
+        if place is None:
+            return ""
+        return ", ".join(part for part in (place.name, place.admin1, place.country_code) if part)
+
+
+class ReverseGeocoder:
+    """
+    Finds addresses for GPS locations with the offline geocoder, falling back to the online geocoder (Nominatim)
+    only if enabled.
+    """
+
+    def __init__(self, offline: OfflineGeocoder = None, online: bool = False, http_client=None):
+        """
+        :param offline: the offline geocoder (default: using the bundled dataset)
+        :param online: True to look up addresses online when the offline geocoder cannot find them
+        :param http_client: the HttpClient used for online lookups (default: the client shared by the frame)
+        """
+        self.offline = offline or OfflineGeocoder()
+        self.online = online
+        self.http_client = http_client
+
+    def get_address(self, latitude, longitude):
+        """
+        :param latitude: latitude (decimal degrees, -ve for S)
+        :param longitude: longitude (decimal degrees, -ve for W)
+        :return: address as a string or "" if not found
+        """
+        address = self.offline.get_address(latitude, longitude)
+        if not address and self.online:
+            address = photo_utils.get_gps_dd_location(latitude, longitude, self.http_client)
+        return address
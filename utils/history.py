@@ -0,0 +1,100 @@
+import logging
+from array import array
+
+logger = logging.getLogger(__name__)
+
+
+class BrowsingHistory:
+    """
+    Fixed-size history of visited media IDs (a ring buffer), with a cursor that can move back and forward.
+    When the history is full, the oldest entries are overwritten.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        Create an empty history
+
+        :param capacity: the maximum number of entries
+        """
+        if capacity < 1:
+            raise ValueError("History capacity must be at least 1")
+
+        self._entries = array("l", [-1] * capacity)
+        self._start = 0  # ring position of the oldest entry
+        self._count = 0  # number of entries
+        self._cursor = -1  # offset (from the oldest entry) of the current entry, -1 if before the start
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """
+        Iterate over the entries, oldest first
+        """
+        for i in range(self._count):
+            yield self._get(i)
+
+    def get_capacity(self):
+        return len(self._entries)
+
+    def _get(self, offset):
+        return self._entries[(self._start + offset) % len(self._entries)]
+
+    def current(self):
+        """
+        :return: the current entry or None if the cursor is before the start of the history
+        """
+        return self._get(self._cursor) if self._cursor >= 0 else None
+
+    def push(self, media_id: int):
+        """
+        Add an entry after the current entry and make it the current entry. Any forward entries are dropped.
+
+        :param media_id: the media ID
+        """
+        self._count = self._cursor + 1
+        if self._count == len(self._entries):
+            # full: overwrite the oldest entry
+            self._start = (self._start + 1) % len(self._entries)
+            self._count -= 1
+
+        self._entries[(self._start + self._count) % len(self._entries)] = media_id
+        self._count += 1
+        self._cursor = self._count - 1
+
+    def back(self):
+        """
+        Move the cursor to the previous entry
+
+        :return: the previous entry or None if there are no more entries
+        """
+        if self._cursor >= 0:
+            self._cursor -= 1
+        return self.current()
+
+    def has_forward(self):
+        """
+        :return: True if there are entries after the current entry (i.e. after going back)
+        """
+        return self._cursor < self._count - 1
+
+    def forward(self):
+        """
+        Move the cursor to the next entry
+
+        :return: the next entry or None if there are no more entries
+        """
+        if not self.has_forward():
+            return None
+        self._cursor += 1
+        return self.current()
+
+    def peek_forward(self, n: int):
+        """
+        Get the entries that forward() will return, without moving the cursor
+
+        :param n: the maximum number of entries
+        :return: list of entries
+        """
+        end = min(self._cursor + 1 + n, self._count)
+        return [self._get(i) for i in range(self._cursor + 1, end)]
@@ -0,0 +1,103 @@
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LruCache:
+    """
+    Least-recently-used cache bounded by the total size of its entries (in bytes) rather than the number of entries.
+    """
+
+    def __init__(self, max_bytes: int, sizeof):
+        """
+        Create an empty cache.
+
+        :param max_bytes: the memory budget of the cache (0 disables the cache)
+        :param sizeof: function returning the size (in bytes) of a cached value
+        """
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (value, size), oldest first
+        self._lock = threading.Lock()
+
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Lookup a value and mark it as recently used
+
+        :param key: the key
+        :return: the value or None if not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        Add a value, evicting the least recently used values until the cache is back within budget.
+        Values bigger than the whole budget are not cached.
+
+        :param key: the key
+        :param value: the value
+        """
+        size = self._sizeof(value)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                logger.debug("Value too big to cache (%d bytes): %s", size, key)
+                return
+
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                old_key, (_old_value, old_size) = self._entries.popitem(last=False)
+                self.current_bytes -= old_size
+                self.evictions += 1
+                logger.debug("Evicted %s from cache", old_key)
+
+    def invalidate(self, key):
+        """
+        Remove a value from the cache (if present)
+
+        :param key: the key
+        """
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get_stats(self):
+        """
+        Get a summary of the cache usage
+
+        :return: a string describing the size and hit/miss/eviction counters
+        """
+        return "%d entries, %d/%d bytes, %d hits, %d misses, %d evictions" % (
+            len(self._entries), self.current_bytes, self.max_bytes, self.hits, self.misses, self.evictions)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
@@ -0,0 +1,340 @@
+import logging
+import math
+import multiprocessing
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+from utils import photo_utils
+
+logger = logging.getLogger(__name__)
+
+try:  # HEIC/HEIF support is optional (the iCloud normally provides a JPEG version of each photo)
+    from pillow_heif import register_heif_opener
+
+    register_heif_opener()
+except ImportError:
+    register_heif_opener = None
+
+JPEG_QUALITY = 90
+
+# a photo frame to prepare photos for (see get_frame_profiles)
+# aspect is the aspect ratio (width / height), size the resolution (width, height) or None to keep the resolution of
+# the photos, orientation is portrait, landscape or None for any orientation
+FrameProfile = namedtuple("FrameProfile", ["name", "output", "aspect", "size", "orientation"])
+
+# the result of converting a photo
+# targets are the converted photos saved, seconds is the time taken, error is None if the photo was converted
+ConvertResult = namedtuple("ConvertResult", ["source", "targets", "seconds", "error"])
+
+
+def parse_aspect(aspect):
+    """
+    :param aspect: an aspect ratio as "width:height" (e.g. "16:9") or a number
+    :return: the aspect ratio (width / height)
+    :except ValueError: if the aspect ratio is not valid
+    """
+    if isinstance(aspect, str) and ":" in aspect:
+        width, height = (float(value) for value in aspect.split(":", 1))
+        ratio = width / height if height else 0
+    else:
+        ratio = float(aspect)
+    if not ratio > 0 or math.isinf(ratio):
+        raise ValueError("Invalid aspect ratio %s" % aspect)
+    return ratio
+
+
+def parse_size(size):
+    """
+    :param size: a size as "widthxheight" (e.g. "800x480")
+    :return: width, height
+    :except ValueError: if the size is not valid
+    """
+    width, height = (int(value) for value in size.lower().split("x", 1))
+    if width <= 0 or height <= 0:
+        raise ValueError("Invalid size %s" % size)
+    return width, height
+
+
+def get_crop_box(width, height, aspect):
+    """
+    Get the largest area with an aspect ratio in the centre of an image
+
+    :param width: the width of the image
+    :param height: the height of the image
+    :param aspect: the aspect ratio (width / height)
+    :return: left, top, right, bottom
+    """
+    if width / height > aspect:  # too wide
+        crop_width = max(1, round(height * aspect))
+        left = (width - crop_width) // 2
+        return left, 0, left + crop_width, height
+
+    crop_height = max(1, round(width / aspect))
+    top = (height - crop_height) // 2
+    return 0, top, width, top + crop_height
+
+
+def get_frame_profiles(config, names=None):
+    """
+    Read the frame profiles from the 'profiles' section of the config file. Each profile needs an 'output' folder and
+    an 'aspect' ratio and/or 'size' (resolution), and can have an 'orientation' (only photos with this orientation are
+    prepared for the frame)
+
+    :param config: the Config
+    :param names: the names of the profiles to read (default: all the profiles)
+    :return: list of FrameProfiles
+    :except KeyError: if a profile is missing or has no output folder
+    :except ValueError: if a profile is not valid
+    """
+    profiles_config = config.get_config_value("profiles", config.root) or {}
+    profiles = []
+    for name in names or profiles_config:
+        if name not in profiles_config:
+            raise KeyError("Could not find profile '%s' in section 'profiles' of the config file" % name)
+        profile_config = profiles_config[name] or {}
+        if not profile_config.get("output"):
+            raise KeyError("Profile '%s' has no output folder" % name)
+
+        aspect = config.get_config_value("aspect", profile_config)
+        if isinstance(aspect, int) and aspect >= 60:
+            # YAML reads an unquoted 16:9 as a number (base 60)
+            raise ValueError("Profile '%s' aspect ratio must be quoted e.g. \"16:9\"" % name)
+        size = config.get_config_value("size", profile_config)
+        profiles.append(create_frame_profile(name, profile_config["output"],
+                                             parse_aspect(str(aspect)) if aspect else None,
+                                             parse_size(str(size)) if size else None,
+                                             config.get_config_value("orientation", profile_config)))
+    return profiles
+
+
+def create_frame_profile(name, output, aspect=None, size=None, orientation=None):
+    """
+    :param name: the name of the profile
+    :param output: the folder to save the photos prepared for the frame
+    :param aspect: the aspect ratio (width / height) of the frame (default: from the size)
+    :param size: the resolution (width, height) of the frame (None to keep the resolution of the photos)
+    :param orientation: portrait, landscape or None for any orientation
+    :return: the FrameProfile
+    :except ValueError: if the orientation is not valid
+    """
+    if orientation not in (None, "portrait", "landscape"):
+        raise ValueError("Profile '%s' orientation must be one of portrait or landscape" % name)
+    if aspect is None and size is not None:
+        aspect = size[0] / size[1]
+    return FrameProfile(name, output, aspect, size, orientation)
+
+
+def get_download_orientation(profiles):
+    """
+    :return: the orientation of the photos to download for frame profiles (None if the frames need both)
+    """
+    orientations = {profile.orientation for profile in profiles}
+    return orientations.pop() if len(orientations) == 1 else None
+
+
+def _get_scaled_size(width, height, size):
+    """
+    :return: the size of an image scaled down to fit in a size (unchanged if the image already fits)
+    """
+    scale = min(size[0] / width, size[1] / height) if size else 1
+    if scale >= 1:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def render_photo(source, renders, quality=JPEG_QUALITY):
+    """
+    Prepare a photo for one or more frames: rotate it upright (EXIF orientation), then for each frame crop the centre
+    to the aspect ratio of the frame, scale it down to the frame resolution and save it as a JPEG (keeping the EXIF
+    tags, e.g. date and GPS).
+    The photo is only decoded once for all the frames, at a reduced scale if it is much larger than all of them.
+
+    :param source: the location of the photo
+    :param renders: list of (FrameProfile, target): where to save the photo for each frame (written to a temporary
+        file, then renamed). Frames with an orientation only get photos with the same orientation
+    :param quality: the JPEG quality
+    :return: list of the targets saved (i.e. not skipped because of their orientation)
+    :except OSError: if the photo cannot be read or saved
+    """
+    with Image.open(source) as image:
+        # the size once rotated upright (only the file header has been read so far)
+        oriented = image.size[::-1] if image.getexif().get(0x0112, 1) in (5, 6, 7, 8) else image.size
+        # the same orientation as the photos are downloaded for (e.g. a square photo is portrait)
+        orientation = "portrait" if photo_utils.is_portrait(*oriented) else "landscape"
+        renders = [(profile, target) for profile, target in renders
+                   if profile.orientation is None or profile.orientation == orientation]
+        if not renders:
+            return []
+
+        if image.format == "JPEG":
+            # decode at the smallest scale still larger than every frame after cropping
+            scale = 0
+            for profile, target in renders:
+                left, top, right, bottom = get_crop_box(*oriented, profile.aspect) if profile.aspect else \
+                    (0, 0, *oriented)
+                scale = max(scale, max(profile.size[0] / (right - left), profile.size[1] / (bottom - top))
+                            if profile.size else 1)
+            if scale < 1:
+                image.draft("RGB", (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+
+        photo = ImageOps.exif_transpose(image)
+        options = {key: photo.info[key] for key in ("exif", "icc_profile") if photo.info.get(key)}
+        if photo.mode != "RGB":
+            photo = photo.convert("RGB")
+
+        for profile, target in renders:
+            frame_photo = photo.crop(get_crop_box(photo.width, photo.height, profile.aspect)) if profile.aspect \
+                else photo
+            scaled_size = _get_scaled_size(frame_photo.width, frame_photo.height, profile.size)
+            if scaled_size != frame_photo.size:
+                frame_photo = frame_photo.resize(scaled_size, Image.LANCZOS, reducing_gap=3.0)
+
+            temp_target = os.path.join(os.path.dirname(target), "." + os.path.basename(target) + ".part")
+            try:
+                frame_photo.save(temp_target, "JPEG", quality=quality, **options)
+                os.replace(temp_target, target)
+            except BaseException:
+                if os.path.exists(temp_target):
+                    os.remove(temp_target)
+                raise
+    return [target for profile, target in renders]
+
+
+def convert_photo(source, target, aspect=None, size=None, quality=JPEG_QUALITY):
+    """
+    Prepare a photo for a frame (see render_photo)
+
+    :param source: the location of the photo
+    :param target: where to save the JPEG
+    :param aspect: the aspect ratio (width / height) of the frame (default: from the size, or the aspect ratio of the
+        photo if there is no size)
+    :param size: the resolution (width, height) of the frame (None to keep the resolution of the photo)
+    :param quality: the JPEG quality
+    :except OSError: if the photo cannot be read or saved
+    """
+    render_photo(source, [(create_frame_profile(None, os.path.dirname(target), aspect, size), target)], quality)
+
+
+def create_process_pool(workers):
+    """
+    Create a pool of processes to convert photos. The processes are not forked from this process while other threads
+    are running (a process forked while another thread holds a lock, e.g. while importing a module, can deadlock):
+    they are forked from a fork server or, on Python 3.6 (which cannot choose how), started straight away, so the
+    pool must be created before starting any thread
+
+    :param workers: the number of processes
+    :return: the ProcessPoolExecutor
+    """
+    if sys.version_info >= (3, 7):
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"))
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    executor.submit(int).result()  # the first job starts every process
+    return executor
+
+
+def render_photo_job(source, renders, quality=JPEG_QUALITY):
+    """
+    Prepare a photo for one or more frames (see render_photo), timing it and catching any error (e.g. to run in
+    another process)
+
+    :return: the ConvertResult
+    """
+    start = time.perf_counter()
+    try:
+        targets = render_photo(source, renders, quality)
+        error = None
+    except Exception as e:  # reported to the caller: one bad photo must not stop the others
+        targets = []
+        error = str(e) or type(e).__name__
+    return ConvertResult(source, targets, time.perf_counter() - start, error)
+
+
+def is_converted(source, target):
+    """
+    :return: True if a photo has already been converted (and has not changed since)
+    """
+    try:
+        return os.stat(target).st_mtime >= os.stat(source).st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def get_target_filename(filename):
+    """
+    :return: the name of the converted photo (as named by the earlier convert script, so photos are not duplicated)
+    """
+    return filename.replace(" ", "_") + ".jpg"
+
+
+def get_conversions(source_folder, profiles):
+    """
+    Find the photos in a folder that have not been converted yet for some frames (or have changed since)
+
+    :param source_folder: the folder of the original photos
+    :param profiles: the FrameProfiles
+    :return: list of (source, list of (FrameProfile, target))
+    """
+    conversions = []
+    with os.scandir(source_folder) as entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            renders = []
+            for profile in profiles:
+                target = os.path.join(profile.output, get_target_filename(entry.name))
+                try:
+                    if os.stat(target).st_mtime >= entry.stat().st_mtime:
+                        continue
+                except FileNotFoundError:
+                    pass
+                renders.append((profile, target))
+            if renders:
+                conversions.append((entry.path, renders))
+    return conversions
+
+
+def convert_photos(conversions, quality=JPEG_QUALITY, workers=None):
+    """
+    Convert photos for frames (see render_photo) on a pool of processes
+
+    :param conversions: list of (source, list of (FrameProfile, target)), as returned by get_conversions
+    :param quality: the JPEG quality
+    :param workers: the number of processes (default: the number of CPUs)
+    :return: list of ConvertResults (in the same order as the conversions)
+    """
+    if not conversions:
+        return []
+
+    start = time.perf_counter()
+    workers = min(workers or os.cpu_count() or 1, len(conversions))
+    with create_process_pool(workers) as executor:
+        futures = [executor.submit(render_photo_job, source, renders, quality) for source, renders in conversions]
+        results = []
+        try:
+            for future in futures:
+                result = future.result()
+                if result.error:
+                    logger.error("Error converting %s - %s", result.source, result.error)
+                else:
+                    logger.info("Converted %s to %d frames in %.0f ms", result.source, len(result.targets),
+                                result.seconds * 1000)
+                results.append(result)
+        except BaseException:  # e.g. Ctrl-C: do not start the photos still waiting
+            for future in futures:
+                future.cancel()
+            raise
+    elapsed = time.perf_counter() - start
+
+    converted = [result.seconds for result in results if not result.error]
+    if converted:
+        logger.info("Converted %d photos (%d frame photos) with %d processes in %.1f s: %.1f photos/s "
+                    "(%.0f ms/photo, slowest %.0f ms)", len(converted), sum(len(result.targets) for result in results),
+                    workers, elapsed, len(converted) / elapsed, sum(converted) * 1000 / len(converted),
+                    max(converted) * 1000)
+    return results
@@ -1,13 +1,16 @@
 import logging
 import random
 
-import exifread
-from geopy.exc import GeocoderServiceError
-from geopy.geocoders import Nominatim
+import numpy as np
+import requests
 from geopy.point import Point
 
+from network.http_client import get_default_client
+
 logger = logging.getLogger(__name__)
 
+NOMINATIM_REVERSE_URL = "https://nominatim.openstreetmap.org/reverse"
+
 
 def get_sample(photos, n):
     """
@@ -22,6 +25,72 @@ def get_sample(photos, n):
     return random.sample(photos, n)
 
 
+def get_stream_sample(photos, n, rng=random):
+    """
+    Select a random sample from a stream of network in a single pass, keeping only the sample in memory (reservoir
+    sampling). Every photo has the same chance of being selected.
+
+    :param photos: iterable of network (e.g. a generator)
+    :param n: number of network to sample
+    :param rng: the random number generator
+    :return: a random list of samples containing n items (or fewer if there are not enough network)
+    """
+    sample = []
+    if n <= 0:
+        return sample
+
+    for i, photo in enumerate(photos):
+        if i < n:
+            sample.append(photo)
+        else:
+            j = rng.randrange(i + 1)
+            if j < n:
+                sample[j] = photo
+    return sample
+
+
+def get_exif_gps_dms(exif_tags):
+    """
+    Extract the GPS co-ordinates from a set of EXIF tags
+    :param exif_tags: dictionary of EXIF tags (as returned by exifread)
+    :return: tuple of lat_d, lat_m, lat_s, lat_ref, long_d, long_m, long_s, long_ref or None if no GPS data
+    """
+    try:
+        lat_ref = str(exif_tags["GPS GPSLatitudeRef"])
+        lat = exif_tags["GPS GPSLatitude"].values
+        long_ref = str(exif_tags["GPS GPSLongitudeRef"])
+        long = exif_tags["GPS GPSLongitude"].values
+    except KeyError:
+        return None
+
+    if not all([lat, lat_ref, long, long_ref]):
+        return None
+
+    lat_d, lat_m, lat_s = (float(r.num) / r.den if r.den else 0.0 for r in lat)
+    long_d, long_m, long_s = (float(r.num) / r.den if r.den else 0.0 for r in long)
+    return lat_d, lat_m, lat_s, lat_ref, long_d, long_m, long_s, long_ref
+
+
+def get_gps_dd_location(latitude, longitude, http_client=None):
+    """
+    Lookup address for a set of GPS co-ordinates in decimal form (online, with OpenStreetMap Nominatim)
+    :param latitude: latitude (decimal degrees, -ve for S)
+    :param longitude: longitude (decimal degrees, -ve for W)
+    :param http_client: the HttpClient used (default: the client shared by the frame)
+    :return: address as a string or "" if not found/lookup error
+    """
+    logger.debug("Checking gps location: %f, %f", latitude, longitude)
+    http_client = http_client or get_default_client()
+
+    try:
+        response = http_client.get(NOMINATIM_REVERSE_URL, params={"format": "json", "lat": latitude, "lon": longitude})
+        response.raise_for_status()
+        return response.json().get("display_name", "")
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error("Error looking up address with Nominatim - %s", e)
+        return ""
+
+
 def get_gps_dms_location(lat_d, lat_m, lat_s, lat_ref, long_d, long_m, long_s, long_ref):
     """
     Lookup address for a set of GPD co-ordinates in DMS form
@@ -36,15 +105,8 @@ def get_gps_dms_location(lat_d, lat_m, lat_s, lat_ref, long_d, long_m, long_s, l
     :return: address as a string or "" if not found/lookup error
     """
     logger.debug("Checking gps location: %s", locals())
-    geolocator = Nominatim(user_agent="pi-cloud-frame")
-    location_point = Point(
-        "%d %d' %f'' %s, %d %d' %f'' %s" % (lat_d, lat_m, lat_s, lat_ref, long_d, long_m, long_s, long_ref))
-
-    try:
-        return geolocator.reverse(location_point).address
-    except GeocoderServiceError as e:
-        logger.error("Error downloading map from Google Maps API - %s", e)
-        return ""
+    latitude, longitude, _altitude = gps_dms_to_dd(lat_d, lat_m, lat_s, lat_ref, long_d, long_m, long_s, long_ref)
+    return get_gps_dd_location(latitude, longitude)
 
 
 def gps_dms_to_dd(lat_d, lat_m, lat_s, lat_ref, long_d, long_m, long_s, long_ref):
@@ -61,26 +123,55 @@ def gps_dms_to_dd(lat_d, lat_m, lat_s, lat_ref, long_d, long_m, long_s, long_ref
     :return: latitude, longitude, altitude
     """
     location_point = Point(
-        "%d %d' %f'' %s, %d %d' %f'' %s" % (lat_d, lat_m, lat_s, lat_ref, long_d, long_m, long_s, long_ref))
+        "%f %f' %f'' %s, %f %f' %f'' %s" % (lat_d, lat_m, lat_s, lat_ref, long_d, long_m, long_s, long_ref))
 
     return location_point.latitude, location_point.longitude, location_point.altitude
 
 
+def gps_dms_to_dd_array(gps_values):
+    """
+    Convert many sets of GPS co-ordinates from DMS form to decimal degrees at once (much faster than calling
+    gps_dms_to_dd for each set)
+    :param gps_values: sequence of tuples of lat_d, lat_m, lat_s, lat_ref, long_d, long_m, long_s, long_ref (as returned
+    by get_exif_gps_dms)
+    :return: latitudes, longitudes (numpy arrays of decimal degrees, -ve for S/W)
+    """
+    if not len(gps_values):
+        return np.empty(0), np.empty(0)
+
+    columns = list(zip(*gps_values))
+    latitudes = dms_to_dd_array(np.array(columns[0:3], dtype=float).T, columns[3], "S")
+    longitudes = dms_to_dd_array(np.array(columns[4:7], dtype=float).T, columns[7], "W")
+    return latitudes, longitudes
+
+
+def dms_to_dd_array(dms, refs, negative_ref):
+    """
+    Convert an array of angles from DMS form to decimal degrees
+    :param dms: array of degrees, minutes, seconds with shape (n, 3), or of EXIF rationals (numerator, denominator) with
+    shape (n, 3, 2)
+    :param refs: the reference of each angle (N/S or E/W)
+    :param negative_ref: the reference of -ve angles (S or W)
+    :return: numpy array of decimal degrees
+    """
+    dms = np.asarray(dms, dtype=float)
+    if dms.ndim == 3:
+        numerators, denominators = dms[..., 0], dms[..., 1]
+        dms = np.divide(numerators, denominators, out=np.zeros_like(numerators), where=denominators != 0)
+
+    degrees = dms @ np.array([1.0, 1 / 60, 1 / 3600])
+    signs = np.where(np.char.upper(np.asarray(refs, dtype=str)) == negative_ref, -1.0, 1.0)
+    return degrees * signs
+
+
 def get_file_exif_orientation(image_filename):
     """
     Get the EXIF orientation from a photo file
     :param image_filename: the location of the image
     :return: the value corresponding to the EXIF orientation tag (None if missing)
     """
-    with open(image_filename, 'rb') as f:
-        exif_tags = exifread.process_file(f, details=False)
-        logger.debug("EXIF data: %s", list(exif_tags.keys()))
-
-        try:
-            # TODO: use correct EXIF tag to determine orientation
-            return exif_tags["EXIF Orientation"]
-        except KeyError:
-            return None
+    from utils.exif_reader import read_exif  # the reader uses this module
+    return read_exif(image_filename).orientation
 
 
 def get_exif_rotation_angle(exif_orientation):
@@ -0,0 +1,232 @@
+import json
+import logging
+import os
+import random
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+
+class ShuffleEngine:
+    """
+    Plays a set of media IDs in a random order without repeats: every ID is played once per cycle.
+    The permutation is generated lazily (Fisher-Yates, one swap per step) and is held in compact integer arrays.
+    IDs can be added/removed at any time without reshuffling the rest of the cycle.
+
+    The order array is split into 3 regions:
+    [0, cursor) already played this cycle | [cursor, fixed) chosen in advance (see peek) | [fixed, n) not chosen yet
+    """
+
+    def __init__(self, ids=(), rng=None):
+        """
+        Create a shuffle engine
+
+        :param ids: the media IDs (non-negative integers) to shuffle
+        :param rng: random number generator (default: the random module)
+        """
+        self._rng = rng or random
+        self._order = array("l")
+        self._positions = array("l")  # media ID -> position in _order (-1 if not present)
+        self._cursor = 0
+        self._fixed = 0
+
+        for media_id in ids:
+            self.add(media_id)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, media_id):
+        return 0 <= media_id < len(self._positions) and self._positions[media_id] >= 0
+
+    def get_cursor(self):
+        """
+        :return: the number of IDs already played in the current cycle
+        """
+        return self._cursor
+
+    def add(self, media_id):
+        """
+        Add an ID to the unplayed part of the current cycle
+
+        :param media_id: the ID to add
+        """
+        if media_id in self:
+            return
+        if media_id >= len(self._positions):
+            self._positions.extend([-1] * (media_id + 1 - len(self._positions)))
+
+        self._positions[media_id] = len(self._order)
+        self._order.append(media_id)
+
+    def remove(self, media_id):
+        """
+        Remove an ID (the order of the other IDs in the cycle is not changed)
+
+        :param media_id: the ID to remove
+        """
+        if media_id not in self:
+            return
+
+        p = self._positions[media_id]
+
+        # move to the start of the chosen region
+        if p < self._cursor:
+            self._swap(p, self._cursor - 1)
+            p = self._cursor - 1
+            self._cursor -= 1
+
+        # move to the start of the unchosen region (keeping the order of the chosen IDs)
+        if p < self._fixed:
+            for i in range(p, self._fixed - 1):
+                self._order[i] = self._order[i + 1]
+                self._positions[self._order[i]] = i
+            p = self._fixed - 1
+            self._order[p] = media_id
+            self._fixed -= 1
+
+        # move to the end and drop it
+        self._swap(p, len(self._order) - 1)
+        self._order.pop()
+        self._positions[media_id] = -1
+
+    def sync(self, ids):
+        """
+        Add/remove IDs so the engine holds exactly the given IDs. The current cycle carries on.
+
+        :param ids: the media IDs
+        """
+        wanted = set(ids)
+        for media_id in [m for m in self._order if m not in wanted]:
+            self.remove(media_id)
+        for media_id in ids:
+            self.add(media_id)
+
+    def peek(self, n):
+        """
+        Choose the next IDs in advance, without playing them
+
+        :param n: the number of IDs
+        :return: list of up to n IDs (fewer if the cycle ends first)
+        """
+        self._start_new_cycle_if_done()
+        end = min(self._cursor + n, len(self._order))
+        while self._fixed < end:
+            self._swap(self._fixed, self._rng.randint(self._fixed, len(self._order) - 1))
+            self._fixed += 1
+        return list(self._order[self._cursor:end])
+
+    def next(self):
+        """
+        Play the next ID. When every ID has been played, a new cycle starts.
+
+        :return: the ID or None if there are no IDs
+        """
+        if not self._order:
+            return None
+
+        self.peek(1)
+        media_id = self._order[self._cursor]
+        self._cursor += 1
+        return media_id
+
+    def _start_new_cycle_if_done(self):
+        if self._order and self._cursor >= len(self._order):
+            logger.debug("Starting new shuffle cycle")
+            self._cursor = 0
+            self._fixed = 0
+
+    def _swap(self, i, j):
+        order, positions = self._order, self._positions
+        order[i], order[j] = order[j], order[i]
+        positions[order[i]] = i
+        positions[order[j]] = j
+
+    def save(self, filename, get_key):
+        """
+        Save the state of the cycle. IDs are stored as keys (e.g. the media filename) so they can be restored
+        after a restart, when the IDs may be different.
+
+        :param filename: the location of the state file
+        :param get_key: function mapping an ID to its persistent key
+        """
+        state = {
+            "cursor": self._cursor,
+            "fixed": self._fixed,
+            "order": [get_key(media_id) for media_id in self._order]
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_filename, filename)
+
+    def load(self, filename, get_id):
+        """
+        Restore the cycle saved by save(). Keys that no longer have an ID are dropped.
+        Call sync() afterwards to add any new IDs.
+
+        :param filename: the location of the state file
+        :param get_id: function mapping a persistent key to its ID (or None if the key is unknown)
+        :return: True if the state was restored
+        """
+        try:
+            with open(filename) as f:
+                state = json.load(f)
+            order, cursor, fixed = state["order"], int(state["cursor"]), int(state["fixed"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.info("Cannot load shuffle state %s - %s", filename, e)
+            return False
+
+        self._order = array("l")
+        self._positions = array("l")
+        self._cursor = self._fixed = 0
+        for i, key in enumerate(order):
+            media_id = get_id(key)
+            if media_id is None or media_id in self:
+                continue
+            self.add(media_id)
+            if i < cursor:
+                self._cursor += 1
+            if i < fixed:
+                self._fixed += 1
+        logger.info("Restored shuffle state from %s (%d/%d played)", filename, self._cursor, len(self._order))
+        return True
+
+
+class PersistentShuffleEngine(ShuffleEngine):
+    """
+    A shuffle engine that saves its state to a file (at most once per save_interval seconds), so a restart
+    resumes the same cycle.
+    """
+
+    def __init__(self, filename, get_key, get_id, save_interval=60, rng=None):
+        """
+        :param filename: the location of the state file
+        :param get_key: function mapping an ID to its persistent key
+        :param get_id: function mapping a persistent key to its ID (or None if the key is unknown)
+        :param save_interval: minimum time (seconds) between saves
+        """
+        super().__init__(rng=rng)
+        self._filename = filename
+        self._get_key = get_key
+        self._last_save = time.monotonic()
+        self.save_interval = save_interval
+        self.load(filename, get_id)
+
+    def next(self):
+        media_id = super().next()
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self.flush()
+        return media_id
+
+    def flush(self):
+        """
+        Save the state now
+        """
+        try:
+            self.save(self._filename, self._get_key)
+        except OSError as e:
+            logger.error("Cannot save shuffle state %s - %s", self._filename, e)
+        self._last_save = time.monotonic()
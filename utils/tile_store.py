@@ -0,0 +1,121 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256  # pixels
+
+MAX_LATITUDE = 85.0511287798  # limit of the Web Mercator projection
+
+
+def get_world_pixel(latitude, longitude, zoom):
+    """
+    Convert a location into pixel co-ordinates on the Web Mercator map of the world (as used by OpenStreetMap)
+
+    :param latitude: latitude (decimal degrees)
+    :param longitude: longitude (decimal degrees)
+    :param zoom: the zoom level
+    :return: x, y (from the top-left corner of the map at this zoom level)
+    """
+    world_size = TILE_SIZE * 2 ** zoom
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    x = (longitude + 180.0) / 360.0 * world_size
+    y = (1.0 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2.0 * world_size
+    return x, y
+
+
+def get_tiles_around(latitude, longitude, zoom, width, height):
+    """
+    Get the tiles needed to draw a map centred on a location
+
+    :param latitude: latitude (decimal degrees)
+    :param longitude: longitude (decimal degrees)
+    :param zoom: the zoom level
+    :param width: the width of the map (pixels)
+    :param height: the height of the map (pixels)
+    :return: list of (x, y, left, top): tile co-ordinates and where to draw the tile on the map
+    """
+    centre_x, centre_y = get_world_pixel(latitude, longitude, zoom)
+    left, top = centre_x - width / 2, centre_y - height / 2
+    tile_count = 2 ** zoom
+
+    tiles = []
+    for tile_y in range(math.floor(top / TILE_SIZE), math.floor((top + height - 1) / TILE_SIZE) + 1):
+        if not 0 <= tile_y < tile_count:
+            continue  # beyond the poles
+        for tile_x in range(math.floor(left / TILE_SIZE), math.floor((left + width - 1) / TILE_SIZE) + 1):
+            tiles.append((tile_x % tile_count, tile_y,  # wrap around at the date line
+                          round(tile_x * TILE_SIZE - left), round(tile_y * TILE_SIZE - top)))
+    return tiles
+
+
+class TileStore:
+    """
+    Map tiles (PNG images) stored in an MBTiles file (https://github.com/mapbox/mbtiles-spec), so maps can be
+    drawn without a network connection. Tiles are added by the seed_tiles.py command.
+    The store can be used from any thread.
+    """
+
+    def __init__(self, filename: str):
+        """
+        Open (or create) the tile store
+
+        :param filename: the location of the MBTiles file
+        """
+        if filename != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS tiles ("
+                             "zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB, "
+                             "PRIMARY KEY (zoom_level, tile_column, tile_row))")
+            self._db.execute("INSERT OR IGNORE INTO metadata VALUES ('name', 'pi-cloud-frame')")
+            self._db.execute("INSERT OR IGNORE INTO metadata VALUES ('format', 'png')")
+
+    @staticmethod
+    def _get_row(zoom, y):
+        # MBTiles numbers the rows from the bottom of the map (TMS), the tile servers from the top
+        return 2 ** zoom - 1 - y
+
+    def get_tile(self, zoom, x, y):
+        """
+        :param zoom: the zoom level
+        :param x: the tile column
+        :param y: the tile row (from the top of the map)
+        :return: the PNG data of the tile or None if it is not in the store
+        """
+        with self._lock:
+            row = self._db.execute("SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                                   (zoom, x, self._get_row(zoom, y))).fetchone()
+        return row[0] if row else None
+
+    def has_tile(self, zoom, x, y):
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                                   (zoom, x, self._get_row(zoom, y))).fetchone()
+        return row is not None
+
+    def put_tile(self, zoom, x, y, data):
+        """
+        :param zoom: the zoom level
+        :param x: the tile column
+        :param y: the tile row (from the top of the map)
+        :param data: the PNG data of the tile
+        """
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                             (zoom, x, self._get_row(zoom, y), sqlite3.Binary(data)))
+
+    def get_stats(self):
+        """
+        :return: number of tiles, total size of the tiles (bytes)
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(tile_data)), 0) FROM tiles").fetchone()